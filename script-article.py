@@ -2,12 +2,11 @@
 
 import altair as alt
 import csv
-from multiprocess import Pool
 import os
 import pandas as pd
 import subprocess
 
-from src.interfaces.script import DOMP, POTENTIAL, PROJECTION, Print
+from src.interfaces.script import BatchJob, DOMP, DOMPBatch, POTENTIAL, PROJECTION, Print
 
 PARALLELIZE = True
 
@@ -62,186 +61,161 @@ def init(domp):
   defaultView(domp)
   defaultWeights(domp)
 
-### PARALLELIZE
-class Parallelize:
-  def __init__(self, parallelize=PARALLELIZE):
-    self._parallelize = parallelize
-    self._actions = []
-    self._actionsCleanup = []
-  def add(self, action, args):
-    self._actions.append((action, args))
-  def addCleanup(self, action):
-    self._actionsCleanup.append(action)
-  def run(self):
-    tasks = []
-    for action, args in self._actions:
-      tasks += [(action, i, arg) for i, arg in enumerate(args)]
-    if self._parallelize:
-      with Pool() as pool:
-        pool.map(Parallelize.__runTask, tasks)
-    else:
-      [Parallelize.__runTask(task) for task in tasks]
-    self._actions = []
-    [action() for action in self._actionsCleanup]
-    self._actionsCleanup = []
-
-  @staticmethod
-  def __runTask(task):
-    action, i, arg = task
-    action(i, arg)
-
 ### A: OPTIMIZATION
 if CREATE_DATA:
   DOMP.about()
 
-  paralellize = Parallelize()
-  
-  def actionA(_, projection):
-    with DOMP(cleanup=False, logging=not PARALLELIZE, hideAbout=True) as domp:
-      init(domp)
-      data = domp.startData(preventSnapshots=True)
-      for i, context in enumerate(['supporting-points-forces-all', 'supporting-points-forces-all-individual', 'neighbours-land', 'graticule-land']):
-        # view settings
-        parts = []
-        if context == 'supporting-points-forces-all':
-          parts = ['supporting-points', 'forces', 'all']
-          domp.viewSupportingPoints(active=True)
-          domp.viewForces(all=True, sum=True)
-        if context == 'supporting-points-forces-all-individual':
-          parts = ['supporting-points', 'forces', 'all', 'individual']
-          domp.viewSupportingPoints(active=True)
-          domp.viewForces(all=True, sum=False)
-        if context == 'neighbours-land':
-          parts = ['neighbours', 'land']
-          domp.viewNeighbours(show=True)
-          domp.viewContinents(show=not TESTING, showStronglySimplified=TESTING)
-        if context == 'graticule-land':
-          parts = ['graticule', 'land']
-          domp.viewContinents(show=not TESTING, showStronglySimplified=TESTING)
-          domp.viewGraticule(show=True, degResolution=2)
-        # run
-        domp.limitLatForEnergy(90 if projection != PROJECTION.Mercator else 85.06)
-        domp.loadProjection(projection)
-        video = domp.startVideo()
-        if i == 0:
-          domp.startData(dataData=data)
-        domp.steps()
-        if i == 0:
-          domp.stopData(dataData=data)
-        domp.saveVideo(video, addPaths=[pathA, projection.name], addParts=parts)
-        # reset view settings
-        domp.viewSupportingPoints(active=False)
-        domp.viewNeighbours(show=False)
-        domp.viewContinents(show=False)
-        domp.viewGraticule(show=False)
-        domp.viewForces(all=False)
-      domp.saveData(data, addPaths=[pathA, projection.name], filename='domp-optimization-' + projection.name + '.csv')
+  jobs = []
+  cleanups = []
+
+  def actionA(domp, job):
+    projection = job.projection
+    init(domp)
+    data = domp.startData(preventSnapshots=True)
+    for i, context in enumerate(['supporting-points-forces-all', 'supporting-points-forces-all-individual', 'neighbours-land', 'graticule-land']):
+      # view settings
+      parts = []
+      if context == 'supporting-points-forces-all':
+        parts = ['supporting-points', 'forces', 'all']
+        domp.viewSupportingPoints(active=True)
+        domp.viewForces(all=True, sum=True)
+      if context == 'supporting-points-forces-all-individual':
+        parts = ['supporting-points', 'forces', 'all', 'individual']
+        domp.viewSupportingPoints(active=True)
+        domp.viewForces(all=True, sum=False)
+      if context == 'neighbours-land':
+        parts = ['neighbours', 'land']
+        domp.viewNeighbours(show=True)
+        domp.viewContinents(show=not TESTING, showStronglySimplified=TESTING)
+      if context == 'graticule-land':
+        parts = ['graticule', 'land']
+        domp.viewContinents(show=not TESTING, showStronglySimplified=TESTING)
+        domp.viewGraticule(show=True, degResolution=2)
+      # run
+      domp.limitLatForEnergy(90 if projection != PROJECTION.Mercator else 85.06)
+      domp.loadProjection(projection)
+      video = domp.startVideo()
+      if i == 0:
+        domp.startData(dataData=data)
+      domp.steps()
+      if i == 0:
+        domp.stopData(dataData=data)
+      domp.saveVideo(video, addPaths=[pathA, projection.name], addParts=parts)
+      # reset view settings
+      domp.viewSupportingPoints(active=False)
+      domp.viewNeighbours(show=False)
+      domp.viewContinents(show=False)
+      domp.viewGraticule(show=False)
+      domp.viewForces(all=False)
+    domp.saveData(data, addPaths=[pathA, projection.name], filename='domp-optimization-' + projection.name + '.csv')
 
   if ACTION_A:
-    paralellize.add(actionA, PROJECTION.canBeOptimizedProjections)
-    paralellize.addCleanup(lambda: DOMP.collectData(pathA + '/*/**/domp-optimization-*.csv', addPath=pathA, filename='domp-optimization.csv'))
+    jobs += [BatchJob(projection, settings={'resolution': 3}, action=actionA, streamData=False) for projection in PROJECTION.canBeOptimizedProjections]
+    cleanups.append(lambda: DOMP.collectData(pathA + '/*/**/domp-optimization-*.csv', addPath=pathA, filename='domp-optimization.csv'))
 
   ### B: COMPARISON OF PROJECTIONS
-  def actionB(i, projection):
-    with DOMP(cleanup=False, logging=not PARALLELIZE, hideAbout=True) as domp:
-      init(domp)
+  def actionB(domp, job):
+    projection = job.projection
+    isFirst = projection == PROJECTION.allProjections[0]
+    init(domp)
 
-      def _screenshot(projection, *parts):
-        for extension in ['png', 'svg']:
-          filename = domp.screenshot(addPaths=[pathB, projection.name], addParts=parts, extension=extension)
-          if extension == 'svg':
-            path, fname = os.path.split(filename)
-            subprocess.run(f'zip -9 "{fname}.zip" "{fname}" && rm "{fname}"', shell=True, cwd=path, capture_output=True)
-      
-      def _dump(data, projection, parts, initial=False):
-        potentials = [POTENTIAL.DISTANCE, POTENTIAL.AREA, POTENTIAL.TRIANGLE_ALTITUDE]
-        # data
-        domp.appendData(data, additionalData={'case': '-'.join(parts)})
-        if initial and projection.canBeOptimized:
-          # initial polygons
-          if initial:
-            domp.viewOriginalPolygons(show=True)
-            _screenshot(projection, 'initial-polygons', *parts)
-            domp.viewOriginalPolygons(show=False)
-        # supporting points
-        domp.viewSupportingPoints(active=True)
-        _screenshot(projection, 'supporting-points', *parts)
-        # supporting points with labels
-        domp.viewLabels(show=True)
-        _screenshot(projection, 'supporting-points-with-labels', *parts)
-        domp.viewLabels(show=False)
-        domp.viewSupportingPoints(active=False)
-        if projection.canBeOptimized:
-          # neighbours
-          domp.viewNeighbours(show=True)
-          _screenshot(projection, 'neighbours', *parts)
-          domp.viewNeighbours(show=False)
-          # forces
-          domp.viewForces(all=True, sum=True)
-          _screenshot(projection, 'forces', 'all', *parts)
-          domp.viewForces(all=True, sum=False)
-          _screenshot(projection, 'forces', 'all', 'individual', *parts)
-          for potential in potentials:
-            domp.viewForces(potential=potential, sum=True)
-            _screenshot(projection, 'forces', potential.lower(), *parts)
-            domp.viewForces(potential=potential, sum=False)
-            _screenshot(projection, 'forces', potential.lower(), 'individual', *parts)
-          domp.viewForces(all=False, potential=None)
-        # energies
-        domp.viewEnergy(all=True)
-        _screenshot(projection, 'energies', 'all', *parts)
+    def _screenshot(projection, *parts):
+      for extension in ['png', 'svg']:
+        filename = domp.screenshot(addPaths=[pathB, projection.name], addParts=parts, extension=extension)
+        if extension == 'svg':
+          path, fname = os.path.split(filename)
+          subprocess.run(f'zip -9 "{fname}.zip" "{fname}" && rm "{fname}"', shell=True, cwd=path, capture_output=True)
+    
+    def _dump(data, projection, parts, initial=False):
+      potentials = [POTENTIAL.DISTANCE, POTENTIAL.AREA, POTENTIAL.TRIANGLE_ALTITUDE]
+      # data
+      domp.appendData(data, additionalData={'case': '-'.join(parts)})
+      if initial and projection.canBeOptimized:
+        # initial polygons
+        if initial:
+          domp.viewOriginalPolygons(show=True)
+          _screenshot(projection, 'initial-polygons', *parts)
+          domp.viewOriginalPolygons(show=False)
+      # supporting points
+      domp.viewSupportingPoints(active=True)
+      _screenshot(projection, 'supporting-points', *parts)
+      # supporting points with labels
+      domp.viewLabels(show=True)
+      _screenshot(projection, 'supporting-points-with-labels', *parts)
+      domp.viewLabels(show=False)
+      domp.viewSupportingPoints(active=False)
+      if projection.canBeOptimized:
+        # neighbours
+        domp.viewNeighbours(show=True)
+        _screenshot(projection, 'neighbours', *parts)
+        domp.viewNeighbours(show=False)
+        # forces
+        domp.viewForces(all=True, sum=True)
+        _screenshot(projection, 'forces', 'all', *parts)
+        domp.viewForces(all=True, sum=False)
+        _screenshot(projection, 'forces', 'all', 'individual', *parts)
         for potential in potentials:
-          domp.viewEnergy(potential=potential)
-          _screenshot(projection, 'energies', potential.lower(), *parts)
-        domp.viewEnergy(all=False, potential=None)
-        # land
-        domp.viewContinents(show=True)
-        _screenshot(projection, 'land', *parts)
-        domp.viewContinents(show=False)
-        # graticule
-        domp.viewGraticule(show=True, degResolution=2)
-        _screenshot(projection, 'graticule', *parts)
-        domp.viewGraticule(show=False)
+          domp.viewForces(potential=potential, sum=True)
+          _screenshot(projection, 'forces', potential.lower(), *parts)
+          domp.viewForces(potential=potential, sum=False)
+          _screenshot(projection, 'forces', potential.lower(), 'individual', *parts)
+        domp.viewForces(all=False, potential=None)
+      # energies
+      domp.viewEnergy(all=True)
+      _screenshot(projection, 'energies', 'all', *parts)
+      for potential in potentials:
+        domp.viewEnergy(potential=potential)
+        _screenshot(projection, 'energies', potential.lower(), *parts)
+      domp.viewEnergy(all=False, potential=None)
+      # land
+      domp.viewContinents(show=True)
+      _screenshot(projection, 'land', *parts)
+      domp.viewContinents(show=False)
+      # graticule
+      domp.viewGraticule(show=True, degResolution=2)
+      _screenshot(projection, 'graticule', *parts)
+      domp.viewGraticule(show=False)
 
-      def _runComparison(part, saveWeights):
-        domp.limitLatForEnergy(90 if projection != PROJECTION.Mercator else 85.06)
-        data = domp.startData(preventSnapshots=True)
-        for considerLand in [False, True]:
-          parts = [part] + (['land'] if considerLand else [])
-          # weights
-          domp.weights(POTENTIAL.AREA, weightOceanActive=considerLand)
-          domp.weights(POTENTIAL.DISTANCE, weightOceanActive=considerLand)
-          if saveWeights:
-            domp.saveJSON(domp.weights(), addPath=pathB, addParts=parts)
-          # run
-          domp.loadProjection(projection)
-          _dump(data, projection, parts, initial=True)
-          if projection.canBeOptimized:
-            domp.steps(100)
-            _dump(data, projection, parts)
-            domp.steps()
-            _dump(data, projection, parts)
-          # reset weights
-          domp.weights(POTENTIAL.AREA, weightOceanActive=True)
-          domp.weights(POTENTIAL.DISTANCE, weightOceanActive=True)
-        domp.saveData(data, addPaths=[pathB, projection.name], filename='domp-comparison-of-projections-' + part + '.csv')
+    def _runComparison(part, saveWeights):
+      domp.limitLatForEnergy(90 if projection != PROJECTION.Mercator else 85.06)
+      data = domp.startData(preventSnapshots=True)
+      for considerLand in [False, True]:
+        parts = [part] + (['land'] if considerLand else [])
+        # weights
+        domp.weights(POTENTIAL.AREA, weightOceanActive=considerLand)
+        domp.weights(POTENTIAL.DISTANCE, weightOceanActive=considerLand)
+        if saveWeights:
+          domp.saveJSON(domp.weights(), addPath=pathB, addParts=parts)
+        # run
+        domp.loadProjection(projection)
+        _dump(data, projection, parts, initial=True)
+        if projection.canBeOptimized:
+          domp.steps(100)
+          _dump(data, projection, parts)
+          domp.steps()
+          _dump(data, projection, parts)
+        # reset weights
+        domp.weights(POTENTIAL.AREA, weightOceanActive=True)
+        domp.weights(POTENTIAL.DISTANCE, weightOceanActive=True)
+      domp.saveData(data, addPaths=[pathB, projection.name], filename='domp-comparison-of-projections-' + part + '.csv')
 
-      # defaultWeights(domp)
-      _runComparison('default', i == 0)
+    # defaultWeights(domp)
+    _runComparison('default', isFirst)
 
-      defaultWeights(domp)
-      distanceWeights(domp)
-      _runComparison('distance-1.7', i == 0)
+    defaultWeights(domp)
+    distanceWeights(domp)
+    _runComparison('distance-1.7', isFirst)
 
-      defaultWeights(domp)
-      areaWeights(domp)
-      _runComparison('area-1.7', i == 0)
+    defaultWeights(domp)
+    areaWeights(domp)
+    _runComparison('area-1.7', isFirst)
 
   if ACTION_B:
-    paralellize.add(actionB, PROJECTION.allProjections)
-    paralellize.addCleanup(lambda: DOMP.collectData(pathB + '/*/**/domp-comparison-of-projections-*.csv', addPath=pathB, filename='domp-comparison-of-projections.csv'))
+    jobs += [BatchJob(projection, settings={'resolution': 3}, action=actionB, streamData=False) for projection in PROJECTION.allProjections]
+    cleanups.append(lambda: DOMP.collectData(pathB + '/*/**/domp-comparison-of-projections-*.csv', addPath=pathB, filename='domp-comparison-of-projections.csv'))
 
-  paralellize.run()
+  DOMPBatch(parallelize=PARALLELIZE, logging=not PARALLELIZE).run(jobs)
+  [cleanup() for cleanup in cleanups]
 
 ### CREATE VISUALIZATIONS
 if CREATE_VISUALIZATION:
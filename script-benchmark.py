@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from src.common.console import Console
+from src.interfaces.benchmark import Benchmark
+
+parser = argparse.ArgumentParser(description='Benchmark the optimization of the grid')
+parser.add_argument('--resolutions', type=int, nargs='+', default=None, help=f"resolutions of the grid to benchmark (default: {' '.join(str(resolution) for resolution in Benchmark.resolutionsDefault)}, or {' '.join(str(resolution) for resolution in Benchmark.resolutionsForKernels)} when checking the kernels)")
+parser.add_argument('--potentials', nargs='+', default=None, help=f"potentials to benchmark in isolation, or {Benchmark.potentialsCombined} for all potentials combined (default: each potential and all combined)")
+parser.add_argument('--steps', type=int, default=10, help='number of steps to perform')
+parser.add_argument('--repeat', type=int, default=3, help='number of repetitions of each measurement')
+parser.add_argument('--include-grid-creation', action='store_true', help='also measure the creation of the grid by DGGRID')
+parser.add_argument('--output', default='benchmark.json', help='file to save the results to')
+parser.add_argument('--baseline', default=None, help='file with results to compare to')
+parser.add_argument('--threshold', type=float, default=.1, help='relative slowdown that is reported as a regression')
+parser.add_argument('--check-kernels', action='store_true', help='only check whether the kernels of the potentials agree with their computation cell by cell (initially and after the steps)')
+parser.add_argument('--tolerance', type=float, default=1e-9, help='relative difference up to which a kernel is considered to agree with the computation cell by cell')
+parser.add_argument('--imports', nargs='?', const='src.interfaces.script', default=None, help='only measure the import time per module of the given module (default: src.interfaces.script)')
+args = parser.parse_args()
+
+if args.imports is not None:
+  Benchmark.printImportTimes(Benchmark.importTimes(args.imports, repeat=args.repeat))
+  exit(0)
+
+if args.check_kernels:
+  checks = Benchmark(resolutions=args.resolutions or Benchmark.resolutionsForKernels, steps=args.steps).checkKernels(tolerance=args.tolerance)
+  Benchmark.printKernelChecks(checks)
+  exit(0 if all(check['agrees'] for check in checks) else 1)
+
+benchmark = Benchmark(resolutions=args.resolutions, potentialKinds=args.potentials, steps=args.steps, repeat=args.repeat, includeGridCreation=args.include_grid_creation)
+results = benchmark.run()
+Console.print(f"results saved to {benchmark.save(args.output)}")
+
+if args.baseline is None:
+  Benchmark.printResults(results)
+else:
+  comparison = Benchmark.compare(results, Benchmark.load(args.baseline)['results'], threshold=args.threshold)
+  Benchmark.printComparison(comparison)
+  if any(row['regression'] for row in comparison):
+    exit(1)
@@ -31,3 +31,4 @@ class Console:
   def clearStatus(cls):
     if cls.__statusLine is not None:
       print(cls.__strCleanIfStatus())
+      cls.__statusLine = None
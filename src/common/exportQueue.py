@@ -0,0 +1,35 @@
+import queue
+import threading
+
+class ExportQueue:
+  # runs exports (rendering and encoding) in a background thread in the order of submission, such that the optimization does not need to wait for them
+  def __init__(self, queueSize=8):
+    self.__queue = queue.Queue(maxsize=queueSize)
+    self.__exception = None
+    self.__thread = threading.Thread(target=self.__run, daemon=True)
+    self.__thread.start()
+
+  def submit(self, function):
+    # blocks if too many exports are pending (each of them holds a snapshot of the grid)
+    self.__raise()
+    self.__queue.put(function)
+
+  def flush(self):
+    # waits until all submitted exports are completed, and raises the first error that occurred
+    self.__queue.join()
+    self.__raise()
+
+  def __raise(self):
+    if self.__exception is not None:
+      exception, self.__exception = self.__exception, None
+      raise exception
+
+  def __run(self):
+    while True:
+      function = self.__queue.get()
+      try:
+        function()
+      except Exception as e:
+        self.__exception = self.__exception or e
+      finally:
+        self.__queue.task_done()
@@ -0,0 +1,187 @@
+import csv
+import json
+import os
+import threading
+import time
+
+class _NoSpan:
+  # used when the metrics are disabled, such that spans cause almost no overhead
+  def __enter__(self):
+    return self
+  def __exit__(self, *args):
+    pass
+
+_noSpan = _NoSpan()
+
+class _Span:
+  def __init__(self, metrics, label, step):
+    self.__metrics = metrics
+    self.__label = label
+    self.__step = step
+    self.__path = None
+    self.__start = None
+
+  def __enter__(self):
+    self.__path = self.__metrics._pushSpan(self.__label)
+    self.__start = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    end = time.perf_counter()
+    self.__metrics._popSpan()
+    self.__metrics._recordSpan(self.__path, self.__label, self.__step, self.__start, end)
+
+class Metrics(object):
+  # collects named spans (hierarchical, per thread) and counters; all aggregation is thread-safe
+  def __new__(cls):
+    if not hasattr(cls, 'instance'):
+      cls.instance = super(Metrics, cls).__new__(cls)
+      cls.instance.enabled = False
+      cls.instance.__keepEvents = True
+      cls.instance.__lock = threading.Lock()
+      cls.instance.__local = threading.local()
+      cls.instance.__origin = time.perf_counter()
+      cls.instance.reset()
+    return cls.instance
+
+  def enable(self, enabled=True, keepEvents=True):
+    self.enabled = enabled
+    self.__keepEvents = keepEvents
+
+  def disable(self):
+    self.enabled = False
+
+  def reset(self):
+    with self.__lock:
+      self.__spans = {}
+      self.__spansPerStep = {}
+      self.__counters = {}
+      self.__countersPerStep = {}
+      self.__events = []
+
+  ## spans
+
+  def span(self, label, step=None):
+    if not self.enabled:
+      return _noSpan
+    return _Span(self, label, step)
+
+  def _pushSpan(self, label):
+    stack = getattr(self.__local, 'stack', None)
+    if stack is None:
+      stack = self.__local.stack = []
+    stack.append(label)
+    return '/'.join(stack)
+
+  def _popSpan(self):
+    self.__local.stack.pop()
+
+  def _recordSpan(self, path, label, step, start, end):
+    duration = end - start
+    with self.__lock:
+      if path not in self.__spans:
+        self.__spans[path] = {'count': 0, 'total': 0, 'min': None, 'max': None}
+      s = self.__spans[path]
+      s['count'] += 1
+      s['total'] += duration
+      s['min'] = duration if s['min'] is None else min(s['min'], duration)
+      s['max'] = duration if s['max'] is None else max(s['max'], duration)
+      if step is not None:
+        if step not in self.__spansPerStep:
+          self.__spansPerStep[step] = {}
+        self.__spansPerStep[step][path] = self.__spansPerStep[step].get(path, 0) + duration
+      if self.__keepEvents:
+        self.__events.append((label, path, step, threading.get_ident(), start - self.__origin, duration))
+
+  ## counters
+
+  def count(self, name, n=1, step=None):
+    if not self.enabled:
+      return
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + n
+      if step is not None:
+        if step not in self.__countersPerStep:
+          self.__countersPerStep[step] = {}
+        self.__countersPerStep[step][name] = self.__countersPerStep[step].get(name, 0) + n
+
+  ## results
+
+  def spans(self):
+    with self.__lock:
+      return dict((path, {**s, 'average': s['total'] / s['count']}) for path, s in self.__spans.items())
+
+  def spansPerStep(self):
+    with self.__lock:
+      return dict((step, dict(spans)) for step, spans in self.__spansPerStep.items())
+
+  def counters(self):
+    with self.__lock:
+      return dict(self.__counters)
+
+  def countersPerStep(self):
+    with self.__lock:
+      return dict((step, dict(counters)) for step, counters in self.__countersPerStep.items())
+
+  def toJSON(self):
+    return {
+      'spans': self.spans(),
+      'spansPerStep': self.spansPerStep(),
+      'counters': self.counters(),
+      'countersPerStep': self.countersPerStep(),
+    }
+
+  ## export
+
+  def saveJSON(self, pathAndFilename):
+    Metrics.__makeDirs(pathAndFilename)
+    with open(pathAndFilename, 'w') as f:
+      json.dump(self.toJSON(), f, indent=2)
+    return pathAndFilename
+
+  def saveCSV(self, pathAndFilename):
+    # one row per span and step, and one row per counter and step (the step is empty for the total)
+    Metrics.__makeDirs(pathAndFilename)
+    with open(pathAndFilename, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(['kind', 'name', 'step', 'count', 'total', 'average', 'min', 'max'])
+      for path, s in self.spans().items():
+        writer.writerow(['span', path, '', s['count'], s['total'], s['average'], s['min'], s['max']])
+      for step, spans in self.spansPerStep().items():
+        for path, total in spans.items():
+          writer.writerow(['span', path, step, '', total, '', '', ''])
+      for name, n in self.counters().items():
+        writer.writerow(['counter', name, '', n, '', '', '', ''])
+      for step, counters in self.countersPerStep().items():
+        for name, n in counters.items():
+          writer.writerow(['counter', name, step, n, '', '', '', ''])
+    return pathAndFilename
+
+  def saveChromeTrace(self, pathAndFilename):
+    # the trace can be opened in chrome://tracing or https://ui.perfetto.dev
+    with self.__lock:
+      events = list(self.__events)
+    pid = os.getpid()
+    traceEvents = [{
+      'name': label,
+      'cat': path,
+      'ph': 'X',
+      'ts': start * 1e6,
+      'dur': duration * 1e6,
+      'pid': pid,
+      'tid': tid,
+      'args': {'step': step} if step is not None else {},
+    } for label, path, step, tid, start, duration in events]
+    for name, n in self.counters().items():
+      traceEvents.append({'name': name, 'ph': 'C', 'ts': 0, 'pid': pid, 'args': {name: n}})
+    Metrics.__makeDirs(pathAndFilename)
+    with open(pathAndFilename, 'w') as f:
+      json.dump({'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}, f)
+    return pathAndFilename
+
+  @staticmethod
+  def __makeDirs(pathAndFilename):
+    path = os.path.dirname(os.path.abspath(pathAndFilename))
+    os.makedirs(path, exist_ok=True)
+
+metrics = Metrics()
@@ -1,6 +1,8 @@
+import threading
 import time
 
 from src.common.console import Console
+from src.common.metrics import metrics
 
 class TimerConfig(object):
   def __new__(cls):
@@ -23,7 +25,8 @@ timerConfig = TimerConfig()
 
 class timer(object):
   __durationsByLabel = {}
-  
+  __lock = threading.Lock()
+
   def __init__(self, label='', log=True, forceLog=False, showAverage=100, **kwargs):
     self.__label = label
     self.__log = log and (not timerConfig.disableAllLog() or forceLog)
@@ -32,12 +35,20 @@ class timer(object):
     self.__formatKwargs = kwargs
     self.__time = None
     self.__durations = []
+    self.__span = None
 
   def __enter__(self):
+    # the duration is also recorded as a span of the metrics (if enabled)
+    self.__span = metrics.span(self.__label, step=self.__formatKwargs['step'] if 'step' in self.__formatKwargs else None) if self.__label else None
+    if self.__span is not None:
+      self.__span.__enter__()
     self.start()
 
   def __exit__(self, *args):
     duration = self.end()
+    if self.__span is not None:
+      self.__span.__exit__(*args)
+      self.__span = None
     if not self.__log or (timerConfig.disableAllLog() and not self.__forceLog) or self.__time is None or (timerConfig.filterLog() is not None and timerConfig.filterLog() not in self.__label):
       return
     label1 = ''
@@ -45,7 +56,9 @@ class timer(object):
       label1 = f"step {self.__formatKwargs['step']:>5}"
     avg = ''
     if self.__showAverage is not False:
-      avg = f", avg {sum(timer.__durationsByLabel[self.__label]) / len(timer.__durationsByLabel[self.__label]) * 10**3:8.3f} ms"
+      with timer.__lock:
+        durationsByLabel = timer.__durationsByLabel[self.__label]
+      avg = f", avg {sum(durationsByLabel) / len(durationsByLabel) * 10**3:8.3f} ms"
     Console.print(f"{label1:<10} | {self.__label:<60} {duration * 10**3:8.3f} ms{avg}")
 
   def end(self):
@@ -54,9 +67,10 @@ class timer(object):
     duration = time.time() - self.__time
     self.__durations.append(duration)
     if self.__showAverage is not False and self.__log:
-      if self.__label not in timer.__durationsByLabel:
-        timer.__durationsByLabel[self.__label] = []
-      timer.__durationsByLabel[self.__label] = timer.__durationsByLabel[self.__label][-self.__showAverage:] + [duration]
+      with timer.__lock:
+        if self.__label not in timer.__durationsByLabel:
+          timer.__durationsByLabel[self.__label] = []
+        timer.__durationsByLabel[self.__label] = timer.__durationsByLabel[self.__label][-self.__showAverage:] + [duration]
     return duration
 
   def start(self):
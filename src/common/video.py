@@ -1,4 +1,88 @@
 import os
+import queue
+import subprocess
+import threading
 
-def renderVideo(folder, fps):
-  os.system(f'ffmpeg -framerate {fps} -pattern_type glob -i "{folder}/*.png" -c:v libx264 -pix_fmt yuv420p -vf "pad=ceil(iw/2)*2:ceil(ih/2)*2" {folder}.mp4 >/dev/null 2>&1')
+class VideoSink:
+  # streams raw RGB frames to a long-lived ffmpeg process; the frames are converted and written by a background thread, such that the optimization is decoupled from the encoding
+  def __init__(self, pathAndFilename, fps=20, queueSize=32):
+    self.__pathAndFilename = pathAndFilename
+    self.__fps = fps
+    self.__queue = queue.Queue(maxsize=queueSize)
+    self.__process = None
+    self.__size = None
+    self.__lastStep = None
+    self.__countFrames = 0
+    self.__exception = None
+    self.__thread = threading.Thread(target=self.__run, daemon=True)
+    self.__thread.start()
+
+  def addFrame(self, image, step=None):
+    # each step is captured only once
+    if step is not None and step == self.__lastStep:
+      return
+    self.__lastStep = step
+    if self.__exception is not None:
+      raise self.__exception
+    # blocks if the encoder cannot keep up
+    self.__queue.put(image)
+
+  def close(self):
+    # waits until all frames are encoded, and returns the filename of the video (or None if no frames have been captured)
+    self.__queue.put(None)
+    self.__thread.join()
+    if self.__exception is not None:
+      raise self.__exception
+    return self.__pathAndFilename if self.__countFrames > 0 else None
+
+  def abort(self):
+    self.__exception = self.__exception or Exception('Video capture aborted')
+    self.__queue.put(None)
+    self.__thread.join()
+
+  def __run(self):
+    while True:
+      image = self.__queue.get()
+      if image is None:
+        break
+      if self.__exception is not None:
+        continue
+      try:
+        self.__writeFrame(image)
+      except Exception as e:
+        self.__exception = e
+    self.__stopProcess()
+
+  def __writeFrame(self, image):
+    if self.__size is None:
+      self.__size = image.size
+    if image.size != self.__size:
+      image = image.resize(self.__size)
+    if self.__process is None:
+      self.__startProcess()
+    self.__process.stdin.write(image.convert('RGB').tobytes())
+    self.__countFrames += 1
+
+  def __startProcess(self):
+    os.makedirs(os.path.dirname(os.path.abspath(self.__pathAndFilename)), exist_ok=True)
+    width, height = self.__size
+    self.__process = subprocess.Popen([
+      'ffmpeg', '-y',
+      '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', str(self.__fps), '-i', '-',
+      '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+      self.__pathAndFilename,
+    ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+  def __stopProcess(self):
+    if self.__process is None:
+      return
+    if self.__exception is not None:
+      self.__process.kill()
+      self.__process.wait()
+      return
+    try:
+      self.__process.stdin.close()
+    except OSError:
+      pass
+    if self.__process.wait() != 0:
+      self.__exception = Exception('Error when encoding the video')
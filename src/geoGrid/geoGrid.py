@@ -1,64 +1,50 @@
-import gzip
+import numpy as np
 import os
-import pickle
-from scipy.optimize import minimize_scalar
-import shapely
 import shutil
-from sklearn.neighbors import BallTree
 
-from src.common.functions import minBy
-from src.common.timer import timer
-from src.geometry.common import Common
+from src.common.console import Console
+from src.common.metrics import metrics
+from src.common.timer import timer, timerConfig
 from src.geometry.cartesian import Cartesian, Point
-from src.geometry.dggrid import DGGRID
-from src.geoGrid.geoGridCell import GeoGridCell
 from src.geoGrid.geoGridProjection import GeoGridProjection
 from src.geoGrid.geoGridProjectionTIN import GeoGridProjectionTIN
 from src.geoGrid.geoGridRenderer import GeoGridRenderer
+from src.geoGrid.geoGridState import GeoGridState
+from src.geoGrid.geoGridTopology import GeoGridTopology
+from src.mechanics.potential.potentials import kernelForPotential
 
 class GeoGrid:
-  def __init__(self, settings, callbackStatus=lambda status, energy, calibration=None: None):
+  # the adaptive step: the factor by which the speed is multiplied is increased after each step that decreases the energy without adding deficiencies, and decreased otherwise (rolling back the step)
+  adaptiveStepIncrease = 1.2
+  adaptiveStepDecrease = .5
+  adaptiveStepMin = .25
+  adaptiveStepMax = 8
+  adaptiveStepMaxSpeed = .5 # the maximum speed (1 - damping factor) resulting from the factor
+
+  def __init__(self, settings, callbackStatus=lambda status, energy, calibration=None: None, topology=None):
     # save settings
     self.__settings = settings
     self.__callbackStatus = callbackStatus
     # init
-    self.__gridStats = None
-    self.__cells = None
     self.__pathTmp = '_tmp'
     self.__step = 0
-    self.__ballTree = None
-    self.__ballTreeCellsId1s = None
+    self.__stepFactor = 1
     self.__projection = None
     # reset potentials
     for potential in self.__settings.potentials:
       potential.emptyCacheAll()
-    # load data
-    filename = 'cells-{resolution}.pickle.gzip'.format(resolution=self.__settings.resolution)
-    if os.path.exists(filename):
-      self.__callbackStatus('loading cells and indices from proxy file ...', None)
-      with timer('load data from proxy file'):
-        with gzip.open(filename, 'rb') as f:
-          data = pickle.load(f)
-    else:
-      self.__callbackStatus('creating cells and indices, and save them to proxy file ...', None)
-      with timer('create cells'):
-        dataCells = self.createCells(resolution=self.__settings.resolution)
-      with timer('compute ball tree'):
-        dataBallTree = self.createBallTree(dataCells)
-      with timer('save data to proxy file'):
-        data = {
-          **dataCells,
-          **dataBallTree,
-        }
-        with gzip.open(filename, 'wb') as f:
-          pickle.dump(data, f)
-    for k, v in data.items():
-      setattr(self, '_{self.__class__.__name__}{k}'.format(self=self, k=k) if k.startswith('__') else k, v)
+    # load the topology, which is shared by all grids of the same resolution, and create the state
+    self.__topology = topology if topology is not None else GeoGridTopology.forResolution(self.__settings.resolution, callbackStatus=self.__callbackStatus)
+    self.__state = GeoGridState(self.__topology)
+    self.__cells = self.__state.cells()
+    self.__cellsByIndex = list(self.__cells.values())
+    self.__neighbouringCellsCache = None
+    self.__energyMasks = None
     # empty the tmp path
     if os.path.exists(self.__pathTmp):
       shutil.rmtree(self.__pathTmp)
     # init the settings
-    self.__settings.initWithGridStats(self.__gridStats)
+    self.__settings.initWithGridStats(self.__topology.gridStats)
     self.__settings.initWithGeoGrid(self)
     # project to initial crs
     if self.__settings.initialProjection and self.__settings.initialProjection.transform is not None:
@@ -75,84 +61,17 @@ class GeoGrid:
   def settings(self):
     return self.__settings
 
-  def cells(self):
-    return self.__cells
+  def topology(self):
+    return self.__topology
 
-  @staticmethod
-  def createCells(resolution):
-    dggrid = DGGRID(executable='DGGRID/build/src/apps/dggrid/dggrid')
-    # get grid stats
-    gridStats, _ = dggrid.stats(resolution=resolution)
-    # get grid cells
-    dggridCells, _ = dggrid.generate(resolution=resolution)
-    # create GeoGridCells
-    cells = {}
-    cellsById1 = {}
-    nextId2 = max(dggridCells.keys()) + 1
-    for dLon in [None, -360, 360]:
-      for dggridCell in dggridCells.values():
-        if dLon is None:
-          id2 = dggridCell.id
-        else:
-          id2 = nextId2
-          nextId2 += 1
-        cells[id2] = GeoGridCell(id2, dggridCell, dLon=dLon)
-        if dggridCell.id not in cellsById1:
-          cellsById1[dggridCell.id] = []
-        cellsById1[dggridCell.id].append(cells[id2])
-    # identify poles
-    polesById1 = {}
-    for cell in cells.values():
-      if cell._id1 == cell._id2 and abs(cell._centreOriginal.x) < 1e-10 and (abs(cell._centreOriginal.y - 90) < 1e-10 or abs(cell._centreOriginal.y + 90) < 1e-10):
-        polesById1[cell._id1] = cell, cell._centreOriginal.y > 0
-    # identify neighbours in cartesian space
-    for id2 in cells:
-      cells[id2].initNeighbours([polesById1[n][0] if n in polesById1 else minBy(cellsById1[n], by=lambda cellNeighbour: Cartesian.distance(cells[id2]._centreOriginal, cellNeighbour._centreOriginal)) for n in cells[id2]._neighbours])
-    # identify cells to keep
-    bbox = shapely.geometry.box(-180, -90 - 1e-10, 180, 90 + 1e-10)
-    shapely.prepare(bbox)
-    keepId2s = []
-    for cell in cells.values():
-      if bbox.contains(cell._centreOriginal) and cell._neighbours is not None:
-        cell._isActive = True
-        keepId2s.append(cell._id2)
-        keepId2s += cell._neighbours
-    for cell in cells.values():
-      if cell._isActive and all([cells[neighbour]._isActive for neighbour in cell._neighbours]):
-        cell._selfAndAllNeighboursAreActive = True
-    # remove cells not to keep
-    removeId2s = [id2 for id2 in cells if id2 not in keepId2s]
-    for id2 in removeId2s:
-      del cells[id2]
-    # init poles
-    for cell, isNorth in polesById1.values():
-      cell.initPole(isNorth, cells)
-    # init additional information
-    for cell in cells.values():
-      cell.initAdditionalInformation()
-    # return result
-    return {
-      '__gridStats': gridStats,
-      '__cells': cells,
-    }
+  def state(self):
+    return self.__state
 
-  @staticmethod
-  def createBallTree(dataCells):
-    cells = dataCells['__cells']
-    cellsById1 = {}
-    for cell in cells.values():
-      if cell._id1 not in cellsById1:
-        cellsById1[cell._id1] = []
-      cellsById1[cell._id1].append(cell._id2)
-    ballTreeCells = [cell for cell in cells.values() if cell._id1 == cell._id2]
-    ballTreeCellsId1s = [cellsById1[cell._id1] for cell in ballTreeCells]
-    ballTree = BallTree([(Common.deg2rad(cell._centreOriginal.y), Common.deg2rad(cell._centreOriginal.x)) for cell in ballTreeCells], metric='haversine')
-    return {
-      '__ballTree': ballTree,
-      '__ballTreeCellsId1s': ballTreeCellsId1s,
-    }
+  def cells(self):
+    return self.__cells
 
   def calibrate(self):
+    from scipy.optimize import minimize_scalar
     energy = 0
     for (weight, potential) in self.__settings.weightedPotentials():
       if weight.isVanishing():
@@ -178,56 +97,92 @@ class GeoGrid:
     if len(statusPotentials) > 0:
       self.__callbackStatus(None, energy, calibration=f"calibrated: {', '.join(statusPotentials)}")
 
+  def energyMasks(self):
+    # the cells whose energies are summed up: the active cells within the latitude limit (outer), and those of them whose neighbours are all active (inner)
+    limitLat = self.__settings.limitLatForEnergy
+    if self.__energyMasks is None or self.__energyMasks[0] != limitLat:
+      arrays = self.__topology.arrays()
+      isOuter = np.array(arrays['isActive'], dtype=bool)
+      if limitLat is not None:
+        isOuter &= np.abs(np.asarray(arrays['lats'])) <= limitLat
+      isInner = isOuter & np.asarray(arrays['selfAndAllNeighboursAreActive'])
+      isInner.flags.writeable = False
+      isOuter.flags.writeable = False
+      self.__energyMasks = limitLat, isInner, isOuter
+    return self.__energyMasks[1:]
+
   def energy(self, kindOfPotential=None, weighted=False, calibration=False):
     with timer('compute energy', log=kindOfPotential is None, step=self.__step):
+      isInner, isOuter = self.energyMasks()
       innerEnergy = 0
       outerEnergy = 0
       if self.__step <= 0 or calibration:
+        # compute the energies anew
         for (weight, potential) in self.__settings.weightedPotentials():
           if kindOfPotential is not None and potential.kind != kindOfPotential:
             continue
           if weight.isVanishing():
             continue
-          for cell in self.__cells.values():
-            if cell._isActive and cell.within(lat=self.__settings.limitLatForEnergy):
-              energy = (weight.forCell(cell) if weighted else 1) * potential.energy(cell, [self.__cells[n] for n in cell._neighbours if n in self.__cells])
-              if cell._selfAndAllNeighboursAreActive:
-                innerEnergy += energy
-              outerEnergy += energy
+          ws = weight.forCells(self.__topology)
+          kernel = kernelForPotential(potential)
+          if kernel is not None:
+            energies, _ = kernel(potential, self.__state, self.__topology, ws)
+          else:
+            energies = np.zeros(len(self.__topology))
+            neighbouringCells = self.__neighbouringCells()
+            for i in np.flatnonzero(isOuter).tolist():
+              energies[i] = potential.energy(self.__cellsByIndex[i], neighbouringCells[i])
+          innerEnergy += np.dot(ws[isInner], energies[isInner]) if weighted else np.sum(energies[isInner])
+          outerEnergy += np.dot(ws[isOuter], energies[isOuter]) if weighted else np.sum(energies[isOuter])
       else:
-        for cell in self.__cells.values():
-          if cell._isActive and cell.within(lat=self.__settings.limitLatForEnergy):
-            energy = cell.energy(kindOfPotential if kindOfPotential else 'ALL', weighted=weighted)
-            if cell._selfAndAllNeighboursAreActive:
-              innerEnergy += energy
-            outerEnergy += energy
-      return innerEnergy, outerEnergy
+        # use the energies computed with the forces
+        for kind in [kindOfPotential] if kindOfPotential else self.__state._energy.keys():
+          if kind not in self.__state._energy:
+            raise Exception('The energy has not yet been computed')
+          energies, ws = self.__state._energy[kind], self.__state._energyWeight[kind]
+          innerEnergy += np.dot(ws[isInner], energies[isInner]) if weighted else np.sum(energies[isInner])
+          outerEnergy += np.dot(ws[isOuter], energies[isOuter]) if weighted else np.sum(energies[isOuter])
+      return float(innerEnergy), float(outerEnergy)
+
+  def __neighbouringCells(self):
+    # the neighbouring cells of all cells (as far as they are part of the grid), by index
+    if self.__neighbouringCellsCache is None:
+      self.__neighbouringCellsCache = [[self.__cells[n] for n in cell._neighbours if n in self.__cells] if cell._neighbours is not None else [] for cell in self.__cellsByIndex]
+    return self.__neighbouringCellsCache
 
   def maxForceStrength(self):
     with timer('compute maximum force strength', step=self.__step):
-      forceStrength = 0
-      for cell in self.__cells.values():
-        if cell._isActive:
-          forceStrength = max(forceStrength, Cartesian.length(*cell.computeForcesNext()))
+      xs, ys = self.__state.forcesNext()
+      isActive = np.asarray(self.__topology.arrays()['isActive'])
+      forceStrength = float(np.max(np.sqrt(xs * xs + ys * ys)[isActive], initial=0))
     return forceStrength
 
   def step(self):
     return self.__step
 
+  def stepFactor(self):
+    # the factor by which the speed is multiplied for the forces computed last (1, unless the step is adaptive)
+    return self.__stepFactor
+
   def performStep(self, _onlyComputeNextForces=False):
     # reset projection
     self.__projection = None
     # increase step
     if not _onlyComputeNextForces:
       self.__step += 1
+    with metrics.span('perform step', step=self.__step):
+      if not _onlyComputeNextForces and self.__settings._adaptiveStep:
+        self.__performAdaptiveStep()
+      else:
+        self.__performStep(applyForces=not _onlyComputeNextForces)
+
+  def __performStep(self, applyForces=True):
     # apply forces
-    if not _onlyComputeNextForces:
+    if applyForces:
       with timer('apply forces', step=self.__step):
-        for cell in self.__cells.values():
-          cell.applyForces()
+        self.__state.applyForces()
     # reset potentials
-    for potential in self.__settings.potentials:
-      potential.emptyCacheForStep()
+    self.__emptyCachesForStep()
     # find deficiencies and correct them
     # self.correctDeficiencies()
     # calibrate
@@ -235,6 +190,52 @@ class GeoGrid:
     # compute next forces and energies
     self.computeEnergiesAndForces()
 
+  def __emptyCachesForStep(self):
+    for potential in self.__settings.potentials:
+      potential.emptyCacheForStep()
+
+  def __performAdaptiveStep(self):
+    # the step is accepted if the energy does not increase and no deficiencies are added; otherwise, it is rolled back and repeated with forces computed for a smaller step
+    # this trades speed for stability: every step computes the energy once more, and every step rolled back computes the forces once more; for the default speed, the factor mostly decreases, such that more steps are needed than with a fixed step, but fewer deficiencies emerge
+    # both energies are computed with the calibration of the forces, because the step is only calibrated anew after it has been accepted
+    _, energyBefore = self.energy(weighted=True)
+    countDeficienciesBefore = self.countDeficiencies()
+    snapshot = self.__state.snapshot()
+    countRejected = 0
+    while True:
+      stepFactor = self.__stepFactor
+      with timer('apply forces', step=self.__step):
+        self.__state.applyForces()
+      self.__emptyCachesForStep()
+      _, energyAfter = self.energy(weighted=True, calibration=True)
+      countDeficienciesAfter = self.countDeficiencies()
+      isAccepted = energyAfter <= energyBefore and countDeficienciesAfter <= countDeficienciesBefore
+      if isAccepted or stepFactor <= self.adaptiveStepMin:
+        break
+      # roll back
+      with timer('roll back step', step=self.__step):
+        self.__state.restore(snapshot)
+        self.__emptyCachesForStep()
+        self.__stepFactor = max(self.adaptiveStepMin, stepFactor * self.adaptiveStepDecrease)
+        self.computeEnergiesAndForces()
+      countRejected += 1
+    # calibrate, and compute the forces of the next step with the factor of this step (the factor is increased for the step after)
+    self.calibrate()
+    self.computeEnergiesAndForces()
+    if isAccepted:
+      self.__stepFactor = min(self.adaptiveStepMax, self.adaptiveStepMaxSpeed / (1 - self.__settings._dampingFactor), stepFactor * self.adaptiveStepIncrease)
+    metrics.count('steps rolled back', countRejected, step=self.__step)
+    if not timerConfig.disableAllLog():
+      Console.print(f"{f'step {self.__step:>5}':<10} | adaptive step: speed {100 * (1 - self.__settings._dampingFactor) * stepFactor:.2f} (factor {stepFactor:.3f}){f', rolled back {countRejected}x' if countRejected > 0 else ''}{', not accepted' if not isAccepted else ''}")
+
+  def countDeficiencies(self):
+    # the number of deficiencies (as findDeficiencies), computed for all triangles at once
+    indices0, indices1, indices2 = self.__topology.neighbourTriangles()
+    xs, ys = self.__state.xs, self.__state.ys
+    areas = xs[indices0] * (ys[indices1] - ys[indices2]) + xs[indices1] * (ys[indices2] - ys[indices0]) + xs[indices2] * (ys[indices0] - ys[indices1])
+    isActive = np.asarray(self.__topology.arrays()['isActive'], dtype=bool)
+    return int(np.count_nonzero((areas <= 0) & isActive[indices0]))
+
   def findDeficiencies(self, computeAlmostDeficiencies=True):
     deficiencies, almostDeficiencies = [], []
     with timer(f"find deficiencies", step=self.__step):
@@ -276,36 +277,50 @@ class GeoGrid:
 
   def computeEnergiesAndForces(self):
     # reset forces
-    for cell in self.__cells.values():
-      cell.resetForcesNext()
+    self.__state.resetForcesNext()
     # compute energies and forces
     for (weight, potential) in self.__settings.weightedPotentials():
       with timer(f"compute energies and forces: {potential.kind.lower()}", step=self.__step):
-        for cell in self.__cells.values():
-          # only continue if weight is not vanishing
-          if weight.isVanishing():
-            cell.setEnergy(potential.kind, 0)
-            cell.setEnergyWeight(potential.kind, 0)
-            continue
-          # weight
-          w = weight.forCell(cell)
-          # compute
-          energy, forces = potential.energyAndForces(cell, [self.__cells[n] for n in cell._neighbours if n in self.__cells])
-          # handle energies
-          cell.setEnergy(potential.kind, energy)
-          cell.setEnergyWeight(potential.kind, w)
-          # handle forces
-          for force in forces:
-            force.scaleStrength(w if force.withoutDamping else (1 - self.__settings._dampingFactor) * w)
-            self.__cells[force.id2From].addForce(force)
+        kernel = kernelForPotential(potential)
+        # only continue if weight is not vanishing
+        if weight.isVanishing():
+          self.__state._energy[potential.kind] = np.zeros(len(self.__topology))
+          self.__state._energyWeight[potential.kind] = np.zeros(len(self.__topology))
+          countForces = 0
+        # compute all cells at once
+        elif kernel is not None:
+          ws = weight.forCells(self.__topology)
+          energies, forces = kernel(potential, self.__state, self.__topology, ws)
+          self.__state._energy[potential.kind] = energies
+          self.__state._energyWeight[potential.kind] = ws
+          forces.scaleStrength(ws[forces.sources] if forces.withoutDamping else (1 - self.__settings._dampingFactor) * self.__stepFactor * ws[forces.sources])
+          self.__state.addForces(forces)
+          countForces = len(forces)
+        # compute cell by cell
+        else:
+          ws = weight.forCells(self.__topology)
+          energies = np.zeros(len(self.__topology))
+          for cell, neighbouringCells, w in zip(self.__cellsByIndex, self.__neighbouringCells(), ws.tolist()):
+            # compute
+            energy, forces = potential.energyAndForces(cell, neighbouringCells)
+            energies[cell._index] = energy
+            # handle forces
+            for force in forces:
+              force.scaleStrength(w if force.withoutDamping else (1 - self.__settings._dampingFactor) * self.__stepFactor * w)
+              self.__cells[force.id2From].addForce(force)
+          self.__state._energy[potential.kind] = energies
+          self.__state._energyWeight[potential.kind] = ws
+          countForces = len(self.__state.addPendingForces(potential.kind))
+        metrics.count('cells processed', len(self.__cells), step=self.__step)
+        metrics.count('forces created', countForces, step=self.__step)
 
   def serializedDataForProjection(self):
     with timer('serialize data for projection', step=self.__step):
-      return GeoGridProjection.serializedDataForProjection(self.__cells)
+      return GeoGridProjection.serializedDataForProjection(self.__state)
 
   def projection(self):
     if self.__projection is None:
-      self.__projection = GeoGridProjection(self.__ballTree, self.__ballTreeCellsId1s, self.serializedDataForProjection())
+      self.__projection = GeoGridProjection(self.__topology, self.serializedDataForProjection())
     return self.__projection
 
   def project(self, lon, lat):
@@ -321,35 +336,36 @@ class GeoGrid:
         **GeoGridRenderer.viewSettingsDefault,
         **viewSettings,
       }
-      # init data
-      cells = dict((cell._id2, {}) for cell in self.__cells.values())
+      # the cells are serialized as typed arrays in the order of the topology: the static arrays are shared with the topology without copying, and the dynamic arrays are created anew for each serialization
+      # lists of several values per cell are stored in compressed sparse row format: the values for the cell with index i are in the range indptr[i]:indptr[i + 1]
+      topology = self.__topology
+      arrays = topology.arrays()
+      cells = {
+        'id2s': arrays['id2s'],
+        'xys': np.stack([self.__state.xs, self.__state.ys], axis=1),
+        'isActive': arrays['isActive'],
+        'distancesToLand': arrays['distancesToLand'],
+      }
       # initial polygon coords
       if viewSettings['drawInitialPolygons']:
-        for cell in self.__cells.values():
-          cells[cell._id2]['polygonInitialCoords'] = cell._polygonOriginal.exterior.coords[:-1]
-      # neighbours xy
+        cells['polygonsInitialIndptr'] = arrays['polygonsIndptr']
+        cells['polygonsInitialCoords'] = arrays['polygons']
+      # neighbours
       if viewSettings['drawNeighbours']:
-        for cell in self.__cells.values():
-          if cell._neighbours is not None:
-            cells[cell._id2]['neighboursXY'] = [self.__cells[cell2Id2].xy() for cell2Id2 in cell._neighbours if cell2Id2 in self.__cells]
-      # force vectors
+        cells['neighboursIndptr'], cells['neighbours'] = topology.neighboursIndices()
+      # force vectors (the end points, the start points being the centres)
       if viewSettings['selectedPotential'] is not None:
         if viewSettings['selectedVisualizationMethod'] == 'SUM':
-          for cell in self.__cells.values():
-            cells[cell._id2]['forceVector'] = cell.forceVector(viewSettings['selectedPotential'])
+          forces = [cell.forceVector(viewSettings['selectedPotential'])[1] for cell in self.__cells.values()]
+          cells['forcesIndptr'] = np.arange(len(forces) + 1, dtype=np.int64)
         else:
-          for cell in self.__cells.values():
-            cells[cell._id2]['forceVectors'] = cell.forceVectors(viewSettings['selectedPotential'])
-      # energy
+          forcesPerCell = [cell.forceVectors(viewSettings['selectedPotential'])[1] for cell in self.__cells.values()]
+          forces = [p for ps in forcesPerCell for p in ps]
+          cells['forcesIndptr'] = np.cumsum([0] + [len(ps) for ps in forcesPerCell], dtype=np.int64)
+        cells['forces'] = np.array(forces, dtype=np.float64).reshape(-1, 2)
+      # energy (not a number for inactive cells)
       if viewSettings['selectedEnergy'] is not None:
-        for cell in self.__cells.values():
-          if cell._isActive:
-            cells[cell._id2]['energy'] = cell.energy(viewSettings['selectedEnergy'], weighted=True)
-      # centres xy and is active
-      for cell in self.__cells.values():
-        cells[cell._id2]['xy'] = cell.xy()
-        cells[cell._id2]['isActive'] = cell._isActive
-        cells[cell._id2]['distanceToLand'] = cell._distanceToLand
+        cells['energies'] = np.where(arrays['isActive'], self.__state.energies(viewSettings['selectedEnergy'], weighted=True), np.nan)
       # return
       return {
         'cells': cells,
@@ -1,39 +1,69 @@
+import numpy as np
+
 from src.common.functions import minBy
+from src.common.metrics import metrics
 from src.geometry.common import Common
 from src.geometry.cartesian import Cartesian, Point
 from src.geometry.geo import Geo
-from src.geoGrid.geoGridCell import GeoGridCell
 
 class GeoGridProjection:
-  def __init__(self, ballTree, ballTreeCellsId1s, cellsData):
-    self.__ballTree = ballTree
-    self.__ballTreeCellsId1s = ballTreeCellsId1s
-    self.__cellsData = cellsData
+  # the static data (the topology, including the ball tree) is shared, and only the positions of the cells are updated
+  def __init__(self, topology, xys):
+    self.__topology = topology
+    self.__ballTree, self.__ballTreeCellsIndices = topology.ballTree()
+    self.__xys = xys
+    self.__cacheLines = {}
 
   @staticmethod
-  def serializedDataForProjection(cells):
-    return dict((k, cell.getNeighboursWithEnclosingBearingStaticData()) for k, cell in cells.items())
+  def serializedDataForProjection(state):
+    # a snapshot of the positions, such that the buffer can be swapped while the optimization proceeds
+    return np.stack([state.xs, state.ys], axis=1)
 
   def updateSerializedDataForProjection(self, serializedDataForProjection):
-    self.__cellsData = serializedDataForProjection
+    self.__xys = serializedDataForProjection
+    self.__cacheLines = {}
+
+  def projectLines(self, key, css):
+    # projects lines or polygons given by lon/lat coordinates; the result is cached (by the key) until the positions are updated
+    cacheLines = self.__cacheLines
+    if key not in cacheLines:
+      cacheLines[key] = [[self.project(*c) for c in cs] for cs in css]
+    return cacheLines[key]
 
   def project(self, lon, lat):
+    topology = self.__topology
+    xys = self.__xys
     pointLonLat = Point(lon, lat)
+    metrics.count('ball tree queries')
     dist, ind = self.__ballTree.query([[Common.deg2rad(lat), Common.deg2rad(lon)]], k=3)
-    nearestCellData = None
-    cornerCellsData = None
-    for id2s in [self.__ballTreeCellsId1s[i] for i in ind[0]]:
-      nearestCellData = minBy([self.__cellsData[id2] for id2 in id2s], by=lambda cellData: Cartesian.distance(pointLonLat, cellData['centreOriginal']))
-      cornerCellsData = GeoGridCell.neighboursWithEnclosingBearingStatic(nearestCellData, self.__cellsData, pointLonLat)
-      if cornerCellsData is not None:
+    nearestIndex = None
+    cornerIndices = None
+    for indices in [self.__ballTreeCellsIndices[i] for i in ind[0]]:
+      nearestIndex = minBy(indices, by=lambda i: Cartesian.distance(pointLonLat, topology.centreOriginal(i)))
+      cornerIndices = self.__neighboursWithEnclosingBearing(nearestIndex, pointLonLat)
+      if cornerIndices is not None:
         break
-    if nearestCellData is None or cornerCellsData is None:
+    if nearestIndex is None or cornerIndices is None:
       raise Exception('No nearest cell found')
-    cornerCellsData = [nearestCellData, *cornerCellsData]
-    if cornerCellsData[0]['centreOriginal'].x == lon and cornerCellsData[0]['centreOriginal'].y == lat:
-      return cornerCellsData[0]['point'].x, cornerCellsData[0]['point'].y
-    cs = GeoGridProjection.__toBarycentricCoordinatesSpherical([cellData['centreOriginal'] for cellData in cornerCellsData], pointLonLat)
-    return GeoGridProjection.__fromBarycentricCoordinates([cellData['point'] for cellData in cornerCellsData], cs)
+    cornerIndices = [nearestIndex, *cornerIndices]
+    centreOriginal = topology.centreOriginal(cornerIndices[0])
+    if centreOriginal.x == lon and centreOriginal.y == lat:
+      return tuple(xys[cornerIndices[0]].tolist())
+    cs = GeoGridProjection.__toBarycentricCoordinatesSpherical([topology.centreOriginal(i) for i in cornerIndices], pointLonLat)
+    return GeoGridProjection.__fromBarycentricCoordinates(xys[cornerIndices].tolist(), cs)
+
+  def __neighboursWithEnclosingBearing(self, i, point):
+    topology = self.__topology
+    neighboursBearings2 = topology.neighboursBearings2(i)
+    if neighboursBearings2 is None:
+      return None
+    neighbours = topology.neighbours(i)
+    indexById2 = topology.indexById2()
+    bearing = Geo.bearing(topology.centreOriginal(i), point)
+    for k, b0, b1 in neighboursBearings2:
+      if b0 > bearing and bearing >= b1:
+        return [indexById2[neighbours[j]] for j in [k, (k + 1) % len(neighbours)]]
+    raise Exception('This should never happen – some bearing should have been found')
 
   @staticmethod
   def __toBarycentricCoordinatesSpherical(triangle, point):
@@ -43,4 +73,4 @@ class GeoGridProjection:
 
   @staticmethod
   def __fromBarycentricCoordinates(triangle, coordinates):
-    return sum([coordinates[i] * triangle[i].x for i in range(0, 3)]), sum([coordinates[i] * triangle[i].y for i in range(0, 3)])
+    return sum([coordinates[i] * triangle[i][0] for i in range(0, 3)]), sum([coordinates[i] * triangle[i][1] for i in range(0, 3)])
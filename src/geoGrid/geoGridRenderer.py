@@ -1,4 +1,5 @@
 import math
+import numpy as np
 import os
 
 from src.common.functions import brange
@@ -33,6 +34,64 @@ class Graticule:
     ]
     return self.__cache[key]
 
+class LevelOfDetail:
+  # bins the primitives by tiles of the image, and draws one aggregate per tile
+  # at level k, the tiles have 2^k times the typical spacing of the cell centres in the image, such that about 4^k cells are aggregated
+  minSpacing = 12
+
+  def __init__(self, projectToImage, level, spacing):
+    self.__projectToImage = projectToImage
+    self.level = level
+    self.__tileSize = spacing * 2**level
+
+  @staticmethod
+  def forCentres(xys, projectToImage, level='AUTO'):
+    if not level or len(xys) == 0:
+      return None
+    xs, ys = projectToImage(xys[:, 0], xys[:, 1])
+    # the typical spacing of the cell centres, estimated by the area of the ellipse enclosed by their bounding box
+    spacing = math.sqrt(max(1e-9, Common._pi / 4 * (xs.max() - xs.min()) * (ys.max() - ys.min()) / len(xys)))
+    if level == 'AUTO':
+      level = max(0, math.ceil(math.log2(LevelOfDetail.minSpacing / spacing)))
+    return LevelOfDetail(projectToImage, level, spacing) if level > 0 else None
+
+  def __bins(self, ps):
+    xs, ys = self.__projectToImage(ps[:, 0], ps[:, 1])
+    keys = np.floor(xs / self.__tileSize).astype(np.int64) * 2**32 + np.floor(ys / self.__tileSize).astype(np.int64)
+    _, bins = np.unique(keys, return_inverse=True)
+    return bins.ravel()
+
+  @staticmethod
+  def __means(bins, values):
+    counts = np.bincount(bins)
+    return np.stack([np.bincount(bins, weights=values[:, i]) / counts for i in range(values.shape[1])], axis=1)
+
+  def points(self, ps, rs, fills):
+    # the mean position of the points in the tile, and the radius and the colour of the largest point
+    ps, rs = np.asarray(ps, dtype=np.float64), np.asarray(rs, dtype=np.float64)
+    bins = self.__bins(ps)
+    order = np.lexsort((rs, bins))
+    representatives = order[np.append(bins[order][1:] != bins[order][:-1], True)]
+    return LevelOfDetail.__means(bins, ps), rs[representatives], [fills[i] for i in representatives]
+
+  def vectors(self, pss):
+    # the mean vector of the vectors starting in the tile
+    pss = np.asarray(pss, dtype=np.float64)
+    bins = self.__bins(pss[:, 0])
+    p1s = LevelOfDetail.__means(bins, pss[:, 0])
+    p2s = p1s + LevelOfDetail.__means(bins, pss[:, 1] - pss[:, 0])
+    return np.stack([p1s, p2s], axis=1)
+
+  def edges(self, pss):
+    # one edge between the mean positions of the endpoints in two neighbouring tiles
+    pss = np.asarray(pss, dtype=np.float64)
+    bins = self.__bins(pss.reshape(-1, 2))
+    centres = LevelOfDetail.__means(bins, pss.reshape(-1, 2))
+    bins1, bins2 = bins[0::2], bins[1::2]
+    keep = bins1 != bins2
+    pairs = np.unique(np.stack([np.minimum(bins1, bins2), np.maximum(bins1, bins2)], axis=1)[keep], axis=0)
+    return np.stack([centres[pairs[:, 0]], centres[pairs[:, 1]]], axis=1)
+
 class GeoGridRenderer:
   viewSettingsDefault = {
     'selectedPotential': 'ALL',
@@ -49,7 +108,15 @@ class GeoGridRenderer:
   }
 
   @staticmethod
-  def render(serializedData, geoGridSettings, viewSettings={}, size=None, maxSide=2000, border=10, transparency=False, largeSymbols=False, r=3, boundsExtend=1.3, projection=None, save=False, stepData=None, backend=ImageBackendPillow):
+  def bounds(boundsExtend=1.3):
+    xMax = Common._pi * Geo.radiusEarth * boundsExtend
+    yMax = Common._pi_2 * Geo.radiusEarth * boundsExtend
+    return -xMax, -yMax, xMax, yMax
+
+  @staticmethod
+  def render(serializedData, geoGridSettings, viewSettings={}, size=None, maxSide=2000, border=10, transparency=False, largeSymbols=False, r=3, boundsExtend=1.3, bounds=None, projection=None, save=False, stepData=None, backend=ImageBackendPillow, levelOfDetail=0):
+    # levelOfDetail: 0 draws all primitives, k > 0 aggregates the primitives in tiles (see LevelOfDetail), and 'AUTO' chooses the level by the density of the cells in the image
+    # bounds: the part of the map (xMin, yMin, xMax, yMax) to render, in which case only the primitives intersecting the bounds are drawn
     # handle serialized data
     cells = serializedData['cells']
     path = serializedData['path']
@@ -76,23 +143,26 @@ class GeoGridRenderer:
       heightOverall = height
       width -= 2 * border
       height -= 2 * border
-      xMin = -Common._pi * Geo.radiusEarth * boundsExtend
-      xMax = -xMin
-      yMin = -Common._pi_2 * Geo.radiusEarth * boundsExtend
-      yMax = -yMin
+      xMin, yMin, xMax, yMax = bounds or GeoGridRenderer.bounds(boundsExtend=boundsExtend)
       w = min(width, (xMax - xMin) / (yMax - yMin) * height)
       h = min(height, (yMax - yMin) / (xMax - xMin) * width)
       dx2 = border + (width - w) / 2
       dy2 = border + (height - h) / 2
       s = w / (xMax - xMin)
-      projectToImage = lambda x, y: (dx2 + s * (x - xMin), dy2 + s * (-y - yMin))
+      projectToImage = lambda x, y: (dx2 + s * (x - xMin), dy2 + s * (yMax - y))
       k = Common._pi_180 * Geo.radiusEarth
       lonLatToCartesian = lambda cs: tuple(k * c for c in cs)
       viewSettings = {
         **viewSettings,
         'widthOverall': widthOverall,
         'heightOverall': heightOverall,
+        'levelOfDetail': LevelOfDetail.forCentres(cells['xys'], projectToImage, level=levelOfDetail),
+        'cullingBounds': None,
       }
+      # the primitives are culled with a margin covering the border and the largest symbols
+      if bounds is not None:
+        margin = 12 * (4 if largeSymbols else 1) * r
+        viewSettings['cullingBounds'] = (xMin - (dx2 + margin) / s, yMin - (dy2 + margin) / s, xMax + (dx2 + margin) / s, yMax + (dy2 + margin) / s)
       # create image
       image = backend(widthOverall, heightOverall, projectToImage, transparentBackground=transparency)
       # render
@@ -116,75 +186,82 @@ class GeoGridRenderer:
       return
     if viewSettings['drawContinentsTolerance']:
       csExteriors, csInteriors = NaturalEarth.preparedData(viewSettings['drawContinentsTolerance'])
-      image.group('land-outer', (image.polygon_([projection.project(*c) for c in cs], fill=(230, 230, 230)) for cs in csExteriors))
-      # image.group('land-outer-stroke', (image.polygon_([projection.project(*c) for c in cs], stroke=(0, 255, 0)) for cs in csExteriors))
-      image.group('land-inner', (image.polygon_([projection.project(*c) for c in cs], fill=(255, 255, 255)) for cs in csInteriors))
+      csExteriors = GeoGridRenderer.__cullLines(viewSettings, projection.projectLines(('land-outer', viewSettings['drawContinentsTolerance']), csExteriors))
+      csInteriors = GeoGridRenderer.__cullLines(viewSettings, projection.projectLines(('land-inner', viewSettings['drawContinentsTolerance']), csInteriors))
+      image.group('land-outer', (image.polygon_(cs, fill=(230, 230, 230)) for cs in csExteriors))
+      # image.group('land-outer-stroke', (image.polygon_(cs, stroke=(0, 255, 0)) for cs in csExteriors))
+      image.group('land-inner', (image.polygon_(cs, fill=(255, 255, 255)) for cs in csInteriors))
 
   @staticmethod
   def renderGraticule(image, lonLatToCartesian, cells, geoGridSettings, viewSettings, w, r, projection, stepData):
     if projection is None:
       return
     if viewSettings['drawGraticule']:
-      image.group('graticule', (image.line_([projection.project(*c) for c in gc], stroke=(200, 200, 200), width=2) for gcs in Graticule().coordinates(dDegree=viewSettings['drawGraticuleDDegree'], degResolution=viewSettings['drawGraticuleDegResolution']) for gc in gcs))
+      key = ('graticule', viewSettings['drawGraticuleDDegree'], viewSettings['drawGraticuleDegResolution'])
+      gcs = projection.projectLines(key, [gc for gcs in Graticule().coordinates(dDegree=viewSettings['drawGraticuleDDegree'], degResolution=viewSettings['drawGraticuleDegResolution']) for gc in gcs])
+      image.group('graticule', (image.line_(gc, stroke=(200, 200, 200), width=2) for gc in GeoGridRenderer.__cullLines(viewSettings, gcs)))
 
   @staticmethod
   def renderInitialPolygons(image, lonLatToCartesian, cells, geoGridSettings, viewSettings, w, r, projection, stepData):
     if viewSettings['drawInitialPolygons'] and geoGridSettings.canBeOptimized():
-      image.group('initial-cells', (image.polygon_([lonLatToCartesian(c) for c in cell['polygonInitialCoords']], stroke=(255, 100, 100), width=w) for cell in cells.values()))
+      indptr, coords = cells['polygonsInitialIndptr'].tolist(), cells['polygonsInitialCoords'].tolist()
+      polygons = ([lonLatToCartesian(c) for c in coords[indptr[i]:indptr[i + 1]]] for i in range(len(indptr) - 1))
+      image.group('initial-cells', (image.polygon_(cs, stroke=(255, 100, 100), width=w) for cs in GeoGridRenderer.__cullLines(viewSettings, polygons)))
 
   @staticmethod
   def renderNeighbours(image, lonLatToCartesian, cells, geoGridSettings, viewSettings, w, r, projection, stepData):
     if viewSettings['drawNeighbours'] and geoGridSettings.canBeOptimized():
-      neighbours = []
-      for cell in cells.values():
-        if 'neighboursXY' in cell:
-          for xy in cell['neighboursXY']:
-            neighbours.append(image.line_([cell['xy'], xy], stroke=(220, 220, 220), width=w))
-      image.group('neighbours', neighbours)
+      xys = cells['xys']
+      neighbours = GeoGridRenderer.__cullSegments(viewSettings, np.stack([xys[GeoGridRenderer.__rows(cells['neighboursIndptr'])], xys[cells['neighbours']]], axis=1))
+      if viewSettings['levelOfDetail'] and len(neighbours):
+        neighbours = viewSettings['levelOfDetail'].edges(neighbours)
+      image.lines('neighbours', neighbours, stroke=(220, 220, 220), width=w)
 
   @staticmethod
   def renderForces(image, lonLatToCartesian, cells, geoGridSettings, viewSettings, w, r, projection, stepData):
     if viewSettings['selectedPotential'] is not None and geoGridSettings.canBeOptimized():
-      forces = []
-      if viewSettings['selectedVisualizationMethod'] == 'SUM':
-        for cell in cells.values():
-          forces.append(image.line_(cell['forceVector'], stroke=(150, 150, 150), width=w))
-      else:
-        for cell in cells.values():
-          p1, p2s = cell['forceVectors']
-          for p2 in p2s:
-            forces.append(image.line_([p1, p2], stroke=(150, 150, 150), width=w))
-      image.group('forces', forces)
+      forces = GeoGridRenderer.__cullSegments(viewSettings, np.stack([cells['xys'][GeoGridRenderer.__rows(cells['forcesIndptr'])], cells['forces']], axis=1))
+      if viewSettings['levelOfDetail'] and len(forces):
+        forces = viewSettings['levelOfDetail'].vectors(forces)
+      image.lines('forces', forces, stroke=(150, 150, 150), width=w)
 
   @staticmethod
   def renderCentres(image, lonLatToCartesian, cells, geoGridSettings, viewSettings, w, r, projection, stepData):
     factor = 1e-4
+    xys, isActive = cells['xys'], cells['isActive']
+    visible = isActive if geoGridSettings.cannotBeOptimized() else np.ones(len(xys), dtype=bool)
+    if viewSettings['cullingBounds'] is not None:
+      visible = visible & GeoGridRenderer.__withinBounds(viewSettings['cullingBounds'], xys)
+    # labels
+    labels = []
     if viewSettings['drawLabels']:
       font = image.getImageFont('Helvetica', size=14)
-    centres = []
-    labels = []
-    for id2, cell in cells.items():
-      if geoGridSettings.cannotBeOptimized() and not cell['isActive']:
-        continue
-      radius = r
-      fill = None
-      if viewSettings['selectedEnergy'] is not None and cell['isActive']:
-        radius *= .5 + max(0, min(10, 3 + math.log((cell['energy'] + 1e-10) * factor)))
-        fill = (255, 140, 140)
-      if viewSettings['drawCentres'] is not None:
-        fill = None
-        if viewSettings['drawCentres'] == 'ACTIVE':
-          fill = (255, 140, 140) if cell['isActive'] else (140, 140, 255)
-        else:
-          for weight, potential in geoGridSettings.weightedPotentials():
-            if not weight.isVanishing() and potential.kind == viewSettings['drawCentres']:
-              fill = GeoGridRenderer.__blendColour(.5 * weight.forCellData(cell), colour0=(230, 230, 230), colour1=(255, 0, 0))
-      if fill is not None:
-        centres.append(image.point_(cell['xy'], radius, fill=fill))
-      if viewSettings['drawLabels']:
-        labels.append(image.text_(tuple(map(sum, zip(cell['xy'], lonLatToCartesian((.6, -.3))))), str(id2), font=font, fill=(0, 0, 0), anchor='mm' if viewSettings['drawCentres'] is None else 'la', align='center' if viewSettings['drawCentres'] is None else 'left'))
-    if len(centres):
-      image.group('centres', centres)
+      dxy = lonLatToCartesian((.6, -.3))
+      labels = [image.text_((x + dxy[0], y + dxy[1]), str(id2), font=font, fill=(0, 0, 0), anchor='mm' if viewSettings['drawCentres'] is None else 'la', align='center' if viewSettings['drawCentres'] is None else 'left') for (x, y), id2 in zip(xys[visible].tolist(), cells['id2s'][visible].tolist())]
+    # radii
+    radii = np.full(len(xys), r, dtype=np.float64)
+    fills = None
+    if viewSettings['selectedEnergy'] is not None:
+      energies = cells['energies'][isActive]
+      radii[isActive] *= .5 + np.clip(3 + np.log((energies + 1e-10) * factor), 0, 10)
+      fills = np.where(isActive[:, None], (255, 140, 140), -1)
+    # fills (cells with a fill of -1 are not drawn)
+    if viewSettings['drawCentres'] is not None:
+      fills = np.full((len(xys), 3), -1)
+      if viewSettings['drawCentres'] == 'ACTIVE':
+        fills = np.where(isActive[:, None], (255, 140, 140), (140, 140, 255))
+      else:
+        for weight, potential in geoGridSettings.weightedPotentials():
+          if not weight.isVanishing() and potential.kind == viewSettings['drawCentres']:
+            distancesToLand, inverse = np.unique(cells['distancesToLand'], return_inverse=True)
+            fills = np.array([GeoGridRenderer.__blendColour(.5 * w, colour0=(230, 230, 230), colour1=(255, 0, 0)) for w in weight.forDistancesToLand(distancesToLand).tolist()]).reshape(-1, 3)[inverse.ravel()]
+    if fills is not None:
+      selected = np.flatnonzero(visible & (fills[:, 0] >= 0))
+      centres, radii, fills = xys[selected], radii[selected], [tuple(fill) for fill in fills[selected].tolist()]
+      if viewSettings['levelOfDetail'] and len(centres):
+        centres, radii, fills = viewSettings['levelOfDetail'].points(centres, radii, fills)
+      if len(centres):
+        image.points('centres', centres, radii, fills)
     if len(labels):
       image.group('labels', labels)
 
@@ -198,6 +275,37 @@ class GeoGridRenderer:
       texts.append(image.text_((viewSettings['widthOverall'] - 30, viewSettings['heightOverall'] - 20), f"energy = {innerEnergy:.2e} ({outerEnergy:.2e})", imageCoordinates=True, font=font, fill=(0, 0, 0), anchor='rs', align='right'))
       image.group('stepData', texts)
 
+  ## culling
+
+  @staticmethod
+  def __withinBounds(bounds, ps):
+    xMin, yMin, xMax, yMax = bounds
+    return (ps[:, 0] >= xMin) & (ps[:, 0] <= xMax) & (ps[:, 1] >= yMin) & (ps[:, 1] <= yMax)
+
+  @staticmethod
+  def __cullSegments(viewSettings, pss):
+    # keeps the segments whose bounding box intersects the bounds
+    if viewSettings['cullingBounds'] is None:
+      return pss
+    xMin, yMin, xMax, yMax = viewSettings['cullingBounds']
+    pssMin, pssMax = pss.min(axis=1), pss.max(axis=1)
+    return pss[(pssMax[:, 0] >= xMin) & (pssMin[:, 0] <= xMax) & (pssMax[:, 1] >= yMin) & (pssMin[:, 1] <= yMax)]
+
+  @staticmethod
+  def __cullLines(viewSettings, css):
+    # keeps the lines and polygons whose bounding box intersects the bounds
+    if viewSettings['cullingBounds'] is None:
+      return css
+    xMin, yMin, xMax, yMax = viewSettings['cullingBounds']
+    return [cs for cs in css if len(cs) and max(x for x, _ in cs) >= xMin and min(x for x, _ in cs) <= xMax and max(y for _, y in cs) >= yMin and min(y for _, y in cs) <= yMax]
+
+  ## helpers
+
+  @staticmethod
+  def __rows(indptr):
+    # the index of the cell for each value in compressed sparse row format
+    return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
   @staticmethod
   def __blendColour(value, colour0, colour1):
     return tuple(round((1 - value) * colour0[i] + value * colour1[i]) for i in range(0, 3))
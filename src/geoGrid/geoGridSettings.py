@@ -1,5 +1,7 @@
+import copy
 import hashlib
 import json
+import numpy as np
 
 from src.geoGrid.geoGridWeight import GeoGridWeight
 from src.interfaces.common.common import APP_FILE_FORMAT
@@ -15,13 +17,14 @@ from src.mechanics.potential.potentials import potentials
 # U = - \int F(r) dr
 
 class GeoGridSettings:
-  def __init__(self, initialProjection=PROJECTION.unprojected, resolution=3, dampingFactor=.96, stopThresholdMaxForceStrength=.001, stopThresholdCountDeficiencies=100, stopThresholdMaxSteps=5000, limitLatForEnergy=90, normalizeWeights=True):
+  def __init__(self, initialProjection=PROJECTION.unprojected, resolution=3, dampingFactor=.96, stopThresholdMaxForceStrength=.001, stopThresholdCountDeficiencies=100, stopThresholdMaxSteps=5000, limitLatForEnergy=90, normalizeWeights=True, adaptiveStep=False):
     self.initialProjection = initialProjection
     self.resolution = resolution
     self._dampingFactor = dampingFactor
     self._stopThresholdMaxForceStrength = stopThresholdMaxForceStrength
     self._stopThresholdCountDeficiencies = stopThresholdCountDeficiencies
     self._stopThresholdMaxSteps = stopThresholdMaxSteps
+    self._adaptiveStep = adaptiveStep # adapt the step (relative to the speed given by the damping factor) while optimizing; this changes the meaning of stopThresholdMaxForceStrength, which then refers to the effective speed (the speed multiplied by the factor of the step, see GeoGrid.stepFactor) instead of the speed given by the damping factor
     self.limitLatForEnergy = limitLatForEnergy
     self._typicalDistance = None
     self._normalizeWeights = normalizeWeights
@@ -43,6 +46,10 @@ class GeoGridSettings:
         'outerEnergy': self._energy[1],
         'sumOfWeights': self._sumOfWeights,
       }
+    # the key of the adaptive step is only included if active, such that the hashes of the settings remain unchanged otherwise
+    optional = {}
+    if self._adaptiveStep:
+      optional['adaptiveStep'] = True
     return {
       'fileFormat': APP_FILE_FORMAT,
       'fileFormatVersion': '1.0',
@@ -55,9 +62,14 @@ class GeoGridSettings:
       'limitLatForEnergy': self.limitLatForEnergy,
       'normalizeWeights': self._normalizeWeights,
       'weights': dict((potentialKind, weight.toJSON()) for (potentialKind, weight) in self._potentialsWeights.items()),
+      **optional,
       **transient,
     }
 
+  def cacheKey(self):
+    # the key changes whenever the non-transient settings change (weights are replaced when updated); compare the entries by identity
+    return (self.initialProjection, self.resolution, self._dampingFactor, self._stopThresholdMaxForceStrength, self._stopThresholdCountDeficiencies, self._stopThresholdMaxSteps, self._adaptiveStep, self.limitLatForEnergy, self._normalizeWeights, *self._potentialsWeights.values())
+
   def hash(self, includeTransient=False):
     return self.info(includeTransient=includeTransient)['hash']
 
@@ -96,6 +108,7 @@ class GeoGridSettings:
     self.updateStopThresholdMaxForceStrength(data['stopThresholdMaxForceStrength'])
     self.updateStopThresholdCountDeficiencies(data['stopThresholdCountDeficiencies'])
     self.updateStopThresholdMaxSteps(data['stopThresholdMaxSteps'])
+    self.updateAdaptiveStep(data['adaptiveStep'] if 'adaptiveStep' in data else False)
     self.updateLimitLatForEnergy(data['limitLatForEnergy'])
     self.updateNormalizeWeights(data['normalizeWeights'])
     self.updatePotentialsWeights(dict((potentialKind, GeoGridWeight.fromJSON(weightData)) for (potentialKind, weightData) in data['weights'].items()))
@@ -128,6 +141,10 @@ class GeoGridSettings:
     self._updated()
     self._stopThresholdMaxSteps = stopThresholdMaxSteps
 
+  def updateAdaptiveStep(self, adaptiveStep):
+    self._updated()
+    self._adaptiveStep = adaptiveStep
+
   def updateLimitLatForEnergy(self, limitLatForEnergy):
     self._updated()
     self.limitLatForEnergy = limitLatForEnergy
@@ -149,23 +166,27 @@ class GeoGridSettings:
     if self._sumOfWeights is None and self._normalizeWeights:
       if not self.__geoGrid:
         raise Exception('Execute GeoGridSettings.initWithGeoGrid first')
-      innerCells = [cell for cell in self.__geoGrid.cells().values() if cell._isActive and cell._selfAndAllNeighboursAreActive and cell.within(lat=self.limitLatForEnergy)]
+      topology = self.__geoGrid.topology()
+      isInner, _ = self.__geoGrid.energyMasks()
       # simulate with sum of weights = 1
       self._sumOfWeights = 1
       weightedPotentials = self.weightedPotentials()
       # compute sum of weights
-      self._sumOfWeights = 0
-      for weight, potential in weightedPotentials:
-        if weight.isVanishing() or not potential.considerForSumOfWeights:
-          continue
-        for cell in innerCells:
-          self._sumOfWeights += weight.forCell(cell)
-      self._sumOfWeights /= len(innerCells)
+      self._sumOfWeights = sum(float(np.sum(weight.forCells(topology)[isInner])) for weight, potential in weightedPotentials if not weight.isVanishing() and potential.considerForSumOfWeights) / np.count_nonzero(isInner)
     weightedPotentials = [(self._potentialsWeights[potential.kind], potential) for potential in self.potentials if self._potentialsWeights[potential.kind] is not None]
     for weight, potential in weightedPotentials:
       weight.setSumOfWeights(self._sumOfWeights if self._normalizeWeights and potential.considerForSumOfWeights else 1)
     return weightedPotentials
 
+  def snapshot(self):
+    # a copy which is not changed by the optimization, e.g., for rendering in another thread: the sum of weights is resolved before the weights are copied, and the copy is detached from the grid
+    if self.__geoGrid is not None:
+      self.weightedPotentials()
+    settings = copy.copy(self)
+    settings._potentialsWeights = dict((potentialKind, weight.copy() if weight is not None else None) for potentialKind, weight in self._potentialsWeights.items())
+    settings.__geoGrid = None
+    return settings
+
   ## init
 
   def initWithGridStats(self, gridStats):
@@ -0,0 +1,100 @@
+import numpy as np
+
+from src.geometry.common import Common
+from src.geometry.geo import Geo
+from src.geoGrid.geoGridCell import GeoGridCell
+from src.mechanics.forces import Forces
+
+class GeoGridState:
+  # the mutable state of an optimization (positions, forces, and energies), which references an immutable topology
+  def __init__(self, topology):
+    self.topology = topology
+    n = len(topology)
+    # positions
+    self.xs = np.array([Geo.radiusEarth * Common.deg2rad(lon) for lon in topology._lons], dtype=np.float64)
+    self.ys = np.array([Geo.radiusEarth * Common.deg2rad(lat) for lat in topology._lats], dtype=np.float64)
+    self._xs = memoryview(self.xs)
+    self._ys = memoryview(self.ys)
+    # forces: the batches of forces (see Forces) computed so far, and the forces added cell by cell (by potentials that are not vectorized)
+    self._forcesNext = []
+    self._forcesPending = [[] for _ in range(n)]
+    self.__forcesNextSum = None
+    self._xForcesNext = None
+    self._yForcesNext = None
+    # energies and weights (as arrays aligned with the cells), by kind of potential
+    self._energy = {}
+    self._energyWeight = {}
+    # cells
+    self.__cells = None
+
+  ## forces
+
+  def resetForcesNext(self):
+    self._forcesNext = []
+    self._forcesPending = [[] for _ in range(len(self.topology))]
+    self.__forcesNextSum = None
+
+  def addForces(self, forces):
+    self._forcesNext.append(forces)
+    self.__forcesNextSum = None
+
+  def addPendingForces(self, kind):
+    # collect the forces added cell by cell into a batch
+    forces = Forces.fromForces(kind, [force for forcesPending in self._forcesPending for force in forcesPending], self.topology.indexById2())
+    self._forcesPending = [[] for _ in range(len(self.topology))]
+    self.addForces(forces)
+    return forces
+
+  def forcesNext(self):
+    # the sums of the forces by cell, which are summed up in the order in which the forces have been added
+    if self.__forcesNextSum is None:
+      n = len(self.topology)
+      if len(self._forcesNext) > 0:
+        froms = np.concatenate([forces.froms for forces in self._forcesNext])
+        xs = np.bincount(froms, weights=np.concatenate([forces.xs for forces in self._forcesNext]), minlength=n)
+        ys = np.bincount(froms, weights=np.concatenate([forces.ys for forces in self._forcesNext]), minlength=n)
+      else:
+        xs, ys = np.zeros(n), np.zeros(n)
+      self.__forcesNextSum = xs, ys
+      self._xForcesNext = memoryview(xs)
+      self._yForcesNext = memoryview(ys)
+    return self.__forcesNextSum
+
+  def applyForces(self):
+    xs, ys = self.forcesNext()
+    self.xs += xs
+    self.ys += ys
+
+  ## snapshots
+
+  def snapshot(self):
+    # a copy of the positions, forces, and energies, in order to roll back a step (the batches of forces are not modified once added, and can thus be shared)
+    return self.xs.copy(), self.ys.copy(), list(self._forcesNext), dict(self._energy), dict(self._energyWeight)
+
+  def restore(self, snapshot):
+    # the arrays of the positions are updated in place, because the cells reference them
+    xs, ys, forcesNext, energy, energyWeight = snapshot
+    self.xs[:] = xs
+    self.ys[:] = ys
+    self._forcesNext = list(forcesNext)
+    self._forcesPending = [[] for _ in range(len(self.topology))]
+    self.__forcesNextSum = None
+    self._energy = dict(energy)
+    self._energyWeight = dict(energyWeight)
+
+  ## energies
+
+  def energies(self, kindOfPotential, weighted=False):
+    # the energies of all cells, for one kind of potential or the sum of all kinds ('ALL')
+    if kindOfPotential == 'ALL':
+      return sum((self._energyWeight[kind] * energies if weighted else energies for kind, energies in self._energy.items()), np.zeros(len(self.topology)))
+    if kindOfPotential not in self._energy:
+      raise Exception('The energy has not yet been computed')
+    return self._energyWeight[kindOfPotential] * self._energy[kindOfPotential] if weighted else self._energy[kindOfPotential]
+
+  ## cells
+
+  def cells(self):
+    if self.__cells is None:
+      self.__cells = dict((id2, GeoGridCell(self.topology, self, i)) for i, id2 in enumerate(self.topology._id2s))
+    return self.__cells
@@ -0,0 +1,373 @@
+import gzip
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import os
+import pickle
+import shapely
+import sys
+
+from src.common.timer import timer
+from src.geometry.cartesian import Point
+from src.geometry.common import Common
+from src.geometry.dggrid import DGGRID
+from src.geometry.geo import Geo
+from src.geometry.geoVectorized import GeoVectorized
+from src.geometry.naturalEarth import NaturalEarth
+
+class GeoGridTopology:
+  # the topology of the grid is immutable, and it is thus shared by all grids of the same resolution in a process, and by several processes via shared memory
+  __topologies = {}
+
+  def __init__(self, resolution, gridStats, arrays, sharedMemory=None):
+    self.resolution = resolution
+    self.gridStats = gridStats
+    self.__arrays = arrays
+    self.__sharedMemory = sharedMemory
+    self.__sharedMemoryOwner = False
+    self.__sharedMemoryLayout = None
+    for array in arrays.values():
+      array.flags.writeable = False
+    # memory views for fast access to single values without copying the data
+    self._id1s = memoryview(arrays['id1s'])
+    self._id2s = memoryview(arrays['id2s'])
+    self._lons = memoryview(arrays['lons'])
+    self._lats = memoryview(arrays['lats'])
+    self._isActive = memoryview(arrays['isActive'])
+    self._selfAndAllNeighboursAreActive = memoryview(arrays['selfAndAllNeighboursAreActive'])
+    self._isHexagon = memoryview(arrays['isHexagon'])
+    self._noTriangles = memoryview(arrays['noTriangles'])
+    self._distancesToLand = memoryview(arrays['distancesToLand'])
+    # objects which are only created when needed (once per process)
+    self.__indexById2 = None
+    self.__centresOriginal = None
+    self.__polygonsOriginal = None
+    self.__neighbours = None
+    self.__neighboursIndices = None
+    self.__neighboursIndicesRows = None
+    self.__neighbourTriangles = None
+    self.__neighboursBearings2 = None
+    self.__neighboursGeoDistances = None
+    self.__neighboursGeoBearings = None
+    self.__ballTree = None
+    self.__ballTreeCellsId1s = None
+
+  def __len__(self):
+    return len(self._id2s)
+
+  def arrays(self):
+    return self.__arrays
+
+  ## load and create
+
+  @staticmethod
+  def forResolution(resolution, callbackStatus=lambda status, energy: None):
+    if resolution not in GeoGridTopology.__topologies:
+      GeoGridTopology.__topologies[resolution] = GeoGridTopology.load(resolution, callbackStatus=callbackStatus)
+    return GeoGridTopology.__topologies[resolution]
+
+  @staticmethod
+  def register(topology):
+    # use the topology for all grids of its resolution created in this process
+    GeoGridTopology.__topologies[topology.resolution] = topology
+
+  @staticmethod
+  def load(resolution, callbackStatus=lambda status, energy: None):
+    filename = 'grid-{resolution}.pickle.gzip'.format(resolution=resolution)
+    if os.path.exists(filename):
+      callbackStatus('loading cells and indices from proxy file ...', None)
+      with timer('load data from proxy file'):
+        with gzip.open(filename, 'rb') as f:
+          return GeoGridTopology(**pickle.load(f))
+    callbackStatus('creating cells and indices, and save them to proxy file ...', None)
+    with timer('create cells'):
+      topology = GeoGridTopology.create(resolution)
+    with timer('save data to proxy file'):
+      with gzip.open(filename, 'wb') as f:
+        pickle.dump({
+          'resolution': topology.resolution,
+          'gridStats': topology.gridStats,
+          'arrays': topology.arrays(),
+        }, f)
+    return topology
+
+  @staticmethod
+  def create(resolution):
+    dggrid = DGGRID(executable='DGGRID/build/src/apps/dggrid/dggrid')
+    # get grid stats
+    gridStats, _ = dggrid.stats(resolution=resolution)
+    # get grid cells
+    dggridCells, _ = dggrid.generate(resolution=resolution)
+    dggridCells = list(dggridCells.values())
+    n = len(dggridCells)
+    # create cells: the cells are copied with longitudes shifted by -360 and 360, and the copy k (0 being the original cell) of the DGGRID cell j has the index k * n + j
+    with timer('create cells from DGGRID cells'):
+      ids = np.array([dggridCell.id for dggridCell in dggridCells], dtype=np.int64)
+      centres = shapely.get_coordinates([dggridCell.centre for dggridCell in dggridCells])
+      id1s = np.tile(ids, 3)
+      id2s = np.concatenate([ids, ids.max() + 1 + np.arange(2 * n, dtype=np.int64)])
+      lons = np.concatenate([centres[:, 0], centres[:, 0] - 360, centres[:, 0] + 360])
+      lats = np.tile(centres[:, 1], 3)
+      isPole = (np.abs(centres[:, 0]) < 1e-10) & ((np.abs(centres[:, 1] - 90) < 1e-10) | (np.abs(centres[:, 1] + 90) < 1e-10))
+    # identify neighbours in cartesian space
+    with timer('identify neighbours'):
+      # the neighbours of all cells (by DGGRID cell), and the candidates for each neighbour (its copies)
+      indexById1 = dict((id1, j) for j, id1 in enumerate(ids.tolist()))
+      counts = np.tile(np.array([len(dggridCell.neighbours) for dggridCell in dggridCells], dtype=np.int64), 3)
+      rows = np.repeat(np.arange(3 * n), counts)
+      candidates = np.tile(np.array([indexById1[id1] for dggridCell in dggridCells for id1 in dggridCell.neighbours], dtype=np.int64), 3)[:, None] + n * np.arange(3)
+      # the nearest copy is the neighbour, except for the poles, which are always the original cells
+      dx = lons[candidates] - lons[rows, None]
+      dy = lats[candidates] - lats[rows, None]
+      neighbours = candidates[np.arange(len(rows)), np.argmin(np.sqrt(dx * dx + dy * dy), axis=1)]
+      neighbours = np.where(isPole[candidates[:, 0]], candidates[:, 0], neighbours)
+      # cells with neighbours on the other side of the map have no neighbours
+      hasNeighbours = np.bincount(rows, weights=np.abs(lons[neighbours] - lons[rows]) > 270, minlength=3 * n) == 0
+    # identify cells to keep
+    with timer('identify cells to keep'):
+      bbox = shapely.box(-180, -90 - 1e-10, 180, 90 + 1e-10)
+      shapely.prepare(bbox)
+      isActive = shapely.contains_xy(bbox, lons, lats) & hasNeighbours
+      selfAndAllNeighboursAreActive = isActive & (np.bincount(rows, weights=~isActive[neighbours], minlength=3 * n) == 0)
+      keep = isActive.copy()
+      keep[neighbours[isActive[rows]]] = True
+      indices = np.flatnonzero(keep)
+    # init bearings, poles, and additional information
+    with timer('init neighbours and additional information'):
+      indptr = np.concatenate([[0], np.cumsum(counts)]).tolist()
+      lonsList, latsList = lons.tolist(), lats.tolist()
+      neighboursBearings2 = []
+      noTriangles = []
+      distancesToLand = {}
+      for i in indices.tolist():
+        j = i % n
+        ns = neighbours[indptr[i]:indptr[i + 1]].tolist() if hasNeighbours[i] else None
+        neighboursBearings2.append(GeoGridTopology.__bearings2([Geo.bearing(Point(lonsList[i], latsList[i]), Point(lonsList[k], latsList[k])) for k in ns]) if ns is not None else None)
+        noTriangles.append(GeoGridTopology.__noTriangle(ns, lonsList, latsList[i] > 0) if i == j and isPole[j] and ns is not None else -1)
+        if j not in distancesToLand:
+          distancesToLand[j] = NaturalEarth.distanceToLand(dggridCells[j].centre)
+      # the polygons (without the closing coordinates) of the cells to keep, shifted like the cells
+      polygons = [dggridCell.polygon for dggridCell in dggridCells]
+      lengths = shapely.get_num_coordinates(polygons)
+      lengthsKept = lengths[indices % n] - 1
+      coordinates = shapely.get_coordinates(polygons)[np.repeat((np.cumsum(lengths) - lengths)[indices % n], lengthsKept) + np.arange(lengthsKept.sum()) - np.repeat(np.cumsum(lengthsKept) - lengthsKept, lengthsKept)]
+      shifted = np.repeat(indices >= n, lengthsKept)
+      coordinates[shifted, 0] += np.repeat(np.where(indices < 2 * n, -360, 360), lengthsKept)[shifted]
+    # the neighbours (by id2) of the cells to keep
+    edgesKept = keep[rows] & hasNeighbours[rows]
+    # the geodesic tables along the edges between cells to keep (as in neighboursIndices)
+    with timer('compute geodesic tables'):
+      edgesGeodesic = edgesKept & keep[neighbours]
+      geoDistances, geoBearings = GeoGridTopology.__geodesics(lons, lats, rows[edgesGeodesic], neighbours[edgesGeodesic])
+    return GeoGridTopology(resolution, gridStats, {
+      'id1s': id1s[indices],
+      'id2s': id2s[indices],
+      'lons': lons[indices],
+      'lats': lats[indices],
+      'isActive': isActive[indices],
+      'selfAndAllNeighboursAreActive': selfAndAllNeighboursAreActive[indices],
+      'isHexagon': np.tile(np.array([dggridCell.isHexagon() for dggridCell in dggridCells], dtype=bool), 3)[indices],
+      'noTriangles': np.array(noTriangles, dtype=np.int64),
+      'distancesToLand': np.array([distancesToLand[i % n] for i in indices.tolist()], dtype=np.float64),
+      'polygonsIndptr': np.concatenate([[0], np.cumsum(lengthsKept)]).astype(np.int64),
+      'polygons': coordinates.reshape(-1, 2),
+      'hasNeighbours': hasNeighbours[indices],
+      'neighboursIndptr': np.concatenate([[0], np.cumsum(np.where(hasNeighbours, counts, 0)[indices])]).astype(np.int64),
+      'neighbours': id2s[neighbours[edgesKept]],
+      'neighboursBearings2Indptr': np.cumsum([0] + [len(bs) if bs is not None else 0 for bs in neighboursBearings2], dtype=np.int64),
+      'neighboursBearings2': np.array([b for bs in neighboursBearings2 if bs is not None for b in bs], dtype=np.float64).reshape(-1, 3),
+      'neighboursGeoDistances': geoDistances,
+      'neighboursGeoBearings': geoBearings,
+    })
+
+  @staticmethod
+  def __geodesics(lons, lats, rows, neighbours):
+    # the geodesic distances from the neighbours to the cells, and the bearings from the cells to the neighbours
+    # the y axis of the Cartesian coordinate system is inverted, and the bearings are thus stored negated, such that they can be compared to Cartesian bearings
+    geoDistances = GeoVectorized.distance(lons[neighbours], lats[neighbours], lons[rows], lats[rows])
+    geoBearings = GeoVectorized.normalizeAngle(-GeoVectorized.bearing(lons[rows], lats[rows], lons[neighbours], lats[neighbours]))
+    return geoDistances, geoBearings
+
+  @staticmethod
+  def __bearings2(neighboursBearings):
+    # the ranges of bearings between consecutive neighbours, split where they wrap around
+    neighboursBearings2 = []
+    for i, (b0, b1) in enumerate(zip(neighboursBearings, neighboursBearings[1:] + [neighboursBearings[0]])):
+      if b0 >= b1:
+        neighboursBearings2.append((i, b0, b1))
+      else:
+        neighboursBearings2.append((i, b0, 0))
+        neighboursBearings2.append((i, Common._2pi, b1))
+    return neighboursBearings2
+
+  @staticmethod
+  def __noTriangle(neighbours, lons, isNorth):
+    # the triangle at the pole that is crossing the antimeridian
+    for k in range(len(neighbours)):
+      if (1 if isNorth else -1) * (lons[neighbours[(k + 1) % len(neighbours)]] - lons[neighbours[k]]) < 0:
+        return k
+    return -1
+
+  ## shared memory
+
+  def toSharedMemory(self):
+    # copy the arrays to shared memory, and return a handle, which can be passed to other processes (which only attach to the shared memory, while this process unlinks it, see releaseSharedMemory)
+    if self.__sharedMemoryLayout is None:
+      layout = []
+      size = 0
+      for name, array in self.__arrays.items():
+        layout.append((name, array.dtype.str, array.shape, size))
+        size += -(-array.nbytes // 8) * 8
+      sharedMemory = SharedMemory(create=True, size=max(size, 1))
+      for name, dtype, shape, offset in layout:
+        np.ndarray(shape, dtype=dtype, buffer=sharedMemory.buf, offset=offset)[...] = self.__arrays[name]
+      self.__sharedMemory = sharedMemory
+      self.__sharedMemoryOwner = True
+      self.__sharedMemoryLayout = layout
+    return {
+      'name': self.__sharedMemory.name,
+      'layout': self.__sharedMemoryLayout,
+      'resolution': self.resolution,
+      'gridStats': self.gridStats,
+    }
+
+  @staticmethod
+  def fromSharedMemory(handle):
+    sharedMemory = GeoGridTopology.__attachSharedMemory(handle['name'])
+    arrays = dict((name, np.ndarray(shape, dtype=dtype, buffer=sharedMemory.buf, offset=offset)) for name, dtype, shape, offset in handle['layout'])
+    return GeoGridTopology(handle['resolution'], handle['gridStats'], arrays, sharedMemory=sharedMemory)
+
+  @staticmethod
+  def __attachSharedMemory(name):
+    # only the process that has created the shared memory (toSharedMemory) unlinks it (releaseSharedMemory), such that the processes attaching to it must not register it with their resource tracker, which would unlink it when they exit (and warn about leaked shared memory)
+    if sys.version_info >= (3, 13):
+      return SharedMemory(name=name, track=False)
+    # before Python 3.13, attaching always registers the shared memory, which is suppressed while attaching
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+      return SharedMemory(name=name)
+    finally:
+      resource_tracker.register = register
+
+  def releaseSharedMemory(self):
+    # only the process that has created the shared memory is allowed to release it
+    if self.__sharedMemoryOwner:
+      self.__sharedMemory.close()
+      self.__sharedMemory.unlink()
+      self.__sharedMemory = None
+      self.__sharedMemoryOwner = False
+      self.__sharedMemoryLayout = None
+
+  ## access
+
+  def indexById2(self):
+    if self.__indexById2 is None:
+      self.__indexById2 = dict((id2, i) for i, id2 in enumerate(self._id2s))
+    return self.__indexById2
+
+  def centreOriginal(self, i):
+    if self.__centresOriginal is None:
+      self.__centresOriginal = shapely.points(self.__arrays['lons'], self.__arrays['lats']).tolist()
+    return self.__centresOriginal[i]
+
+  def polygonOriginal(self, i):
+    if self.__polygonsOriginal is None:
+      indptr = self.__arrays['polygonsIndptr'].tolist()
+      polygons = self.__arrays['polygons']
+      self.__polygonsOriginal = [shapely.Polygon(polygons[indptr[j]:indptr[j + 1]]) for j in range(len(self))]
+    return self.__polygonsOriginal[i]
+
+  def neighbours(self, i):
+    if self.__neighbours is None:
+      indptr = self.__arrays['neighboursIndptr'].tolist()
+      neighbours = self.__arrays['neighbours'].tolist()
+      self.__neighbours = [neighbours[indptr[j]:indptr[j + 1]] if hasNeighbours else None for j, hasNeighbours in enumerate(self.__arrays['hasNeighbours'].tolist())]
+    return self.__neighbours[i]
+
+  def neighboursIndices(self):
+    # the neighbours in compressed sparse row format, but referring to the indices of the cells instead of their id2
+    if self.__neighboursIndices is None:
+      indexById2 = self.indexById2()
+      indices = np.fromiter((indexById2.get(id2, -1) for id2 in self.__arrays['neighbours'].tolist()), dtype=np.int64, count=len(self.__arrays['neighbours']))
+      valid = indices >= 0
+      rows = np.repeat(np.arange(len(self)), np.diff(self.__arrays['neighboursIndptr']))
+      indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[valid], minlength=len(self)))]).astype(np.int64)
+      indices = indices[valid]
+      indptr.flags.writeable = False
+      indices.flags.writeable = False
+      self.__neighboursIndices = indptr, indices
+    return self.__neighboursIndices
+
+  def neighboursIndicesRows(self):
+    # the index of the cell for each entry of neighboursIndices
+    if self.__neighboursIndicesRows is None:
+      indptr, _ = self.neighboursIndices()
+      self.__neighboursIndicesRows = np.repeat(np.arange(len(self)), np.diff(indptr))
+      self.__neighboursIndicesRows.flags.writeable = False
+    return self.__neighboursIndicesRows
+
+  def neighbourTriangles(self):
+    # the triangles of the cells and two consecutive neighbours (as GeoGridCell.getNeighbourTriangles) whose corners are all part of the grid, as three arrays of indices of the cells
+    if self.__neighbourTriangles is None:
+      indexById2 = self.indexById2()
+      neighbours = np.fromiter((indexById2.get(id2, -1) for id2 in self.__arrays['neighbours'].tolist()), dtype=np.int64, count=len(self.__arrays['neighbours']))
+      indptr = self.__arrays['neighboursIndptr']
+      counts = np.diff(indptr)
+      rows = np.repeat(np.arange(len(self)), counts)
+      ks = np.arange(len(neighbours)) - indptr[rows]
+      nexts = neighbours[indptr[rows] + (ks + 1) % counts[rows]]
+      isTriangle = (ks != self.__arrays['noTriangles'][rows]) & (neighbours >= 0) & (nexts >= 0)
+      self.__neighbourTriangles = rows[isTriangle], neighbours[isTriangle], nexts[isTriangle]
+      for array in self.__neighbourTriangles:
+        array.flags.writeable = False
+    return self.__neighbourTriangles
+
+  def neighboursBearings2(self, i):
+    if self.__neighboursBearings2 is None:
+      indptr = self.__arrays['neighboursBearings2Indptr'].tolist()
+      bearings2 = self.__arrays['neighboursBearings2'].tolist()
+      self.__neighboursBearings2 = [[(int(k), b0, b1) for k, b0, b1 in bearings2[indptr[j]:indptr[j + 1]]] if hasNeighbours else None for j, hasNeighbours in enumerate(self.__arrays['hasNeighbours'].tolist())]
+    return self.__neighboursBearings2[i]
+
+  def neighboursGeodesics(self):
+    # the geodesic distances and bearings along the edges of neighboursIndices, which only depend on the original positions of the cells
+    if 'neighboursGeoDistances' not in self.__arrays:
+      # proxy files created before the geodesic tables were introduced
+      _, indices = self.neighboursIndices()
+      geoDistances, geoBearings = GeoGridTopology.__geodesics(self.__arrays['lons'], self.__arrays['lats'], self.neighboursIndicesRows(), indices)
+      geoDistances.flags.writeable = False
+      geoBearings.flags.writeable = False
+      self.__arrays['neighboursGeoDistances'] = geoDistances
+      self.__arrays['neighboursGeoBearings'] = geoBearings
+    return self.__arrays['neighboursGeoDistances'], self.__arrays['neighboursGeoBearings']
+
+  def neighboursGeoDistances(self, i):
+    if self.__neighboursGeoDistances is None:
+      self.__neighboursGeoDistances = self.__splitByNeighbours(self.neighboursGeodesics()[0])
+    return self.__neighboursGeoDistances[i]
+
+  def neighboursGeoBearings(self, i):
+    if self.__neighboursGeoBearings is None:
+      self.__neighboursGeoBearings = self.__splitByNeighbours(self.neighboursGeodesics()[1])
+    return self.__neighboursGeoBearings[i]
+
+  def __splitByNeighbours(self, values):
+    indptr = self.neighboursIndices()[0].tolist()
+    values = values.tolist()
+    return [values[indptr[j]:indptr[j + 1]] for j in range(len(self))]
+
+  def ballTree(self):
+    if self.__ballTree is None:
+      from sklearn.neighbors import BallTree
+      with timer('compute ball tree'):
+        # the indices of the cells (including the copies shifted in longitude) by id1
+        cellsById1 = {}
+        for i, id1 in enumerate(self._id1s):
+          if id1 not in cellsById1:
+            cellsById1[id1] = []
+          cellsById1[id1].append(i)
+        indices = [i for i, (id1, id2) in enumerate(zip(self._id1s, self._id2s)) if id1 == id2]
+        self.__ballTreeCellsId1s = [cellsById1[self._id1s[i]] for i in indices]
+        self.__ballTree = BallTree([(Common.deg2rad(self._lats[i]), Common.deg2rad(self._lons[i])) for i in indices], metric='haversine')
+    return self.__ballTree, self.__ballTreeCellsId1s
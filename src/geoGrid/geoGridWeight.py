@@ -1,4 +1,4 @@
-import math
+import numpy as np
 
 from src.geometry.common import Common
 
@@ -11,7 +11,8 @@ class GeoGridWeight:
     self.__distanceTransitionStart = distanceTransitionStart
     self.__distanceTransitionEnd = distanceTransitionEnd
     self.__sumOfWeights = None
-    self.__cache = {}
+    self.__weightsForTopology = None
+    self.__weightsForTopologyNormalized = None
 
   def toJSON(self, includeTransient=False):
     data = {
@@ -34,6 +35,12 @@ class GeoGridWeight:
   def fromJSON(data):
     return GeoGridWeight(**data)
 
+  def copy(self):
+    # a copy with the same sum of weights, which does not share the cached weights
+    weight = GeoGridWeight.fromJSON(self.toJSON())
+    weight.setSumOfWeights(self.__sumOfWeights)
+    return weight
+
   def isActive(self):
     return self.__active
   def weightLand(self):
@@ -54,28 +61,28 @@ class GeoGridWeight:
     return not self.isActive() or (self.__weightLand == 0 and (not self.__weightOceanActive or self.__weightOcean == 0))
 
   def forCell(self, cell):
-    return self.forCellData({
-      'distanceToLand': cell._distanceToLand,
-    })
-  def forCellData(self, cellData):
+    return self.forCells(cell._topology)[cell._index]
+  def forCells(self, topology):
+    # the weights of all cells of the topology as an array aligned with the cells, which is computed only once for the topology (the weight is replaced rather than changed when the settings change) and the sum of weights
+    if self.__weightsForTopology is None or self.__weightsForTopology[0] is not topology:
+      self.__weightsForTopology = topology, self.__forDistancesToLand(np.asarray(topology.arrays()['distancesToLand']))
+      self.__weightsForTopologyNormalized = None
+    if self.__weightsForTopologyNormalized is None or self.__weightsForTopologyNormalized[0] != self.__sumOfWeights:
+      weights = self.__weightsForTopology[1] / self.__sumOfWeights
+      weights.flags.writeable = False
+      self.__weightsForTopologyNormalized = self.__sumOfWeights, weights
+    return self.__weightsForTopologyNormalized[1]
+  def forDistancesToLand(self, distancesToLand):
+    return self.__forDistancesToLand(np.asarray(distancesToLand, dtype=np.float64)) / self.__sumOfWeights
+  def __forDistancesToLand(self, distancesToLand):
     if not self.isActive():
-      return 0
-    if cellData['distanceToLand'] in self.__cache:
-      return self.__cache[cellData['distanceToLand']] / self.__sumOfWeights
-    weight = None
+      return np.zeros(len(distancesToLand))
     if not self.__weightOceanActive or self.__weightLand == self.__weightOcean:
-      weight = self.__weightLand
-    else:
-      weight = self._easeInOutSine(cellData['distanceToLand'], xStart=self.__distanceTransitionStart, xEnd=self.__distanceTransitionEnd, yStart=self.__weightLand, yEnd=self.__weightOcean)
-    self.__cache[cellData['distanceToLand']] = weight
-    return weight / self.__sumOfWeights
+      return np.full(len(distancesToLand), self.__weightLand, dtype=np.float64)
+    return self._easeInOutSine(distancesToLand, xStart=self.__distanceTransitionStart, xEnd=self.__distanceTransitionEnd, yStart=self.__weightLand, yEnd=self.__weightOcean)
 
   @staticmethod
   def _easeInOutSine(x, xStart=0, xEnd=1, yStart=0, yEnd=1):
-    if x <= xStart:
-      return yStart
-    if x >= xEnd:
-      return yEnd
-    x = (x - xStart) / (xEnd - xStart)
-    y = - (math.cos(Common._pi * x) - 1) / 2
-    return yStart + y * (yEnd - yStart)
+    # for an array of x
+    y = - (np.cos(Common._pi * ((x - xStart) / (xEnd - xStart))) - 1) / 2
+    return np.where(x <= xStart, yStart, np.where(x >= xEnd, yEnd, yStart + y * (yEnd - yStart))).astype(np.float64)
@@ -2,6 +2,8 @@ import os
 import shapely
 import subprocess
 
+from src.common.metrics import metrics
+
 class DGGRIDCell:
   def __init__(self, id):
     self.id = id
@@ -43,6 +45,7 @@ class DGGRID:
     self.__removeTmpWorkingDirAfterUse = removeTmpWorkingDirAfterUse
 
   def __run(self, parameters):
+    metrics.count('DGGRID invocations')
     metaFile = 'info.meta'
     if not os.path.exists(self.__tmpWorkingDir):
       os.mkdir(self.__tmpWorkingDir)
@@ -1,5 +1,4 @@
 import math
-import shapely
 
 from src.geometry.cartesian import Point
 from src.geometry.common import Common
@@ -94,19 +93,27 @@ class Geo:
   @staticmethod
   # segmentation length in km
   def segmentize(geometry, segmentation=10000):
+    import shapely
     maxSegmentInDegree = segmentation * 360 / (Common._pi * 2 * Geo.radiusEarth)
     return [shapely.segmentize(g, max_segment_length=maxSegmentInDegree) for g in (geometry if isinstance(geometry, list) else [geometry])]
 
   class PreparedForDistanceTo:
     def __init__(self, geometry, segmentation=10000):
+      import shapely
       # the area is compared in the degree coordinate system, not in real area on the Earth's surface; this is only an approximation but improves running times sufficiently well
       geometry = sorted(geometry, key=lambda g: shapely.area(g)) if isinstance(geometry, list) else [geometry]
       self.__geometries = {
         1: Geo.segmentize(geometry, segmentation=segmentation),
         10: Geo.segmentize(geometry, segmentation=10 * segmentation),
       }
+      self.__coordinates = {}
     def geometry(self, k):
       return self.__geometries[k]
+    def coordinates(self, k):
+      # the coordinates of the exteriors (without the closing coordinates), which are costly to extract from the geometries
+      if k not in self.__coordinates:
+        self.__coordinates[k] = [g.exterior.coords[:-1] for g in self.__geometries[k]]
+      return self.__coordinates[k]
 
   @staticmethod
   def distanceTo(p, geometry, segmentation=10000):
@@ -120,10 +127,10 @@ class Geo:
     pss = []
     segmentationMultiplier = 10
     segmentationDiff = segmentationMultiplier * segmentation / 2
-    for g in gs.geometry(segmentationMultiplier):
+    for coordinates in gs.coordinates(segmentationMultiplier):
       skip = 0
       pss.append([])
-      for p2 in g.exterior.coords[:-1]:
+      for p2 in coordinates:
         if skip > 0:
           skip -= 1
           pss[-1].append((p2, None))
@@ -0,0 +1,73 @@
+import numpy as np
+
+from src.geometry.common import Common
+from src.geometry.geo import Geo
+
+class GeoVectorized:
+  # the functions of Geo for NumPy arrays of longitudes and latitudes (in degrees), which broadcast like NumPy operations
+  # the operations are the same as for the scalar versions, such that the results agree up to the rounding of atan2 and acos (which NumPy and math may round differently in the last bit)
+
+  @staticmethod
+  def normalizeAngle(a, intervalStart=0): # in radiant
+    return np.mod(a + Common._10pi - intervalStart, Common._2pi) + intervalStart
+
+  @staticmethod
+  def deg2rad(x):
+    return np.asarray(x, dtype=np.float64) * Common._pi_180
+
+  @staticmethod
+  def distance(startLons, startLats, endLons, endLats): # in metres
+    startX = GeoVectorized.deg2rad(startLons)
+    startY = GeoVectorized.deg2rad(startLats)
+    endX = GeoVectorized.deg2rad(endLons)
+    endY = GeoVectorized.deg2rad(endLats)
+    # spherical law of cosines (as Geo.distanceLawOfCosines)
+    a = np.sin((endY - startY) / 2)**2 + np.cos(startY) * np.cos(endY) * np.sin((endX - startX) / 2)**2
+    return Geo.radiusEarth * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+  @staticmethod
+  def bearing(startLons, startLats, endLons, endLats): # in radiant, negatively oriented, north is 0
+    startX = GeoVectorized.deg2rad(startLons)
+    startY = GeoVectorized.deg2rad(startLats)
+    endX = GeoVectorized.deg2rad(endLons)
+    endY = GeoVectorized.deg2rad(endLats)
+    y = np.sin(endX - startX) * np.cos(endY)
+    x = np.cos(startY) * np.sin(endY) - np.sin(startY) * np.cos(endY) * np.cos(endX - startX)
+    return GeoVectorized.normalizeAngle(np.arctan2(y, x))
+
+  @staticmethod
+  def areaOfTriangle(lons, lats): # in square metres
+    # lons and lats of shape (..., 3), containing the corners of the triangles
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    # compute spherical excess
+    e = np.full(lons.shape[:-1], -Common._pi)
+    for i, j, k in [[0, 1, 2], [1, 2, 0], [2, 0, 1]]:
+      eNew = GeoVectorized.normalizeAngle(GeoVectorized.bearing(lons[..., i], lats[..., i], lons[..., j], lats[..., j]) - GeoVectorized.bearing(lons[..., i], lats[..., i], lons[..., k], lats[..., k]))
+      e += np.where(eNew <= Common._pi, eNew, Common._2pi - eNew)
+    # Girard's theorem
+    return e * Geo.radiusEarth2
+
+  @staticmethod
+  def toUnitVectors(lons, lats):
+    x = GeoVectorized.deg2rad(lons)
+    y = GeoVectorized.deg2rad(lats)
+    return np.stack(np.broadcast_arrays(np.cos(y) * np.cos(x), np.cos(y) * np.sin(x), np.sin(y)), axis=-1)
+
+  @staticmethod
+  def distanceToSegment(lons, lats, startLons, startLats, endLons, endLats): # in metres
+    # the distance of the points to the great-circle segments from start to end (the shorter arc)
+    p = GeoVectorized.toUnitVectors(lons, lats)
+    a = GeoVectorized.toUnitVectors(startLons, startLats)
+    b = GeoVectorized.toUnitVectors(endLons, endLats)
+    n = np.cross(a, b)
+    lengthN = np.linalg.norm(n, axis=-1)
+    isDegenerate = lengthN < 1e-15
+    n = n / np.where(isDegenerate, 1, lengthN)[..., None]
+    # the nearest point of the great circle is within the segment if it is on the inner side of both end points
+    sinCrossTrack = np.sum(p * n, axis=-1)
+    c = p - sinCrossTrack[..., None] * n
+    isWithin = ~isDegenerate & (np.sum(np.cross(a, c) * n, axis=-1) >= 0) & (np.sum(np.cross(c, b) * n, axis=-1) >= 0)
+    distanceCrossTrack = Geo.radiusEarth * np.abs(np.arcsin(np.clip(sinCrossTrack, -1, 1)))
+    distanceEnds = np.minimum(GeoVectorized.distance(startLons, startLats, lons, lats), GeoVectorized.distance(endLons, endLats, lons, lats))
+    return np.where(isWithin, np.minimum(distanceCrossTrack, distanceEnds), distanceEnds)
@@ -1,7 +1,4 @@
 import os
-import requests
-import shapefile
-import shapely
 
 from src.common.timer import timer
 from src.geometry.geo import Geo
@@ -31,6 +28,7 @@ class NaturalEarth:
       os.mkdir(self.pathNaturalEarthData)
     if os.path.exists(self.fileZipNaturalEarthData):
       return self.fileZipNaturalEarthData
+    import requests
     with open(self.fileZipNaturalEarthData, 'wb') as file:
       with requests.get(self.urlNaturalEarthData) as request:
         file.write(request.content)
@@ -40,12 +38,14 @@ class NaturalEarth:
 
   def _data(self):
     if self._shpData is None:
+      import shapefile
       with timer('load natural earth data'):
         self._shpData = shapefile.Reader(NaturalEarth()._ensureNaturalEarthData())
     return self._shpData
 
   @staticmethod
   def __simplify(exteriors, interiors, tolerance):
+    import shapely
     exteriors = [shapely.simplify(shapely.Polygon(cs), tolerance) for cs in exteriors]
     if tolerance <= 2:
       exteriors = [cs.exterior.coords for cs in sorted(exteriors, key=lambda cs: cs.area)[-20:]]
@@ -55,6 +55,7 @@ class NaturalEarth:
 
   def _preparedData(self, simplifyTolerance='full'):
     if 'full' not in self._prepData:
+      import shapefile
       data = NaturalEarth.data()
       with timer('prepare natural earth data'):
         exteriors = []
@@ -79,6 +80,7 @@ class NaturalEarth:
 
   def _prepareGeometries(self):
     if self._prepGeometries is None:
+      import shapely
       self._prepGeometries = [shapely.Polygon(exterior) for exterior in NaturalEarth.preparedData()[0]]
       self._prepGeometries = [polygon for polygon in self._prepGeometries if Geo.areaOfPolygon(polygon) > 6e10 and polygon.bounds[1] >= -60]
     return self._prepGeometries
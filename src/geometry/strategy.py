@@ -1,5 +1,4 @@
 import math
-from pyproj import CRS, Transformer
 import statistics
 
 from src.geometry.geo import Geo
@@ -39,6 +38,8 @@ class CardinalDirections:
 
 def strategyForScale(corners=CARDINAL_DIRECTION.ALL, horizontal=True, vertical=True, diagonalUp=False, diagonalDown=False, degreeHorizontal=360, degreeVertical=180, degreeDiagonalUp=360, degreeDiagonalDown=360, epsilon=5):
   def _strategyForScale(projection):
+    if projection.transform is None:
+      from pyproj import CRS, Transformer
     transform = projection.transform if projection.transform is not None else Transformer.from_crs(CRS('EPSG:4326'), CRS(projection.srid), always_xy=True).transform
     maxX = max(abs(transform(*CardinalDirections.toCorner(corner, epsilon=epsilon))[0]) for corner in corners)
     maxY = max(abs(transform(*CardinalDirections.toCorner(corner, epsilon=epsilon))[1]) for corner in corners)
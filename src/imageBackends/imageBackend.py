@@ -1,3 +1,6 @@
+import itertools
+import numpy as np
+
 class ImageBackend:
   def __init__(self, projectToImage):
     self.__projectToImage = projectToImage
@@ -5,6 +8,11 @@ class ImageBackend:
   def _project(self, p, imageCoordinates=False):
     return p if imageCoordinates else self.__projectToImage(*p)
 
+  def _projectArray(self, ps):
+    # the projection to the image is affine, and can thus be applied to arrays of coordinates as well
+    xs, ys = self.__projectToImage(ps[..., 0], ps[..., 1])
+    return xs, ys
+
   def _manifest(self, x):
     return x
 
@@ -32,6 +40,27 @@ class ImageBackend:
   def polygon_(self, ps, imageCoordinates=False, stroke=None, fill=None, width=1):
     raise Exception('Not implemented')
 
+  ## bulk drawing (backends can override these methods to draw all elements at once)
+
+  def points(self, name, ps, rs, fills):
+    self.group(name, (self.point_(p, r, fill=fill) for p, r, fill in zip(ImageBackend._toList(ps), ImageBackend._toList(rs), fills)))
+
+  def lines(self, name, pss, stroke=(0, 0, 0), width=1):
+    self.group(name, (self.line_(ps, stroke=stroke, width=width) for ps in ImageBackend._toList(pss)))
+
+  @staticmethod
+  def _toList(xs):
+    # the elements are drawn one by one, such that arrays are converted to Python numbers first
+    # arrays of points are converted lazily from one flat list, which is much faster than creating large nested lists
+    if not isinstance(xs, np.ndarray):
+      return xs
+    if xs.ndim == 1:
+      return xs.tolist()
+    ps = zip(*[iter(xs.ravel().tolist())] * 2)
+    if xs.ndim == 2:
+      return ps
+    return (tuple(itertools.islice(ps, xs.shape[1])) for _ in range(len(xs)))
+
   def text(self, *args, **kwargs):
     self._manifest(self.text_(*args, **kwargs))
   def text_(self, p, text, imageCoordinates=False, font=None, fill=None, anchor='mm', align='left'):
@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+import itertools
+import numpy as np
+from PIL import Image
+
+from src.imageBackends.imageBackendPillow import ImageBackendPillow
+
+class ImageBackendRaster(ImageBackendPillow):
+  # draws points and lines in bulk: all coordinates are transformed to the image in one vectorized step, and the primitives are rasterized with anti-aliasing directly in the pixel array
+  # the remaining elements (polygons, texts, and large points) are drawn by Pillow
+  maxExtentVectorized = 4
+
+  def __init__(self, width, height, projectToImage, transparentBackground=True):
+    super().__init__(width, height, projectToImage, transparentBackground=transparentBackground)
+    # the pixels are kept as an array while drawing in bulk, and only written back to the image when Pillow draws
+    self.__pixels = None
+    self.__coverage = None
+    self.__colourIndices = None
+
+  def __pixelsArray(self):
+    if self.__pixels is None:
+      self.__pixels = np.array(super().im())
+    return self.__pixels
+
+  def __sync(self):
+    if self.__pixels is not None:
+      super().im().paste(Image.fromarray(self.__pixels))
+      self.__pixels = None
+
+  def point_(self, *args, **kwargs):
+    self.__sync()
+    return super().point_(*args, **kwargs)
+
+  def line_(self, *args, **kwargs):
+    self.__sync()
+    return super().line_(*args, **kwargs)
+
+  def polygon_(self, *args, **kwargs):
+    self.__sync()
+    return super().polygon_(*args, **kwargs)
+
+  def text_(self, *args, **kwargs):
+    self.__sync()
+    return super().text_(*args, **kwargs)
+
+  def save(self, pathAndFilename):
+    self.__sync()
+    return super().save(pathAndFilename)
+
+  def im(self):
+    self.__sync()
+    return super().im()
+
+  @staticmethod
+  def __toArray(pss, depth):
+    if isinstance(pss, np.ndarray):
+      return pss.astype(np.float64, copy=False).ravel()
+    # faster than np.asarray for long lists of tuples
+    flat = pss
+    for _ in range(depth):
+      flat = itertools.chain.from_iterable(flat)
+    return np.fromiter(flat, dtype=np.float64)
+
+  def points(self, name, ps, rs, fills):
+    if len(ps) == 0:
+      return
+    xs, ys = self._projectArray(ImageBackendRaster.__toArray(ps, 1).reshape(-1, 2))
+    rs = np.asarray(rs, dtype=np.float64)
+    extents = np.ceil(rs + .5).astype(np.int64)
+    # large points cover many pixels, and are thus drawn by Pillow
+    large = extents > ImageBackendRaster.maxExtentVectorized
+    for i in np.flatnonzero(large):
+      self.point_((xs[i], ys[i]), rs[i], imageCoordinates=True, fill=fills[i])
+    with self.__canvas(np.asarray(fills, dtype=np.float32)) as cover:
+      for extent in np.unique(extents[~large]):
+        selected = np.flatnonzero(extents == extent)
+        cxs, cys, crs = xs[selected], ys[selected], rs[selected]
+        pxs0, pys0 = np.floor(cxs).astype(np.int64), np.floor(cys).astype(np.int64)
+        for ox in range(-extent, extent + 1):
+          for oy in range(-extent, extent + 1):
+            pxs, pys = pxs0 + ox, pys0 + oy
+            cover(pxs, pys, crs + .5 - np.hypot(pxs + .5 - cxs, pys + .5 - cys), colourIndices=selected)
+
+  def lines(self, name, pss, stroke=(0, 0, 0), width=1):
+    if len(pss) == 0:
+      return
+    # all lines need to consist of the same number of points
+    countPoints = len(pss[0])
+    pss = ImageBackendRaster.__toArray(pss, 2).reshape(-1, countPoints, 2)
+    # split polylines into segments
+    if countPoints > 2:
+      pss = np.stack([pss[:, :-1], pss[:, 1:]], axis=2).reshape(-1, 2, 2)
+    xs, ys = self._projectArray(pss)
+    x0s, y0s = xs[:, 0], ys[:, 0]
+    dxs, dys = xs[:, 1] - x0s, ys[:, 1] - y0s
+    # sample each segment once per pixel along its major axis
+    counts = np.ceil(np.maximum(np.abs(dxs), np.abs(dys))).astype(np.int64) + 1
+    indices = np.repeat(np.arange(len(counts)), counts)
+    ts = np.arange(len(indices)) - np.repeat(np.cumsum(counts) - counts, counts)
+    ts = ts / np.maximum(counts - 1, 1)[indices]
+    sampleXs = x0s[indices] + ts * dxs[indices]
+    sampleYs = y0s[indices] + ts * dys[indices]
+    # cover the pixels across the minor axis by their distance to the sample (which corresponds to Wu's algorithm for a width of 1)
+    steep = (np.abs(dys) > np.abs(dxs))[indices]
+    majors = np.floor(np.where(steep, sampleYs, sampleXs)).astype(np.int64)
+    minors = np.where(steep, sampleXs, sampleYs)
+    minors0 = np.floor(minors - width / 2).astype(np.int64)
+    with self.__canvas(np.asarray([stroke], dtype=np.float32)) as cover:
+      for o in range(int(np.ceil(width)) + 1):
+        pixelMinors = minors0 + o
+        cover(np.where(steep, pixelMinors, majors), np.where(steep, majors, pixelMinors), width / 2 + .5 - np.abs(pixelMinors + .5 - minors))
+
+  @contextmanager
+  def __canvas(self, colours):
+    # yields a function recording the coverage of pixels (if several samples cover the same pixel, the last one is kept)
+    # the covered pixels are blended all at once afterwards
+    pixels = self.__pixelsArray()
+    height, width, channels = pixels.shape
+    if self.__coverage is None:
+      self.__coverage = np.zeros(width * height, dtype=np.float32)
+      self.__colourIndices = np.zeros(width * height, dtype=np.int32)
+    coverage, colourIndicesCanvas = self.__coverage, self.__colourIndices
+    bounds = [width * height, 0]
+    def cover(pxs, pys, alphas, colourIndices=None):
+      valid = (alphas > 0) & (pxs >= 0) & (pxs < width) & (pys >= 0) & (pys < height)
+      flats = pys[valid] * width + pxs[valid]
+      if len(flats) == 0:
+        return
+      coverage[flats] = np.minimum(alphas[valid], 1)
+      if colourIndices is not None:
+        colourIndicesCanvas[flats] = colourIndices[valid]
+      bounds[0], bounds[1] = min(bounds[0], flats.min()), max(bounds[1], flats.max() + 1)
+    yield cover
+    if bounds[0] >= bounds[1]:
+      return
+    # only the range of pixels covered needs to be searched
+    touched = np.flatnonzero(coverage[bounds[0]:bounds[1]]) + bounds[0]
+    cs = colours[colourIndicesCanvas[touched]] if len(colours) > 1 else colours[0]
+    pixels = pixels.reshape(-1, channels)
+    pixels[touched] = ImageBackendRaster.__blend(pixels[touched].astype(np.float32), cs, coverage[touched, None])
+    coverage[touched] = 0
+
+  @staticmethod
+  def __blend(dst, cs, alphas):
+    if dst.shape[1] == 3:
+      return np.rint(cs * alphas + dst * (1 - alphas)).astype(np.uint8)
+    # source over destination with straight alpha
+    dstAlphas = dst[:, 3:] / 255
+    outAlphas = alphas + dstAlphas * (1 - alphas)
+    out = np.empty_like(dst)
+    out[:, :3] = (cs * alphas + dst[:, :3] * dstAlphas * (1 - alphas)) / np.maximum(outAlphas, 1e-6)
+    out[:, 3:] = 255 * outAlphas
+    return np.rint(out).astype(np.uint8)
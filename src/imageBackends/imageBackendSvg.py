@@ -1,6 +1,8 @@
-import drawsvg as svg
+import numpy as np
+import shutil
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
 
-from src.common.functions import flatten
 from src.imageBackends.imageBackend import ImageBackend
 
 class ImageFontSvg:
@@ -9,9 +11,18 @@ class ImageFontSvg:
     self.size = size
 
 class ImageBackendSvg(ImageBackend):
-  def __init__(self, width, height, projectToImage, transparentBackground=True):
+  # streams the elements to a temporary file as soon as they are manifested, such that the drawing is never kept in memory as a whole
+  # the coordinates are written with a fixed precision, lines sharing a style are batched into paths, and repeated points are referenced as symbols
+  maxLinesPerPath = 1000
+
+  def __init__(self, width, height, projectToImage, transparentBackground=True, precision=2):
     super().__init__(projectToImage)
-    self.__svg = svg.Drawing(width, height)
+    self.__precision = precision
+    self.__countSymbols = 0
+    self.__file = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+    self.__file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n')
+    if not transparentBackground:
+      self.__file.write('<rect width="100%" height="100%" fill="rgb(255, 255, 255)" />\n')
 
   @staticmethod
   def getImageFont(name, size=12):
@@ -25,23 +36,37 @@ class ImageBackendSvg(ImageBackend):
       raise Exception('rgb value must be a tuple of length 3')
     return f'rgb({rgb[0]:.0f}, {rgb[1]:.0f}, {rgb[2]:.0f})'
 
+  def __number(self, x):
+    s = f'{x:.{self.__precision}f}'
+    if '.' in s:
+      s = s.rstrip('0').rstrip('.')
+    return '0' if s == '-0' else s
+
+  def __points(self, ps, imageCoordinates=False):
+    return ' '.join(f'{self.__number(x)} {self.__number(y)}' for x, y in (self._project(p, imageCoordinates=imageCoordinates) for p in ps))
+
   def _manifest(self, x):
-    return self.__svg.append(x)
+    # the elements are strings, and groups are iterables of elements (which are only created while writing)
+    if isinstance(x, str):
+      self.__file.write(x)
+    else:
+      for element in x:
+        self._manifest(element)
 
   def group_(self, name, elements):
-    g = svg.Group(id=name)
-    for element in elements:
-      g.append(element)
-    return g
+    yield f'<g id={quoteattr(name)}>\n'
+    yield from elements
+    yield '</g>\n'
 
   def point_(self, p, r, imageCoordinates=False, fill=(0, 0, 0)):
-    return svg.Circle(*self._project(p, imageCoordinates=imageCoordinates), r, fill=self.__rgb(fill))
+    x, y = self._project(p, imageCoordinates=imageCoordinates)
+    return f'<circle cx="{self.__number(x)}" cy="{self.__number(y)}" r="{self.__number(r)}" fill="{self.__rgb(fill)}" />\n'
 
   def line_(self, ps, imageCoordinates=False, stroke=(0, 0, 0), width=1):
-    return svg.Lines(*flatten([self._project(p, imageCoordinates=imageCoordinates) for p in ps]), stroke=self.__rgb(stroke), stroke_width=width)
+    return f'<path d="M{self.__points(ps, imageCoordinates=imageCoordinates)}" fill="none" stroke="{self.__rgb(stroke)}" stroke-width="{width}" />\n'
 
   def polygon_(self, ps, imageCoordinates=False, stroke=None, fill=None, width=1):
-    return svg.Lines(*flatten([self._project(p, imageCoordinates=imageCoordinates) for p in ps]), fill=self.__rgb(fill), stroke=self.__rgb(stroke), stroke_width=width)
+    return f'<path d="M{self.__points(ps, imageCoordinates=imageCoordinates)}Z" fill="{self.__rgb(fill)}" stroke="{self.__rgb(stroke)}" stroke-width="{width}" />\n'
 
   def text_(self, p, text, imageCoordinates=False, font=None, fill=(0, 0, 0), anchor='mm', align='left'):
     if len(anchor) != 2:
@@ -52,12 +77,56 @@ class ImageBackendSvg(ImageBackend):
       'r': 'end',
     }[anchor[0]]
     dominantBaseline = {
-      'b': 'auto',
-      'm': 'middle',
+      'a': 'hanging',
       't': 'hanging',
-    }
+      'm': 'middle',
+      's': 'alphabetic',
+    }.get(anchor[1], 'auto')
     x, y = self._project(p, imageCoordinates=imageCoordinates)
-    return svg.Text(text, font.size if font else 12, x=x, y=y, fill=self.__rgb(fill), text_anchor=textAnchor, dominant_baseline=dominantBaseline)
+    return f'<text x="{self.__number(x)}" y="{self.__number(y)}" font-size="{font.size if font else 12}" fill="{self.__rgb(fill)}" text-anchor="{textAnchor}" dominant-baseline="{dominantBaseline}">{escape(text)}</text>\n'
+
+  ## bulk drawing
+
+  def points(self, name, ps, rs, fills):
+    # points with the same radius and fill, occurring more than once, are defined once as a symbol
+    ps, rs = ImageBackend._toList(ps), ImageBackend._toList(rs)
+    counts = {}
+    for r, fill in zip(rs, fills):
+      counts[(r, fill)] = counts.get((r, fill), 0) + 1
+    symbols = {}
+    for (r, fill), count in counts.items():
+      if count > 1:
+        symbols[(r, fill)] = f's{self.__countSymbols}'
+        self.__countSymbols += 1
+    def _elements():
+      if len(symbols):
+        yield '<defs>\n'
+        for (r, fill), id in symbols.items():
+          yield f'<circle id="{id}" r="{self.__number(r)}" fill="{self.__rgb(fill)}" />\n'
+        yield '</defs>\n'
+      for p, r, fill in zip(ps, rs, fills):
+        if (r, fill) in symbols:
+          x, y = self._project(p)
+          yield f'<use xlink:href="#{symbols[(r, fill)]}" x="{self.__number(x)}" y="{self.__number(y)}" />\n'
+        else:
+          yield self.point_(p, r, fill=fill)
+    self.group(name, _elements())
+
+  def lines(self, name, pss, stroke=(0, 0, 0), width=1):
+    # the lines share their style, and are thus batched into few paths
+    if not isinstance(pss, np.ndarray):
+      return super().lines(name, pss, stroke=stroke, width=width)
+    xys = np.stack(self._projectArray(pss), axis=-1)
+    def _elements():
+      for start in range(0, len(xys), ImageBackendSvg.maxLinesPerPath):
+        d = ''.join('M' + ' '.join(self.__number(x) for x in xs) for xs in xys[start:start + ImageBackendSvg.maxLinesPerPath].reshape(-1, 2 * xys.shape[1]).tolist())
+        yield f'<path d="{d}" fill="none" stroke="{self.__rgb(stroke)}" stroke-width="{width}" />\n'
+    self.group(name, _elements())
 
   def save(self, pathAndFilename):
-    self.__svg.save_svg(pathAndFilename)
+    self.__file.flush()
+    self.__file.seek(0)
+    with open(pathAndFilename, 'w', encoding='utf-8') as f:
+      shutil.copyfileobj(self.__file, f)
+      f.write('</svg>\n')
+    self.__file.seek(0, 2)
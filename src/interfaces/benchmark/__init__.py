@@ -0,0 +1 @@
+from src.interfaces.benchmark.benchmark import Benchmark
@@ -0,0 +1,271 @@
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from src.common.console import Console
+from src.common.timer import timerConfig
+from src.geoGrid.geoGrid import GeoGrid
+from src.geoGrid.geoGridRenderer import GeoGridRenderer
+from src.geoGrid.geoGridSettings import GeoGridSettings
+from src.geoGrid.geoGridTopology import GeoGridTopology
+from src.geoGrid.geoGridWeight import GeoGridWeight
+from src.imageBackends.imageBackendRaster import ImageBackendRaster
+from src.interfaces.common.projections import PROJECTION
+from src.mechanics.potential.potentials import potentials
+
+class Benchmark:
+  resolutionsDefault = [3, 4, 5, 6, 7]
+  potentialsCombined = 'ALL'
+  resolutionsForKernels = [3, 4]
+  projectionsForKernels = [PROJECTION.Eckert_IV, PROJECTION.Mercator]
+  viewSettings = {
+    **GeoGridRenderer.viewSettingsDefault,
+    'selectedPotential': 'ALL',
+    'selectedVisualizationMethod': 'INDIVIDUAL',
+    'selectedEnergy': 'ALL',
+    'drawNeighbours': True,
+    'drawInitialPolygons': True,
+    'drawGraticule': True,
+    'drawCentres': 'ACTIVE',
+    'captureVideo': False,
+  }
+
+  def __init__(self, resolutions=None, potentialKinds=None, steps=10, repeat=3, projection=PROJECTION.Eckert_IV, countProjectedPoints=1000, includeGridCreation=False, callbackStatus=None):
+    self.__resolutions = resolutions or Benchmark.resolutionsDefault
+    # each potential in isolation, and all potentials combined
+    self.__potentialKinds = potentialKinds or [potential.kind for potential in potentials] + [Benchmark.potentialsCombined]
+    self.__steps = steps
+    self.__repeat = repeat
+    self.__projection = projection
+    self.__countProjectedPoints = countProjectedPoints
+    self.__includeGridCreation = includeGridCreation
+    self.__callbackStatus = callbackStatus or (lambda status: Console.status(status))
+    self.__results = {}
+
+  def results(self):
+    return self.__results
+
+  def info(self):
+    return {
+      'date': datetime.now(timezone.utc).isoformat(),
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'processor': platform.processor(),
+      'resolutions': self.__resolutions,
+      'potentials': self.__potentialKinds,
+      'steps': self.__steps,
+      'repeat': self.__repeat,
+      'projection': self.__projection.name,
+      'countProjectedPoints': self.__countProjectedPoints,
+    }
+
+  ## run
+
+  def run(self):
+    disableAllLog = timerConfig.disableAllLog()
+    timerConfig.disableAllLog(True)
+    try:
+      self.__results = {}
+      for resolution in self.__resolutions:
+        self.__runForResolution(resolution)
+        for potentialKind in self.__potentialKinds:
+          self.__runForPotential(resolution, potentialKind)
+    finally:
+      timerConfig.disableAllLog(disableAllLog)
+      Console.clearStatus()
+    return self.__results
+
+  def __measure(self, resolution, potentialKind, measure, function, repeat=None):
+    self.__callbackStatus(f"benchmark: resolution {resolution}, {potentialKind.lower() if potentialKind else 'grid'}, {measure} ...")
+    durations = []
+    for _ in range(repeat or self.__repeat):
+      t = time.perf_counter()
+      function()
+      durations.append(time.perf_counter() - t)
+    key = Benchmark.key(resolution, potentialKind, measure)
+    self.__results[key] = {
+      'resolution': resolution,
+      'potentials': potentialKind,
+      'measure': measure,
+      'durations': durations,
+      'mean': statistics.mean(durations),
+      'median': statistics.median(durations),
+      'min': min(durations),
+    }
+
+  def __runForResolution(self, resolution):
+    if self.__includeGridCreation:
+      self.__measure(resolution, None, 'createGrid', lambda: GeoGridTopology.create(resolution), repeat=1)
+    # make sure that the proxy file exists
+    GeoGridTopology.forResolution(resolution)
+    self.__measure(resolution, None, 'loadProxyFile', lambda: GeoGridTopology.load(resolution))
+
+  def __settings(self, resolution, potentialKind, projection=None):
+    settings = GeoGridSettings(initialProjection=projection or self.__projection, resolution=resolution)
+    weights = {}
+    for potential in settings.potentials:
+      weightJSON = (potential.defaultWeight or GeoGridWeight()).toJSON()
+      weightJSON['active'] = potentialKind == Benchmark.potentialsCombined or potential.kind == potentialKind
+      weights[potential.kind] = GeoGridWeight.fromJSON(weightJSON)
+    settings.updatePotentialsWeights(weights)
+    return settings
+
+  def __runForPotential(self, resolution, potentialKind):
+    settings = self.__settings(resolution, potentialKind)
+    geoGrids = []
+    self.__measure(resolution, potentialKind, 'initGrid', lambda: geoGrids.append(GeoGrid(settings)))
+    geoGrid = geoGrids[-1]
+    self.__measure(resolution, potentialKind, 'computeEnergiesAndForces', geoGrid.computeEnergiesAndForces)
+    self.__measure(resolution, potentialKind, 'calibrate', geoGrid.calibrate)
+    # the steps are measured only once, because they change the state of the grid
+    def performSteps():
+      for _ in range(self.__steps):
+        geoGrid.performStep()
+    self.__measure(resolution, potentialKind, 'performStep', performSteps, repeat=1)
+    self.__results[Benchmark.key(resolution, potentialKind, 'performStep')]['perStep'] = self.__results[Benchmark.key(resolution, potentialKind, 'performStep')]['mean'] / max(1, self.__steps)
+    self.__measure(resolution, potentialKind, 'findDeficiencies', geoGrid.findDeficiencies)
+    self.__measure(resolution, potentialKind, 'serializedData', lambda: geoGrid.serializedData(Benchmark.viewSettings))
+    self.__measure(resolution, potentialKind, 'serializedDataForProjection', geoGrid.serializedDataForProjection)
+    # project points on a regular lattice
+    n = max(1, round(self.__countProjectedPoints**.5))
+    lonLats = [(-179 + 358 * i / max(1, n - 1), -89 + 178 * j / max(1, n - 1)) for i in range(n) for j in range(n)]
+    projection = geoGrid.projection()
+    self.__measure(resolution, potentialKind, 'project', lambda: [projection.project(lon, lat) for lon, lat in lonLats])
+    serializedData = geoGrid.serializedData(Benchmark.viewSettings)
+    self.__measure(resolution, potentialKind, 'render', lambda: GeoGridRenderer.render(serializedData, settings, viewSettings=Benchmark.viewSettings, size=(1920, 1080), projection=projection))
+    # as rendered in the GUI and for videos
+    self.__measure(resolution, potentialKind, 'renderRasterAuto', lambda: GeoGridRenderer.render(serializedData, settings, viewSettings=Benchmark.viewSettings, size=(1920, 1080), projection=projection, backend=ImageBackendRaster, levelOfDetail='AUTO'))
+
+  ## kernels
+
+  def checkKernels(self, projections=None, tolerance=1e-9):
+    # compares the kernel of each registered potential with its computation cell by cell (see compareKernelWithScalar), for the initial grid and after the steps, with all potentials active
+    from src.mechanics.potential.potentials import compareKernelWithScalar, kernelForPotential
+    disableAllLog = timerConfig.disableAllLog()
+    timerConfig.disableAllLog(True)
+    try:
+      checks = []
+      for resolution in self.__resolutions:
+        for projection in projections or Benchmark.projectionsForKernels:
+          geoGrid = GeoGrid(self.__settings(resolution, Benchmark.potentialsCombined, projection=projection))
+          for step in [0, self.__steps]:
+            while geoGrid.step() < step:
+              geoGrid.performStep()
+            for potential in geoGrid.settings().potentials:
+              if kernelForPotential(potential) is None:
+                continue
+              self.__callbackStatus(f"check kernels: resolution {resolution}, {projection.name}, step {step}, {potential.kind.lower()} ...")
+              differences = compareKernelWithScalar(potential, geoGrid.state())
+              checks.append({
+                'resolution': resolution,
+                'projection': projection.name,
+                'step': step,
+                'potential': potential.kind,
+                **differences,
+                'agrees': all(difference <= tolerance for difference in differences.values()),
+              })
+    finally:
+      timerConfig.disableAllLog(disableAllLog)
+      Console.clearStatus()
+    return checks
+
+  @staticmethod
+  def printKernelChecks(checks):
+    Console.print(f"{'resolution':>10} | {'projection':<16} | {'step':>5} | {'potential':<22} | {'energies':>9} | {'forces':>9} |")
+    for check in checks:
+      Console.print(f"{check['resolution']:>10} | {check['projection']:<16} | {check['step']:>5} | {check['potential']:<22} | {check['energies']:9.2e} | {check['forces']:9.2e} | {'' if check['agrees'] else 'DISAGREES'}")
+
+  ## startup
+
+  @staticmethod
+  def importTimes(module='src.interfaces.script', repeat=3):
+    # imports the module in fresh interpreters (as the workers of a batch do), and reports the self and cumulative import time per module in seconds
+    runs = []
+    for _ in range(repeat):
+      process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True, text=True, cwd=os.getcwd())
+      if process.returncode != 0:
+        raise Exception(f"Could not import {module}: {process.stderr.strip().splitlines()[-1] if process.stderr.strip() else process.returncode}")
+      times = {}
+      for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+          continue
+        selfTime, cumulativeTime, name = line[len('import time:'):].split('|')
+        if not selfTime.strip().isdigit():
+          continue
+        times[name.strip()] = (int(selfTime) * 1e-6, int(cumulativeTime) * 1e-6)
+      runs.append(times)
+    results = {}
+    for name in runs[0]:
+      if all(name in times for times in runs):
+        results[name] = {
+          'module': name,
+          'self': statistics.median(times[name][0] for times in runs),
+          'cumulative': statistics.median(times[name][1] for times in runs),
+        }
+    return dict(sorted(results.items(), key=lambda item: -item[1]['cumulative']))
+
+  @staticmethod
+  def printImportTimes(importTimes, count=30):
+    Console.print(f"{'module':<60} | {'self [ms]':>10} | {'cumulative [ms]':>16}")
+    for result in list(importTimes.values())[:count]:
+      Console.print(f"{result['module']:<60} | {result['self'] * 10**3:10.1f} | {result['cumulative'] * 10**3:16.1f}")
+
+  ## results
+
+  @staticmethod
+  def key(resolution, potentialKind, measure):
+    return f"{resolution}/{potentialKind or '-'}/{measure}"
+
+  def save(self, filename):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'w') as f:
+      json.dump({
+        'info': self.info(),
+        'results': self.__results,
+      }, f, indent=2)
+    return filename
+
+  @staticmethod
+  def load(filename):
+    with open(filename, 'r') as f:
+      return json.load(f)
+
+  @staticmethod
+  def compare(results, baseline, threshold=.1, by='median'):
+    # compares the results to the baseline, and reports a regression if the ratio exceeds 1 + threshold
+    comparison = []
+    for key, result in results.items():
+      if key not in baseline:
+        continue
+      ratio = result[by] / baseline[key][by] if baseline[key][by] > 0 else None
+      comparison.append({
+        'key': key,
+        'resolution': result['resolution'],
+        'potentials': result['potentials'],
+        'measure': result['measure'],
+        'baseline': baseline[key][by],
+        'value': result[by],
+        'ratio': ratio,
+        'regression': ratio is not None and ratio > 1 + threshold,
+        'improvement': ratio is not None and ratio < 1 - threshold,
+      })
+    return comparison
+
+  @staticmethod
+  def printResults(results, by='median'):
+    Console.print(f"{'resolution':>10} | {'potentials':<22} | {'measure':<28} | {by + ' [ms]':>14}")
+    for result in results.values():
+      Console.print(f"{result['resolution']:>10} | {result['potentials'] or '-':<22} | {result['measure']:<28} | {result[by] * 10**3:14.3f}")
+
+  @staticmethod
+  def printComparison(comparison):
+    Console.print(f"{'resolution':>10} | {'potentials':<22} | {'measure':<28} | {'baseline [ms]':>14} | {'value [ms]':>14} | {'ratio':>7} |")
+    for row in comparison:
+      flag = 'REGRESSION' if row['regression'] else 'improved' if row['improvement'] else ''
+      ratio = f"{row['ratio']:7.2f}" if row['ratio'] is not None else f"{'-':>7}"
+      Console.print(f"{row['resolution']:>10} | {row['potentials'] or '-':<22} | {row['measure']:<28} | {row['baseline'] * 10**3:14.3f} | {row['value'] * 10**3:14.3f} | {ratio} | {flag}")
@@ -4,14 +4,22 @@ import os
 import random
 import shutil
 
-from src.common.video import renderVideo
+from src.common.exportQueue import ExportQueue
+from src.common.metrics import metrics
+from src.common.video import VideoSink
 from src.geoGrid.geoGridRenderer import GeoGridRenderer
 from src.imageBackends.imageBackendPillow import ImageBackendPillow
-from src.imageBackends.imageBackendSvg import ImageBackendSvg
+from src.imageBackends.imageBackendRaster import ImageBackendRaster
 from src.interfaces.common.common import APP_CAPTURE_PATH
 from src.interfaces.common.file import File
+from src.interfaces.common.stepDataWriter import StepDataWriter
 
 class InterfaceCommon:
+  __stepDataWriters = {}
+  __videoSinks = {}
+  __stepDataSettingsCache = None
+  __exportQueue = None
+
   @staticmethod
   def hash():
     return f'{random.randrange(0, 10**6):06d}'
@@ -20,11 +28,10 @@ class InterfaceCommon:
   def isStopThresholdReached(geoGrid, geoGridSettings, stepData=None):
     # maxForceStrength is in units of the coordinate system in which the cells are located: radiusEarth * deg2rad(lon), radiusEarth * deg2rad(lat)
     # maxForceStrength is divided by the typical distance (which works perfectly at the equator) to normalize
-    # The normalized maxForceStrength is divided by the speed (100 * (1 - dampingFactor)), in order to compensate for varying speeds
-    stopThresholdReached = geoGrid.maxForceStrength() / (100 * (1 - geoGridSettings._dampingFactor)) < geoGridSettings._stopThresholdMaxForceStrength * geoGridSettings._typicalDistance
+    # The normalized maxForceStrength is divided by the speed (100 * (1 - dampingFactor), multiplied by the factor of the adaptive step), in order to compensate for varying speeds
+    stopThresholdReached = geoGrid.maxForceStrength() / (100 * (1 - geoGridSettings._dampingFactor) * geoGrid.stepFactor()) < geoGridSettings._stopThresholdMaxForceStrength * geoGridSettings._typicalDistance
     # count deficiencies
-    deficiencies, _ = geoGrid.findDeficiencies(computeAlmostDeficiencies=False)
-    stopThresholdReached = stopThresholdReached or (stepData['countDeficiencies'] if stepData else len(deficiencies)) >= geoGridSettings._stopThresholdCountDeficiencies
+    stopThresholdReached = stopThresholdReached or (stepData['countDeficiencies'] if stepData else geoGrid.countDeficiencies()) >= geoGridSettings._stopThresholdCountDeficiencies
     # max steps
     stopThresholdReached = stopThresholdReached or geoGrid.step() >= geoGridSettings._stopThresholdMaxSteps
     if stopThresholdReached:
@@ -60,36 +67,54 @@ class InterfaceCommon:
 
   @staticmethod
   def stepData(dataData, geoGridSettings, geoGrid=None, stepData=None, additionalData=None, appendOnlyIf=True):
+    writer = InterfaceCommon.__stepDataWriters.get(dataData)
+    if writer is not None and not appendOnlyIf:
+      return
     stepData = stepData or InterfaceCommon.computeStepData(geoGrid, geoGridSettings)
     if stepData is None:
       raise Exception('Please provide either stepData or geogrid')
-    _jsonDumps = lambda x: '"' + json.dumps(x).replace('"', '""') + '"'
-    fileNameTmp = os.path.join(APP_CAPTURE_PATH, dataData + '.csv')
+    if writer is None:
+      writer = InterfaceCommon.__stepDataWriters[dataData] = StepDataWriter(dataData)
+    writer.append(InterfaceCommon.stepDataNumeric(stepData), InterfaceCommon.stepDataSettings(geoGridSettings), additionalData=additionalData)
+
+  @staticmethod
+  def stepDataRow(geoGridSettings, stepData, additionalData=None):
+    _format = lambda key, value: str(value) if key in StepDataWriter.integerColumns else f"{value:.0f}"
+    return {
+      **dict((key, _format(key, value)) for key, value in InterfaceCommon.stepDataNumeric(stepData).items()),
+      **InterfaceCommon.stepDataSettings(geoGridSettings),
+      **(additionalData if additionalData is not None else {}),
+    }
+
+  @staticmethod
+  def stepDataNumeric(stepData):
     innerEnergy, outerEnergy = stepData['energy']
     innerEnergyWeighted, outerEnergyWeighted = stepData['energyWeighted']
-    settings = geoGridSettings.toJSON()
-    info = geoGridSettings.info()
     data = {
-      'step': str(stepData['step']),
-      'countDeficiencies': str(stepData['countDeficiencies']),
-      'countAlmostDeficiencies': str(stepData['countDeficiencies'] + stepData['countAlmostDeficiencies']),
-      'innerEnergy': f"{innerEnergy:.0f}",
-      'outerEnergy': f"{outerEnergy:.0f}",
-      'innerEnergyWeighted': f"{innerEnergyWeighted:.0f}",
-      'outerEnergyWeighted': f"{outerEnergyWeighted:.0f}",
+      'step': stepData['step'],
+      'countDeficiencies': stepData['countDeficiencies'],
+      'countAlmostDeficiencies': stepData['countDeficiencies'] + stepData['countAlmostDeficiencies'],
+      'innerEnergy': innerEnergy,
+      'outerEnergy': outerEnergy,
+      'innerEnergyWeighted': innerEnergyWeighted,
+      'outerEnergyWeighted': outerEnergyWeighted,
     }
     for (key, value), (keyWeighted, valueWeighted) in zip(stepData['energyPerPotential'].items(), stepData['energyWeightedPerPotential'].items()):
-      innerEnergy, outerEnergy = value
-      innerEnergyWeighted, outerEnergyWeighted = valueWeighted
-      data = {
-        **data,
-        'innerEnergy_' + key: f"{innerEnergy:.0f}",
-        'outerEnergy_' + key: f"{outerEnergy:.0f}",
-        'innerEnergyWeighted_' + keyWeighted: f"{innerEnergyWeighted:.0f}",
-        'outerEnergyWeighted_' + keyWeighted: f"{outerEnergyWeighted:.0f}",
-      }
+      data['innerEnergy_' + key], data['outerEnergy_' + key] = value
+      data['innerEnergyWeighted_' + keyWeighted], data['outerEnergyWeighted_' + keyWeighted] = valueWeighted
+    return data
+
+  @staticmethod
+  def stepDataSettings(geoGridSettings):
+    # the settings, the hash, and the JSON dumps are only recomputed if the settings have changed
+    key = geoGridSettings.cacheKey()
+    cache = InterfaceCommon.__stepDataSettingsCache
+    if cache is not None and cache[0] is geoGridSettings and len(cache[1]) == len(key) and all(a is b for a, b in zip(cache[1], key)):
+      return cache[2]
+    _jsonDumps = lambda x: '"' + json.dumps(x).replace('"', '""') + '"'
+    info = geoGridSettings.info()
+    settings = info['jsonSettings']
     data = {
-      **data,
       'hash': info['hash'],
       'initialProjection': _jsonDumps(settings['initialProjection']),
       'initialProjectionName': settings['initialProjection']['name'],
@@ -100,28 +125,23 @@ class InterfaceCommon:
       'stopThresholdMaxSteps': str(settings['stopThresholdMaxSteps']),
       'limitLatForEnergy': str(settings['limitLatForEnergy']),
       'weights': _jsonDumps(settings['weights']),
-      **(additionalData if additionalData is not None else {}),
     }
-    dataRow = f"{','.join(data.values())}\n"
-    if not os.path.exists(fileNameTmp):
-      os.makedirs(APP_CAPTURE_PATH, exist_ok=True)
-      with open(fileNameTmp, 'w') as f:
-        headerRow = f"{','.join(data.keys())}\n"
-        f.write(headerRow)
-        f.write(dataRow)
-    elif appendOnlyIf:
-      with open(fileNameTmp, 'a') as f:
-        f.write(dataRow)
+    InterfaceCommon.__stepDataSettingsCache = (geoGridSettings, key, data)
+    return data
 
   @staticmethod
   def saveData(pathFunction, dataData, geoGridSettings):
     fileNameTmp = os.path.join(APP_CAPTURE_PATH, dataData + '.csv')
+    writer = InterfaceCommon.__stepDataWriters.pop(dataData, None)
+    if writer is not None:
+      writer.saveCSV(fileNameTmp)
+      writer.remove()
     file = File(dataData, geoGridSettings=geoGridSettings, extension='csv').apply(pathFunction)
     file.byTmpFile(fileNameTmp)
     return file.pathAndFilename()
 
   @staticmethod
-  def saveScreenshot(pathFunction, geoGridSettings, viewSettings, geoGrid=None, serializedData=None, projection=None, stepData=None, largeSymbols=False, extension='png'):
+  def saveScreenshot(pathFunction, geoGridSettings, viewSettings, geoGrid=None, serializedData=None, projection=None, stepData=None, largeSymbols=False, extension='png', asynchronous=False):
     if geoGrid:
       serializedData = serializedData or geoGrid.serializedData(viewSettings)
       projection = projection or geoGrid.projection()
@@ -131,9 +151,29 @@ class InterfaceCommon:
     file = File(stepData['step'], geoGridSettings=geoGridSettings, extension=extension, addHash=InterfaceCommon.hash()).apply(pathFunction)
     if not file.isCancelled():
       file.removeExisting()
-      GeoGridRenderer.render(serializedData, geoGridSettings=geoGridSettings, viewSettings=viewSettings, projection=projection, size=(1920, 1080), transparency=True, largeSymbols=largeSymbols, stepData=stepData, backend=ImageBackendSvg if extension == 'svg' else ImageBackendPillow).save(file.pathAndFilename())
+      if extension == 'svg':
+        from src.imageBackends.imageBackendSvg import ImageBackendSvg
+      render = lambda geoGridSettings, viewSettings: GeoGridRenderer.render(serializedData, geoGridSettings=geoGridSettings, viewSettings=viewSettings, projection=projection, size=(1920, 1080), transparency=True, largeSymbols=largeSymbols, stepData=stepData, backend=ImageBackendSvg if extension == 'svg' else ImageBackendPillow).save(file.pathAndFilename())
+      if asynchronous:
+        # the serialized data and the projection are snapshots, and so are the settings (including the weights) and the view settings, such that the optimization can proceed while rendering
+        geoGridSettingsCopy, viewSettingsCopy = geoGridSettings.snapshot(), dict(viewSettings)
+        InterfaceCommon.exportQueue().submit(lambda: render(geoGridSettingsCopy, viewSettingsCopy))
+      else:
+        render(geoGridSettings, viewSettings)
     return file.pathAndFilename()
 
+  @staticmethod
+  def exportQueue():
+    if InterfaceCommon.__exportQueue is None:
+      InterfaceCommon.__exportQueue = ExportQueue()
+    return InterfaceCommon.__exportQueue
+
+  @staticmethod
+  def flushExports():
+    # waits until all asynchronous exports are completed
+    if InterfaceCommon.__exportQueue is not None:
+      InterfaceCommon.__exportQueue.flush()
+
   @staticmethod
   def renderImage(geoGridSettings, viewSettings, geoGrid=None, serializedData=None, projection=None, stepData=None, size=None):
     if geoGrid:
@@ -142,7 +182,7 @@ class InterfaceCommon:
       stepData = stepData or InterfaceCommon.computeStepData(geoGrid, geoGridSettings)
     if serializedData is None or projection is None:
       raise Exception('Please provide either serializedData, projection, and stepData, or provide geogrid')
-    return GeoGridRenderer.render(serializedData, geoGridSettings=geoGridSettings, viewSettings=viewSettings, projection=projection, size=size if size else (1920, 1080), stepData=stepData).im(), stepData
+    return GeoGridRenderer.render(serializedData, geoGridSettings=geoGridSettings, viewSettings=viewSettings, projection=projection, size=size if size else (1920, 1080), stepData=stepData, backend=ImageBackendRaster, levelOfDetail='AUTO').im(), stepData
 
   @staticmethod
   def startVideo():
@@ -150,33 +190,53 @@ class InterfaceCommon:
 
   @staticmethod
   def stepVideo(im, videoData, stepData):
-    GeoGridRenderer.save(im, hash=videoData, step=stepData['step'])
+    if videoData not in InterfaceCommon.__videoSinks:
+      InterfaceCommon.__videoSinks[videoData] = VideoSink(os.path.join(APP_CAPTURE_PATH, videoData + '.mp4'), fps=20)
+    InterfaceCommon.__videoSinks[videoData].addFrame(im, step=stepData['step'])
 
   @staticmethod
   def saveVideo(pathFunction, videoData, geoGridSettings):
-    fileNameTmp = os.path.join(APP_CAPTURE_PATH, videoData)
-    renderVideo(fileNameTmp, 20)
+    videoSink = InterfaceCommon.__videoSinks.pop(videoData, None)
+    if videoSink is None or videoSink.close() is None:
+      raise Exception('No frames have been captured for the video')
     file = File(videoData, geoGridSettings=geoGridSettings, extension='mp4').apply(pathFunction)
-    file.byTmpFile(fileNameTmp + '.mp4', move=True)
+    file.byTmpFile(os.path.join(APP_CAPTURE_PATH, videoData + '.mp4'), move=True)
     return file.pathAndFilename()
 
   @staticmethod
   def collectData(pathFunction, pattern):
-    lines = []
-    for filename in glob.glob(os.path.expanduser(File._defaultPath) + '/' + pattern, recursive=True):
-      with open(filename, 'r') as f:
-        linesNew = f.readlines()
-        if len(lines) == 0:
-          lines = linesNew
-        elif lines[0] == linesNew[0]:
-          lines += linesNew[1:]
-        else:
-          raise Exception('Error when collecting: different header')
+    # the files are concatenated without parsing their rows
     pathAndFilename = File(extension='csv').apply(pathFunction).pathAndFilename()
-    with open(pathAndFilename, 'w') as f:
-      f.writelines(lines)
+    header = None
+    with open(pathAndFilename + '.tmp', 'wb') as fOut:
+      for filename in glob.glob(os.path.expanduser(File._defaultPath) + '/' + pattern, recursive=True):
+        with open(filename, 'rb') as f:
+          headerNew = f.readline()
+          if header is None:
+            header = headerNew
+            fOut.write(header)
+          elif header != headerNew:
+            raise Exception('Error when collecting: different header')
+          shutil.copyfileobj(f, fOut)
+    os.replace(pathAndFilename + '.tmp', pathAndFilename)
     return pathAndFilename
 
+  @staticmethod
+  def saveMetrics(pathFunction, geoGridSettings, format='json'):
+    save = {
+      'json': (metrics.saveJSON, ['metrics'], 'json'),
+      'csv': (metrics.saveCSV, ['metrics'], 'csv'),
+      'trace': (metrics.saveChromeTrace, ['metrics', 'trace'], 'json'),
+    }
+    if format not in save:
+      raise Exception('Unknown format for the metrics')
+    method, parts, extension = save[format]
+    file = File(*parts, geoGridSettings=geoGridSettings, extension=extension).apply(pathFunction)
+    if file.isCancelled():
+      return None
+    method(file.removeExisting())
+    return file.pathAndFilename()
+
   @staticmethod
   def saveJSON(pathFunction, data):
     file = File(extension='json').apply(pathFunction)
@@ -185,6 +245,10 @@ class InterfaceCommon:
 
   @staticmethod
   def cleanup():
+    InterfaceCommon.__stepDataWriters.clear()
+    for videoSink in InterfaceCommon.__videoSinks.values():
+      videoSink.abort()
+    InterfaceCommon.__videoSinks.clear()
     try:
       with os.scandir(APP_CAPTURE_PATH) as entries:
         for entry in entries:
@@ -1,6 +1,4 @@
 import math
-from pyproj import CRS, Transformer
-from scipy.optimize import newton
 
 from src.geometry.common import Common
 from src.geometry.geo import Geo
@@ -27,18 +25,34 @@ class Projection:
       self.transform = None
     self.canBeOptimized = canBeOptimized
     self.usePROJ = usePROJ
-    self.scale = scale(self) if callable(scale) else scale if scale or (self.transform is None and srid is None) else strategyForScale()(self)
+    # the scale and the transformer of PROJ are only computed when needed, as computing them for all projections at import is slow
+    self.__scale = scale
+    self.__scaleComputed = not callable(scale) and (scale or (self.transform is None and srid is None))
+    self.__transformPROJ = None
     self.sortBy += [self.name]
 
   def __multiplyByRadiusEarth(self, xy):
     return (Geo.radiusEarth * xy[0], Geo.radiusEarth * xy[1])
 
+  @property
+  def scale(self):
+    if not self.__scaleComputed:
+      self.__scale = self.__scale(self) if callable(self.__scale) else strategyForScale()(self)
+      self.__scaleComputed = True
+    return self.__scale
+
   def useSRID(self):
     if self.srid is not None:
-      self.transform = Transformer.from_crs(CRS('EPSG:4326'), CRS(self.srid), always_xy=True).transform
+      self.transform = self.__transformWithPROJ
       self.name += ' (PROJ)'
     return self
 
+  def __transformWithPROJ(self, x, y):
+    if self.__transformPROJ is None:
+      from pyproj import CRS, Transformer
+      self.__transformPROJ = Transformer.from_crs(CRS('EPSG:4326'), CRS(self.srid), always_xy=True).transform
+    return self.__transformPROJ(x, y)
+
   def toJSON(self):
     return {
       'name': self.name,
@@ -70,11 +84,13 @@ def aitoff_transformRad(l, t):
   return (2 * math.cos(t) * math.sin(l / 2) * k, math.sin(t) * k)
 
 def eckert_IV_transformRad(l, t):
+  from scipy.optimize import newton
   k = (2 + Common._pi_2) * math.sin(t)
   p = newton(lambda x: x + math.sin(x) * math.cos(x) + 2 * math.sin(x) - k, t)
   return (2 * l * (1 + math.cos(p)) / math.sqrt(4 * Common._pi + Common._pi__2), 2 * Common._sqrtPi * math.sin(p) / math.sqrt(4 + Common._pi))
 
 def eckert_VI_transformRad(l, t):
+  from scipy.optimize import newton
   k = (1 + Common._pi_2) * math.sin(t)
   p = newton(lambda x: x + math.sin(x) - k, t)
   return (l * (1 + math.cos(p)) / math.sqrt(2 + Common._pi), 2 * p / math.sqrt(2 + Common._pi))
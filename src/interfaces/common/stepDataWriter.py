@@ -0,0 +1,75 @@
+import numpy as np
+import os
+
+from src.interfaces.common.common import APP_CAPTURE_PATH
+
+class StepDataWriter:
+  # the numeric columns of the steps are buffered as NumPy records, and the records are appended in chunks to a binary file
+  # the columns describing the settings (and the additional data) are kept only once for each segment of rows sharing them
+  chunkSize = 256
+  integerColumns = ['step', 'countDeficiencies', 'countAlmostDeficiencies']
+
+  def __init__(self, dataData):
+    self.__pathAndFilenameRecords = os.path.join(APP_CAPTURE_PATH, dataData + '.records')
+    self.__dtype = None
+    self.__chunk = None
+    self.__countChunk = 0
+    self.__countFlushed = 0
+    self.__segments = []
+
+  def __len__(self):
+    return self.__countFlushed + self.__countChunk
+
+  def append(self, numericData, settingsData, additionalData=None):
+    if self.__dtype is None:
+      self.__dtype = np.dtype([(key, np.int64 if key in StepDataWriter.integerColumns else np.float64) for key in numericData.keys()])
+      self.__chunk = np.zeros(StepDataWriter.chunkSize, dtype=self.__dtype)
+    elif tuple(numericData.keys()) != self.__dtype.names:
+      raise Exception('Error when writing step data: different columns')
+    # start a new segment if the settings or the additional data have changed
+    additionalData = dict((key, str(value)) for key, value in additionalData.items()) if additionalData else {}
+    if len(self.__segments) == 0 or self.__segments[-1][1] is not settingsData or self.__segments[-1][2] != additionalData:
+      self.__segments.append((len(self), settingsData, additionalData))
+    self.__chunk[self.__countChunk] = tuple(numericData.values())
+    self.__countChunk += 1
+    if self.__countChunk == StepDataWriter.chunkSize:
+      self.flush()
+
+  def flush(self):
+    if self.__countChunk == 0:
+      return
+    os.makedirs(APP_CAPTURE_PATH, exist_ok=True)
+    with open(self.__pathAndFilenameRecords, 'ab') as f:
+      self.__chunk[:self.__countChunk].tofile(f)
+    self.__countFlushed += self.__countChunk
+    self.__countChunk = 0
+
+  def records(self):
+    if self.__dtype is None:
+      return None
+    self.flush()
+    return np.fromfile(self.__pathAndFilenameRecords, dtype=self.__dtype)
+
+  def remove(self):
+    if os.path.exists(self.__pathAndFilenameRecords):
+      os.unlink(self.__pathAndFilenameRecords)
+
+  def saveCSV(self, pathAndFilename):
+    records = self.records()
+    if records is None:
+      return None
+    # format the numeric columns column-wise
+    columns = [records[key].astype(str) if key in StepDataWriter.integerColumns else np.char.mod('%.0f', records[key]) for key in self.__dtype.names]
+    numericRows = [','.join(values) for values in zip(*columns)]
+    # the header contains the union of the keys of the additional data
+    keysText = list(self.__segments[0][1].keys())
+    for _, _, additionalData in self.__segments:
+      keysText += [key for key in additionalData.keys() if key not in keysText]
+    with open(pathAndFilename, 'w') as f:
+      f.write(','.join(list(self.__dtype.names) + keysText) + '\n')
+      for i, (start, settingsData, additionalData) in enumerate(self.__segments):
+        end = self.__segments[i + 1][0] if i + 1 < len(self.__segments) else len(records)
+        textData = {**settingsData, **additionalData}
+        suffix = ',' + ','.join(textData.get(key, '') for key in keysText) if keysText else ''
+        f.writelines(row + suffix + '\n' for row in numericRows[start:end])
+    return pathAndFilename
@@ -0,0 +1,217 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import re
+import threading
+
+from src.geoGrid.geoGridRenderer import GeoGridRenderer
+from src.imageBackends.imageBackendRaster import ImageBackendRaster
+from src.interfaces.common.interfaceCommon import InterfaceCommon
+
+class TileSource:
+  # a snapshot of an optimized projection, from which the tiles are rendered
+  # the settings are a snapshot (shared by the sources with the same hash), and the state of the grid is only serialized when the first tile is requested, which needs to happen before the grid performs the next step
+  def __init__(self, geoGrid, hash, geoGridSettings, viewSettings):
+    self.hash = hash
+    self.step = geoGrid.step()
+    self.geoGridSettings = geoGridSettings
+    self.viewSettings = {
+      **viewSettings,
+      'captureVideo': False,
+    }
+    self.serializedData = None
+    self.projection = None
+    self.__geoGrid = geoGrid
+
+  def key(self):
+    return self.hash, self.step
+
+  def isSerialized(self):
+    return self.serializedData is not None
+
+  def serialize(self):
+    # returns False if the grid has already performed further steps, such that the source can no longer be serialized
+    if self.serializedData is None:
+      if self.__geoGrid is None or self.__geoGrid.step() != self.step:
+        return False
+      self.serializedData = self.__geoGrid.serializedData(self.viewSettings)
+      # the projection of the grid is replaced (and not changed) when a step is performed
+      self.projection = self.__geoGrid.projection()
+      self.__geoGrid = None
+    return True
+
+class TileServer:
+  # serves the tiles (z/x/y, as used by web maps) of optimized projections via HTTP
+  # the tiles are rendered on demand with only the primitives intersecting them, and kept in an LRU cache keyed by the hash of the settings and the step
+  # the steps are kept as sources only if tiles have been requested while they were current
+  tileSize = 256
+  maxZoom = 12
+  maxSources = 16
+
+  def __init__(self, host='127.0.0.1', port=8000, cacheSize=2048, boundsExtend=1.3):
+    self.__host = host
+    self.__port = port
+    self.__cacheSize = cacheSize
+    self.__boundsExtend = boundsExtend
+    self.__sources = OrderedDict()
+    self.__currentKey = None
+    self.__cache = OrderedDict()
+    self.__lock = threading.Lock()
+    self.__lockRender = threading.Lock()
+    self.__lockGrid = threading.Lock()
+    self.__settingsSnapshot = None
+    self.__server = None
+    self.__thread = None
+
+  ## sources
+
+  def publish(self, geoGrid, geoGridSettings, viewSettings):
+    # adds a source for the current step of the grid, which becomes the current source
+    # the hash of the settings is cached as long as the settings do not change, and the settings are only copied if the hash has changed
+    hash = InterfaceCommon.stepDataSettings(geoGridSettings)['hash']
+    if self.__settingsSnapshot is None or self.__settingsSnapshot[0] != hash:
+      self.__settingsSnapshot = hash, geoGridSettings.snapshot()
+    source = TileSource(geoGrid, hash, self.__settingsSnapshot[1], viewSettings)
+    with self.__lock:
+      # the previous source is removed if no tile has been requested, because it can no longer be serialized
+      if self.__currentKey is not None and self.__currentKey in self.__sources and not self.__sources[self.__currentKey].isSerialized():
+        del self.__sources[self.__currentKey]
+      self.__sources[source.key()] = source
+      self.__sources.move_to_end(source.key())
+      self.__currentKey = source.key()
+      while len(self.__sources) > TileServer.maxSources:
+        self.__sources.popitem(last=False)
+    return source.key()
+
+  def lockGrid(self):
+    # the grid must not perform a step while the current source is serialized
+    return self.__lockGrid
+
+  def sources(self):
+    with self.__lock:
+      return [{'hash': hash, 'step': step, 'current': (hash, step) == self.__currentKey} for hash, step in self.__sources.keys()]
+
+  ## tiles
+
+  def tileBounds(self, z, x, y):
+    # the tiles of zoom level 0 consist of one square tile covering the whole map
+    xMin, yMin, xMax, yMax = GeoGridRenderer.bounds(boundsExtend=self.__boundsExtend)
+    side = max(xMax - xMin, yMax - yMin)
+    size = side / 2**z
+    xLeft = (xMin + xMax) / 2 - side / 2 + x * size
+    yTop = (yMin + yMax) / 2 + side / 2 - y * size
+    return xLeft, yTop - size, xLeft + size, yTop
+
+  def tile(self, z, x, y, key=None):
+    # returns the tile as PNG, or None if the tile or the source does not exist
+    if not (0 <= z <= TileServer.maxZoom and 0 <= x < 2**z and 0 <= y < 2**z):
+      return None
+    with self.__lock:
+      key = key or self.__currentKey
+      source = self.__sources.get(key)
+      if source is None:
+        return None
+      keyTile = (*key, z, x, y)
+      if keyTile in self.__cache:
+        self.__cache.move_to_end(keyTile)
+        return self.__cache[keyTile]
+    if not source.isSerialized():
+      with self.__lockGrid:
+        if not source.serialize():
+          return None
+    with self.__lockRender:
+      png = self.__render(source, z, x, y)
+    with self.__lock:
+      self.__cache[keyTile] = png
+      while len(self.__cache) > self.__cacheSize:
+        self.__cache.popitem(last=False)
+    return png
+
+  def __render(self, source, z, x, y):
+    # the renderer doubles the size of the image
+    image = GeoGridRenderer.render(source.serializedData, source.geoGridSettings, viewSettings=source.viewSettings, size=(TileServer.tileSize // 2, TileServer.tileSize // 2), border=0, transparency=True, bounds=self.tileBounds(z, x, y), projection=source.projection, backend=ImageBackendRaster, levelOfDetail='AUTO')
+    buffer = io.BytesIO()
+    image.im().save(buffer, format='PNG')
+    return buffer.getvalue()
+
+  ## server
+
+  def url(self):
+    return f"http://{self.__host}:{self.__port}/"
+
+  def start(self):
+    if self.__server is None:
+      self.__server = ThreadingHTTPServer((self.__host, self.__port), TileServer.__handler(self))
+      self.__port = self.__server.server_address[1]
+      self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+      self.__thread.start()
+    return self.url()
+
+  def stop(self):
+    if self.__server is not None:
+      self.__server.shutdown()
+      self.__server.server_close()
+      self.__thread.join()
+      self.__server = None
+      self.__thread = None
+
+  @staticmethod
+  def __handler(tileServer):
+    class TileRequestHandler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/':
+          return self.__respond(TileServer.html.encode(), 'text/html; charset=utf-8')
+        if path == '/sources':
+          return self.__respond(json.dumps(tileServer.sources()).encode(), 'application/json')
+        match = re.fullmatch(r'/tiles(?:/([0-9a-f]+)/(\d+))?/(\d+)/(\d+)/(\d+)\.png', path)
+        if match is None:
+          return self.send_error(404)
+        hash, step, z, x, y = match.groups()
+        png = tileServer.tile(int(z), int(x), int(y), key=(hash, int(step)) if hash is not None else None)
+        if png is None:
+          return self.send_error(404)
+        self.__respond(png, 'image/png')
+
+      def __respond(self, body, contentType):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+    return TileRequestHandler
+
+  html = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Optimized projection</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map { height: 100%; margin: 0; background: #fff; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+const map = L.map('map', {crs: L.CRS.Simple, minZoom: 0, maxZoom: ''' + str(maxZoom) + '''}).setView([-128, 128], 2);
+const layer = L.tileLayer('/tiles/{z}/{x}/{y}.png', {tileSize: ''' + str(tileSize) + ''', noWrap: true, bounds: [[-256, 0], [0, 256]]}).addTo(map);
+// follow the current source
+let current = null;
+const update = () => fetch('/sources').then(response => response.json()).then(sources => {
+  const source = sources.find(source => source.current);
+  if (source && (!current || source.hash !== current.hash || source.step !== current.step)) {
+    current = source;
+    layer.setUrl(`/tiles/${source.hash}/${source.step}/{z}/{x}/{y}.png`);
+  }
+});
+update();
+setInterval(update, 2000);
+</script>
+</body>
+</html>
+'''
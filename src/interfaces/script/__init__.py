@@ -1,2 +1,3 @@
 from src.interfaces.common.projections import PROJECTION
 from src.interfaces.script.app import DOMP, POTENTIAL, Print
+from src.interfaces.script.batch import BatchJob, DOMPBatch
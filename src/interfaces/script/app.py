@@ -1,10 +1,10 @@
+from contextlib import contextmanager
 import os
-import py
-import sys
+import time
 
 from src.common.console import Console
+from src.common.metrics import metrics
 from src.common.timer import timerConfig
-from src.geoGrid.geoGrid import GeoGrid
 from src.geoGrid.geoGridSettings import GeoGridSettings
 from src.geoGrid.geoGridWeight import GeoGridWeight
 from src.interfaces.common.common import APP_NAME, APP_COPYRIGHT, APP_FILES_PATH
@@ -26,9 +26,13 @@ for potential in potentials:
 # TODO load and save simulation settings
 
 class DOMP:
-  def __init__(self, cleanup=True, logging=True, hideAbout=False):
+  def __init__(self, cleanup=True, logging=True, hideAbout=False, statusInterval=None):
+    # statusInterval: if provided, the progress of long operations (like steps) is shown at most once per interval (in seconds)
     self.__cleanup = cleanup
     self.__logging = logging
+    self.__statusInterval = statusInterval
+    self.__operations = []
+    self.__timeStatus = 0
     timerConfig.disableAllLog(not self.__logging)
     # self.__appSettings = shelve.Shelf({})
     self.__geoGridSettings = GeoGridSettings()
@@ -38,8 +42,11 @@ class DOMP:
     # init paths
     os.makedirs(APP_FILES_PATH, exist_ok=True)
     # variables
+    self.__geoGridInstance = None
     self.__dataDataDict = {}
     self.__videoDatas = []
+    self.__callbacksStepData = []
+    self.__tileServer = None
     # settings
     self.viewForces(all=True)
     self.viewEnergy()
@@ -57,6 +64,25 @@ class DOMP:
   def __callbackStatus(self, status, energy=None, calibration=None):
     if self.__logging:
       Console.print(f"{'':<10} |", status, energy or '', calibration or '')
+
+  ###### PROGRESS
+
+  @contextmanager
+  def __operation(self, label, details=''):
+    # the operations are reported at their boundaries (as status and as spans of the metrics), such that there is no overhead while they run
+    self.__operations.append(label)
+    if self.__logging and len(self.__operations) == 1:
+      Console.status(f"{'':<10} |", label, details)
+    try:
+      with metrics.span(label):
+        yield
+    finally:
+      self.__operations.pop()
+
+  def __progress(self, status):
+    if self.__logging and self.__statusInterval is not None and time.time() - self.__timeStatus >= self.__statusInterval:
+      self.__timeStatus = time.time()
+      Console.status(f"{'':<10} |", ' > '.join(self.__operations), '|', status)
   
   ###### ABOUT
 
@@ -108,6 +134,11 @@ class DOMP:
       self.__geoGridSettings.updateDampingFactor(1 - speed / 100)
     return 100 * (1 - self.__geoGridSettings._dampingFactor)
 
+  def adaptiveStep(self, adaptiveStep=None):
+    if adaptiveStep is not None:
+      self.__geoGridSettings.updateAdaptiveStep(adaptiveStep)
+    return self.__geoGridSettings._adaptiveStep
+
   def stopThreshold(self, maxForceStrength=None, countDeficiencies=None, maxSteps=None):
     if maxForceStrength is not None:
       self.__geoGridSettings.updateStopThresholdMaxForceStrength(maxForceStrength / 100)
@@ -120,13 +151,16 @@ class DOMP:
   def limitLatForEnergy(self, limitLatForEnergy=None):
     if limitLatForEnergy is not None:
       self.__geoGridSettings.updateLimitLatForEnergy(limitLatForEnergy)
-      self.__geoGrid.computeEnergiesAndForces()
+      if self.__geoGridInstance is not None:
+        self.__geoGridInstance.computeEnergiesAndForces()
     return self.__geoGridSettings.limitLatForEnergy
 
   def weights(self, potentialKind=None, active=None, weightLand=None, weightOceanActive=None, weightOcean=None, distanceTransitionStart=None, distanceTransitionEnd=None):
     if not potentialKind:
       if any(x is not None for x in [active, weightLand, weightOceanActive, weightOcean, distanceTransitionStart, distanceTransitionEnd]):
         raise Exception('Values can only be updated if the kind of the potential to update is provided')
+      # the effective weights depend on the grid
+      self.__ensureGeoGrid()
       weights = {potentialKind: weight.toJSON(includeTransient=True) for potentialKind, weight in self.__geoGridSettings._potentialsWeights.items()}
       for weight in weights.values():
         weight['distanceTransitionStart'] /= 1000
@@ -158,7 +192,10 @@ class DOMP:
     if modified:
       weight = GeoGridWeight(**weightJSON)
       self.__geoGridSettings.updatePotentialsWeights({potentialKind: weight})
-      self.__geoGrid.computeEnergiesAndForces()
+      if self.__geoGridInstance is not None:
+        self.__geoGridInstance.computeEnergiesAndForces()
+    # the effective weights depend on the grid
+    self.__ensureGeoGrid()
     weightJSON = weight.toJSON(includeTransient=True)
     weightJSON['distanceTransitionStart'] /= 1000
     weightJSON['distanceTransitionEnd'] /= 1000
@@ -181,41 +218,76 @@ class DOMP:
     self.__stepActions()
 
   def __resetGeoGrid(self):
-    self.__geoGrid = GeoGrid(self.__geoGridSettings, callbackStatus=self.__callbackStatus)
+    # the grid is only created when it is used for the first time
+    self.__geoGridInstance = None
+
+  def __ensureGeoGrid(self):
+    if self.__geoGridInstance is None:
+      # the grid (and the modules it needs) is only imported when a grid is used, such that querying settings and collecting data starts fast
+      from src.geoGrid.geoGrid import GeoGrid
+      with self.__operation('create grid'):
+        self.__geoGridInstance = GeoGrid(self.__geoGridSettings, callbackStatus=self.__callbackStatus)
+    return self.__geoGridInstance
+
+  @property
+  def __geoGrid(self):
+    return self.__ensureGeoGrid()
 
   ###### RUN
 
   def __stepActions(self):
-    self.__stepActionsData(self.__dataDataDict)
-    self.__stepActionsVideo(self.__videoDatas)
-  def __stepActionsData(self, dataDataDict={}):
+    self.__stepActionsTiles()
+    if len(self.__dataDataDict) == 0 and len(self.__videoDatas) == 0 and len(self.__callbacksStepData) == 0:
+      return
+    stepData = InterfaceCommon.computeStepData(self.__geoGrid, self.__geoGridSettings)
+    self.__stepActionsData(self.__dataDataDict, stepData=stepData)
+    self.__stepActionsVideo(self.__videoDatas, stepData=stepData)
+    self.__stepActionsCallbacks(self.__callbacksStepData, stepData=stepData)
+  def __stepActionsCallbacks(self, callbacksStepData=[], stepData=None):
+    if len(callbacksStepData) == 0:
+      return
+    row = InterfaceCommon.stepDataRow(self.__geoGridSettings, stepData or InterfaceCommon.computeStepData(self.__geoGrid, self.__geoGridSettings))
+    for callback in callbacksStepData:
+      callback(row)
+  def __stepActionsData(self, dataDataDict={}, stepData=None):
     for dataData, dd in dataDataDict.items():
-      InterfaceCommon.stepData(dataData, self.__geoGridSettings, geoGrid=self.__geoGrid, additionalData=dd['additionalData'] if dd is not None and 'additionalData' in dd else {})
-  def __stepActionsVideo(self, videoDatas=None, videoData=None):
+      InterfaceCommon.stepData(dataData, self.__geoGridSettings, geoGrid=self.__geoGrid, stepData=stepData, additionalData=dd['additionalData'] if dd is not None and 'additionalData' in dd else {})
+  def __stepActionsVideo(self, videoDatas=None, videoData=None, stepData=None):
     if videoData and not videoDatas:
       videoDatas = [videoData]
     if len(videoDatas) == 0:
       return
     self.__viewSettings['captureVideo'] = True
-    im, stepData = InterfaceCommon.renderImage(self.__geoGridSettings, self.__viewSettings, geoGrid=self.__geoGrid)
+    im, stepData = InterfaceCommon.renderImage(self.__geoGridSettings, self.__viewSettings, geoGrid=self.__geoGrid, stepData=stepData)
     self.__viewSettings['captureVideo'] = False
     for videoData in videoDatas:
       InterfaceCommon.stepVideo(im, videoData, stepData)
 
+  def __stepActionsTiles(self):
+    if self.__tileServer is not None:
+      self.__tileServer.publish(self.__geoGrid, self.__geoGridSettings, self.__viewSettings)
+
   def step(self):
     self.steps(n=1)
   def steps(self, n=None):
     def _step():
-      self.__geoGrid.performStep()
+      if self.__tileServer is not None:
+        with self.__tileServer.lockGrid():
+          self.__geoGrid.performStep()
+      else:
+        self.__geoGrid.performStep()
       self.__stepActions()
-    if n is None:
-      while True:
-        _step()
-        if InterfaceCommon.isStopThresholdReached(self.__geoGrid, self.__geoGridSettings):
-          break
-    else:
-      for _ in range(0, n):
-        _step()
+    with self.__operation('steps', f"(n = {n})" if n is not None else '(until the stop threshold is reached)'):
+      if n is None:
+        while True:
+          _step()
+          self.__progress(f"step {self.__geoGrid.step()}")
+          if InterfaceCommon.isStopThresholdReached(self.__geoGrid, self.__geoGridSettings):
+            break
+      else:
+        for i in range(0, n):
+          _step()
+          self.__progress(f"step {self.__geoGrid.step()} ({i + 1}/{n})")
 
   ###### DATA
 
@@ -255,10 +327,27 @@ class DOMP:
 
   def saveData(self, dataData, **kwargs):
     self.stopData(dataData)
-    return InterfaceCommon.saveData(DOMP.__fileFunction(**kwargs), dataData, self.__geoGridSettings)
+    with self.__operation('save data'):
+      return InterfaceCommon.saveData(DOMP.__fileFunction(**kwargs), dataData, self.__geoGridSettings)
+
+  def startStepDataCallback(self, callback, preventInitialSnapshot=False):
+    # the callback is called with the data row (as written to the csv data) after each step
+    self.__callbacksStepData.append(callback)
+    if not preventInitialSnapshot:
+      self.__stepActionsCallbacks([callback])
+    return callback
+
+  def stopStepDataCallback(self, callback):
+    self.__callbacksStepData = [c for c in self.__callbacksStepData if c != callback]
 
-  def screenshot(self, largeSymbols=False, extension='png', **kwargs):
-    return InterfaceCommon.saveScreenshot(DOMP.__fileFunction(**kwargs), self.__geoGridSettings, self.__viewSettings, geoGrid=self.__geoGrid, largeSymbols=largeSymbols, extension=extension)
+  def screenshot(self, largeSymbols=False, extension='png', asynchronous=False, **kwargs):
+    # asynchronous screenshots are rendered and saved in the background (call flush to wait for them); the filename is returned immediately
+    with self.__operation('screenshot', f"({extension})"):
+      return InterfaceCommon.saveScreenshot(DOMP.__fileFunction(**kwargs), self.__geoGridSettings, self.__viewSettings, geoGrid=self.__geoGrid, largeSymbols=largeSymbols, extension=extension, asynchronous=asynchronous)
+
+  def flush(self):
+    with self.__operation('wait for exports'):
+      InterfaceCommon.flushExports()
 
   def startVideo(self):
     videoData = InterfaceCommon.startVideo()
@@ -268,10 +357,46 @@ class DOMP:
 
   def saveVideo(self, videoData, **kwargs):
     self.__videoDatas = [vd for vd in self.__videoDatas if vd != videoData]
-    return InterfaceCommon.saveVideo(DOMP.__fileFunction(**kwargs), videoData, self.__geoGridSettings)
+    with self.__operation('save video'):
+      return InterfaceCommon.saveVideo(DOMP.__fileFunction(**kwargs), videoData, self.__geoGridSettings)
 
   def saveJSON(self, data, **kwargs):
-    return InterfaceCommon.saveJSON(DOMP.__fileFunction(**kwargs), data)
+    with self.__operation('save json'):
+      return InterfaceCommon.saveJSON(DOMP.__fileFunction(**kwargs), data)
+
+  ###### METRICS
+
+  def startMetrics(self, keepEvents=True):
+    # collects the durations of the timed sections (per step and hierarchically) and counters; keepEvents is needed for the trace
+    metrics.reset()
+    metrics.enable(keepEvents=keepEvents)
+
+  def stopMetrics(self):
+    metrics.disable()
+
+  def metrics(self):
+    return metrics.toJSON()
+
+  def saveMetrics(self, format='json', **kwargs):
+    # format: 'json', 'csv', or 'trace' (Chrome trace event format)
+    with self.__operation('save metrics'):
+      return InterfaceCommon.saveMetrics(DOMP.__fileFunction(**kwargs), self.__geoGridSettings, format=format)
+
+  ###### TILE SERVER
+
+  def startTileServer(self, port=8000, host='127.0.0.1', cacheSize=2048):
+    # serves the tiles of the current projection (updated after each step) and of the previous ones, and returns the URL of a map viewer
+    if self.__tileServer is None:
+      from src.interfaces.common.tileServer import TileServer
+      self.__tileServer = TileServer(host=host, port=port, cacheSize=cacheSize)
+    url = self.__tileServer.start()
+    self.__stepActionsTiles()
+    return url
+
+  def stopTileServer(self):
+    if self.__tileServer is not None:
+      self.__tileServer.stop()
+      self.__tileServer = None
 
   ###### COLLECTING DATA
 
@@ -281,21 +406,12 @@ class DOMP:
 
   ###### WITH
 
-  def __trace(self, frame, event, arg):
-    if event != 'line':
-      return
-    lineNumber = frame.f_lineno
-    Console.status(f'\nline {lineNumber + 1:>5} |', self.__codeFulltext[lineNumber - 1].strip())
-
   def __enter__(self):
-    if self.__logging:
-      sys.settrace(lambda *args, **kwargs: None)
-      frame = sys._getframe(1)
-      self.__codeFulltext = py.code.Frame(sys._getframe(1)).code.fullsource
-      frame.f_trace = self.__trace
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
+    self.stopTileServer()
+    self.flush()
     if self.__cleanup:
       self.__callbackStatus('cleanup')
       InterfaceCommon.cleanup()
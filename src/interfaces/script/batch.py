@@ -0,0 +1,213 @@
+import os
+import queue
+import traceback
+
+from src.common.console import Console
+from src.geoGrid.geoGridSettings import GeoGridSettings
+from src.geometry.naturalEarth import NaturalEarth
+from src.interfaces.common.file import File
+from src.interfaces.script.app import DOMP
+
+class BatchJob:
+  # settings are applied by calling the corresponding methods of DOMP, e.g., {'resolution': 4, 'stopThreshold': {'maxSteps': 1000}}
+  settingsAllowed = ['resolution', 'dampingFactor', 'speed', 'adaptiveStep', 'stopThreshold', 'limitLatForEnergy', 'normalizeWeights']
+
+  def __init__(self, projection, weights=None, settings=None, action=None, name=None, streamData=True):
+    self.projection = projection
+    self.weights = weights or {}
+    self.settings = settings or {}
+    self.action = action
+    self.name = name or projection.name
+    self.streamData = streamData
+    self.index = None
+    for key in self.settings:
+      if key not in BatchJob.settingsAllowed:
+        raise Exception(f"Unknown setting: {key}")
+
+  def resolution(self):
+    return self.settings['resolution'] if 'resolution' in self.settings else GeoGridSettings().resolution
+
+  def run(self, domp, callbackStepData=None):
+    # settings
+    for key, value in self.settings.items():
+      if isinstance(value, dict):
+        getattr(domp, key)(**value)
+      else:
+        getattr(domp, key)(value)
+    # projection and weights
+    domp.loadProjection(self.projection)
+    for potentialKind, weight in self.weights.items():
+      domp.weights(potentialKind, **weight)
+    # run
+    if callbackStepData is not None:
+      domp.startStepDataCallback(callbackStepData)
+    if self.action is not None:
+      result = self.action(domp, self)
+    else:
+      result = None
+      domp.steps()
+    if callbackStepData is not None:
+      domp.stopStepDataCallback(callbackStepData)
+    # artefacts
+    return {
+      'name': self.name,
+      'settings': domp.settings(),
+      'energy': domp.energy(),
+      'energyPerPotential': domp.energyPerPotential(),
+      'countDeficiencies': len(domp.deficiencies()),
+      'result': result,
+    }
+
+### WORKER
+
+_workerQueue = None
+
+def _initWorker(messages, topologyHandles):
+  global _workerQueue
+  _workerQueue = messages
+  from src.geoGrid.geoGridTopology import GeoGridTopology
+  # the topologies are shared with the main process via shared memory, and the remaining data is loaded only once per worker
+  for topologyHandle in topologyHandles:
+    GeoGridTopology.register(GeoGridTopology.fromSharedMemory(topologyHandle))
+  NaturalEarth.preparedData()
+
+def _runJob(index, attempt, job, logging):
+  send = lambda kind, data=None: _workerQueue.put((kind, index, attempt, data))
+  send('start')
+  try:
+    with DOMP(cleanup=False, logging=logging, hideAbout=True) as domp:
+      result = job.run(domp, callbackStepData=(lambda row: send('row', row)) if job.streamData else None)
+    send('result', (True, result))
+  except Exception:
+    send('result', (False, traceback.format_exc()))
+
+class _DirectQueue:
+  def __init__(self, handle):
+    self.__handle = handle
+
+  def put(self, message):
+    self.__handle(message)
+
+### BATCH
+
+class DOMPBatch:
+  def __init__(self, processes=None, parallelize=True, retries=0, logging=False, callbackRow=None, callbackResult=None, callbackProgress=None):
+    self.__processes = processes or os.cpu_count()
+    self.__parallelize = parallelize and self.__processes > 1
+    self.__retries = retries
+    self.__logging = logging
+    self.__callbackRow = callbackRow
+    self.__callbackResult = callbackResult
+    self.__callbackProgress = callbackProgress
+    self.__reset([])
+
+  def __reset(self, jobs):
+    self.__jobs = jobs
+    self.__results = [None] * len(jobs)
+    self.__errors = {}
+    self.__rows = {}
+    self.__attempts = [0] * len(jobs)
+    self.__running = set()
+    self.__finished = set()
+    self.__toRetry = []
+
+  def run(self, jobs):
+    self.__reset(list(jobs))
+    for index, job in enumerate(self.__jobs):
+      job.index = index
+    from src.geoGrid.geoGridTopology import GeoGridTopology
+    topologies = [GeoGridTopology.forResolution(resolution) for resolution in sorted(set(job.resolution() for job in self.__jobs))]
+    if self.__parallelize:
+      from multiprocess import Pool, Queue
+      try:
+        messages = Queue()
+        with Pool(processes=self.__processes, initializer=_initWorker, initargs=(messages, [topology.toSharedMemory() for topology in topologies])) as pool:
+          submit = lambda index: pool.apply_async(_runJob, (index, self.__attempts[index], self.__jobs[index], self.__logging))
+          asyncResults = dict((index, submit(index)) for index in range(len(self.__jobs)))
+          while len(self.__finished) < len(self.__jobs):
+            try:
+              self.__handle(messages.get(timeout=.1))
+            except queue.Empty:
+              pass
+            for index in self.__toRetry:
+              asyncResults[index] = submit(index)
+            self.__toRetry = []
+            for index, asyncResult in asyncResults.items():
+              # the job could not even be started, e.g., because it cannot be pickled
+              if asyncResult.ready() and not asyncResult.successful() and index not in self.__finished:
+                try:
+                  asyncResult.get(0)
+                except Exception as e:
+                  self.__handle(('result', index, self.__attempts[index], (False, repr(e))))
+      finally:
+        for topology in topologies:
+          topology.releaseSharedMemory()
+    else:
+      _initWorker(_DirectQueue(self.__handle), [])
+      for index in range(len(self.__jobs)):
+        _runJob(index, self.__attempts[index], self.__jobs[index], self.__logging)
+        while len(self.__toRetry) > 0:
+          self.__toRetry = []
+          _runJob(index, self.__attempts[index], self.__jobs[index], self.__logging)
+    if self.__callbackProgress is None:
+      Console.clearStatus()
+    return self.__results
+
+  def __handle(self, message):
+    kind, index, attempt, data = message
+    job = self.__jobs[index]
+    if kind == 'start':
+      self.__running.add(index)
+    elif kind == 'row':
+      data = {'batchJob': job.name, **data}
+      self.__rows.setdefault((index, attempt), []).append(data)
+      if self.__callbackRow is not None:
+        self.__callbackRow(job, data)
+    elif kind == 'result':
+      self.__running.discard(index)
+      successful, result = data
+      if successful:
+        self.__results[index] = result
+        self.__finished.add(index)
+        if self.__callbackResult is not None:
+          self.__callbackResult(job, result)
+      elif attempt < self.__retries:
+        Console.print(f"batch job {job.name} failed, retrying ...")
+        self.__attempts[index] = attempt + 1
+        self.__toRetry.append(index)
+      else:
+        Console.print(f"batch job {job.name} failed:\n{result}")
+        self.__errors[index] = result
+        self.__finished.add(index)
+    self.__progress()
+
+  def __progress(self):
+    progress = {
+      'total': len(self.__jobs),
+      'finished': len(self.__finished),
+      'running': len(self.__running),
+      'failed': len(self.__errors),
+    }
+    if self.__callbackProgress is not None:
+      self.__callbackProgress(progress)
+    else:
+      Console.status(f"batch: {progress['finished']}/{progress['total']} jobs finished, {progress['running']} running, {progress['failed']} failed")
+
+  def errors(self):
+    return dict((self.__jobs[index].name, error) for index, error in self.__errors.items())
+
+  def rows(self):
+    # only the rows of the successful attempt of each job are kept, in the order of the jobs
+    return [row for index in range(len(self.__jobs)) if index not in self.__errors for row in self.__rows.get((index, self.__attempts[index]), [])]
+
+  def saveData(self, **kwargs):
+    rows = self.rows()
+    keys = []
+    for row in rows:
+      keys += [key for key in row if key not in keys]
+    pathAndFilename = File('batch', extension='csv').apply(lambda file: file.update(**kwargs)).pathAndFilename()
+    with open(pathAndFilename, 'w') as f:
+      f.write(f"{','.join(keys)}\n")
+      for row in rows:
+        f.write(f"{','.join(row[key] if key in row else '' for key in keys)}\n")
+    return pathAndFilename
@@ -0,0 +1,62 @@
+import numpy as np
+
+class Forces:
+  # a batch of forces of one kind as arrays, computed by a vectorized potential (or collected from the forces of a potential computed cell by cell)
+  # the force k acts on the cell with index froms[k], points to the cell with index tos[k] (or -1 if it points to an arbitrary destination), and is caused by the potential of the cell with index sources[k] (which determines its weight)
+  def __init__(self, kind, froms, tos, xs, ys, sources=None, withoutDamping=False):
+    self.kind = kind
+    self.froms = froms
+    self.tos = tos
+    self.xs = xs
+    self.ys = ys
+    self.sources = sources
+    self.withoutDamping = withoutDamping
+    self.__byCell = None
+
+  def __len__(self):
+    return len(self.froms)
+
+  # forces in the direction of froms -> froms + deltas (as Force)
+  @staticmethod
+  def byDeltas(kind, froms, dXs, dYs, strengths, tos=None, sources=None, withoutDamping=False):
+    isVanishing = ((dXs == 0) & (dYs == 0)) | (strengths == 0)
+    ks = strengths / np.where(isVanishing, 1, np.sqrt(dXs * dXs + dYs * dYs))
+    xs = np.where(isVanishing, 0, ks * dXs)
+    ys = np.where(isVanishing, 0, ks * dYs)
+    return Forces(kind, froms, tos if tos is not None else np.full(len(froms), -1, dtype=np.int64), xs, ys, sources=sources, withoutDamping=withoutDamping)
+
+  @staticmethod
+  def concatenate(kind, forcesList, withoutDamping=False):
+    return Forces(
+      kind,
+      np.concatenate([forces.froms for forces in forcesList]),
+      np.concatenate([forces.tos for forces in forcesList]),
+      np.concatenate([forces.xs for forces in forcesList]),
+      np.concatenate([forces.ys for forces in forcesList]),
+      sources=np.concatenate([forces.sources for forces in forcesList]),
+      withoutDamping=withoutDamping,
+    )
+
+  @staticmethod
+  def fromForces(kind, forces, indexById2):
+    return Forces(
+      kind,
+      np.fromiter((indexById2[force.id2From] for force in forces), dtype=np.int64, count=len(forces)),
+      np.fromiter((indexById2[force.id2To] if force.id2To is not None else -1 for force in forces), dtype=np.int64, count=len(forces)),
+      np.fromiter((force.x for force in forces), dtype=np.float64, count=len(forces)),
+      np.fromiter((force.y for force in forces), dtype=np.float64, count=len(forces)),
+    )
+
+  def scaleStrength(self, factors):
+    self.xs = self.xs * factors
+    self.ys = self.ys * factors
+
+  def forCell(self, i):
+    # the forces acting on the cell as tuples (to, x, y), in the order of the batch
+    if self.__byCell is None:
+      self.__byCell = {}
+      for f, t, x, y in zip(self.froms.tolist(), self.tos.tolist(), self.xs.tolist(), self.ys.tolist()):
+        if f not in self.__byCell:
+          self.__byCell[f] = []
+        self.__byCell[f].append((t, x, y))
+    return self.__byCell.get(i, [])
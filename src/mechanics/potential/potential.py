@@ -1,6 +1,6 @@
+import numpy as np
+
 from src.common.functions import sign
-from src.geometry.common import Common
-from src.geometry.geo import Geo
 
 class Potential:
   kind = None
@@ -9,8 +9,6 @@ class Potential:
   calibrationPossible = False
   considerForSumOfWeights = True
   __exponent = 1
-  __geoBearingsCache = {}
-  __geoDistanceCache = {}
 
   def __init__(self, settings):
     self._settings = settings
@@ -20,8 +18,6 @@ class Potential:
   def emptyCacheAll(self):
     self.emptyCacheDampingFactor()
     self.emptyCacheForStep()
-    self.__geoBearingsCache = {}
-    self.__geoDistanceCache = {}
 
   def emptyCacheDampingFactor(self):
     self.__D = None
@@ -32,18 +28,14 @@ class Potential:
   def setCalibrationFactor(self, k):
     self.calibrationFactor = k
 
-  def _geoBearingsForCell(self, cell, neighbouringCells):
-    key = cell._id2
-    if key not in self.__geoBearingsCache:
-      # the y axis of the Cartesian coordinate system is inverted, thus the ‘-’ in the formula below
-      self.__geoBearingsCache[key] = [Common.normalizeAngle(-Geo.bearing(cell._centreOriginal, neighbouringCell._centreOriginal)) for neighbouringCell in neighbouringCells]
-    return self.__geoBearingsCache[key]
+  # the geodesic tables of the topology, aligned with the neighbouring cells (all neighbours of the cell that are part of the grid)
+  @staticmethod
+  def _geoBearingsForCell(cell):
+    return cell._topology.neighboursGeoBearings(cell._index)
 
-  def _geoDistanceForCells(self, cell1, cell2):
-    key = (cell1._id2, cell2._id2)
-    if key not in self.__geoDistanceCache:
-      self.__geoDistanceCache[key] = Geo.distance(cell1._centreOriginal, cell2._centreOriginal)
-    return self.__geoDistanceCache[key]
+  @staticmethod
+  def _geoDistancesForCell(cell):
+    return cell._topology.neighboursGeoDistances(cell._index)
 
   def energy(self, cell, neighbouringCells):
     raise Exception('Needs to be implemented by inheriting class')
@@ -51,6 +43,9 @@ class Potential:
     raise Exception('Needs to be implemented by inheriting class')
   def energyAndForces(self, cell, neighbouringCells):
     raise Exception('Needs to be implemented by inheriting class')
+  # the kernel (optional, see potentials.py), computing all cells at once from the arrays of the state, the topology, and the weights of the cells: the energies of the cells as an array, and the forces (not yet weighted) as Forces
+  def energiesAndForces(self, state, topology, weights):
+    raise Exception('Needs to be implemented by inheriting class')
 
   def _value(self, cell, *args):
     raise Exception('Needs to be implemented by inheriting class')
@@ -61,11 +56,18 @@ class Potential:
     return self.__quantity(self._value(*args), **kwargs)
   def _quantities(self, *args, **kwargs):
     return [self.__quantity(r, **kwargs) for r in self._values(*args)]
-  def __quantity(self, r, onlyEnergy=False, onlyForce=False, relativeToTypicalDistance=True):
+  def _quantitiesArray(self, rs, relativeToTypicalDistance=True):
+    # the energies and forces for an array of values
+    self.__initD(relativeToTypicalDistance)
+    ks = self.__D * np.abs(rs)**self.__exponent
+    return ks / (self.__exponent + 1) * np.abs(rs), ks * np.copysign(1, rs)
+  def __initD(self, relativeToTypicalDistance):
     # D – spring constant
     #     chosen such that the force at r = 1/2 is -delta/2 (where delta is the typical distance)
     if self.__D is None:
       self.__D = (self._settings._typicalDistance if relativeToTypicalDistance else 1) * 2**(self.__exponent - 1)
+  def __quantity(self, r, onlyEnergy=False, onlyForce=False, relativeToTypicalDistance=True):
+    self.__initD(relativeToTypicalDistance)
     if onlyEnergy:
       return self.__D / (self.__exponent + 1) * abs(r)**(self.__exponent + 1)
     elif onlyForce:
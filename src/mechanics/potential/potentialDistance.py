@@ -12,18 +12,17 @@ class PotentialDistance(Potential):
     super().__init__(*args, **kwargs)
 
   def energy(self, cell, neighbouringCells):
-    return sum(self._quantity(cell, neighbouringCell, onlyEnergy=True) for neighbouringCell in neighbouringCells)
+    return sum(self._quantity(cell, neighbouringCell, geoD, onlyEnergy=True) for neighbouringCell, geoD in zip(neighbouringCells, self._geoDistancesForCell(cell)))
   def forces(self, cell, neighbouringCells):
-    return [Force.toCell(self.kind, neighbouringCell, cell, self._quantity(cell, neighbouringCell, onlyForce=True)) for neighbouringCell in neighbouringCells]
+    return [Force.toCell(self.kind, neighbouringCell, cell, self._quantity(cell, neighbouringCell, geoD, onlyForce=True)) for neighbouringCell, geoD in zip(neighbouringCells, self._geoDistancesForCell(cell))]
   def energyAndForces(self, cell, neighbouringCells):
     energy, forces = 0, []
-    for neighbouringCell in neighbouringCells:
-      qEnergy, qForce = self._quantity(cell, neighbouringCell)
+    for neighbouringCell, geoD in zip(neighbouringCells, self._geoDistancesForCell(cell)):
+      qEnergy, qForce = self._quantity(cell, neighbouringCell, geoD)
       energy += qEnergy
       forces.append(Force.toCell(self.kind, neighbouringCell, cell, qForce))
     return energy, forces
 
-  def _value(self, cell, neighbouringCell):
+  def _value(self, cell, neighbouringCell, geoD):
     cartesianD = Cartesian.distance(neighbouringCell.point(), cell.point()) * self.calibrationFactor
-    geoD = self._geoDistanceForCells(neighbouringCell, cell)
     return cartesianD / geoD - 1
@@ -1,17 +1,23 @@
 import math
+import numpy as np
 import sys
 
 from src.geometry.cartesian import Cartesian, Point
 from src.geometry.common import Common
+from src.geometry.geoVectorized import GeoVectorized
 from src.geoGrid.geoGridWeight import GeoGridWeight
 from src.mechanics.force import Force
+from src.mechanics.forces import Forces
 from src.mechanics.potential.potential import Potential
 
 class PotentialDistanceHomogeneity(Potential):
   kind = 'DISTANCE_HOMOGENEITY'
   defaultWeight = GeoGridWeight(active=False, weightLand=.2, weightOceanActive=True, weightOcean=.05, distanceTransitionStart=100000, distanceTransitionEnd=800000)
   calibrationPossible = False
+  __dataForStepCache = None
   __dataForCellCache = {}
+  # the scales exp(G) which overflow are replaced by the square root of the largest float
+  __scaleMax = math.sqrt(sys.float_info.max)
 
   def __init__(self, *args, enforceNorth=False, **kwargs):
     super().__init__(*args, **kwargs)
@@ -19,13 +25,68 @@ class PotentialDistanceHomogeneity(Potential):
 
   def emptyCacheForStep(self):
     super().emptyCacheForStep()
+    self.__dataForStepCache = None
     self.__dataForCellCache = {}
 
+  def __dataForStep(self, state):
+    # the values of all cells and the force vectors along all edges of neighboursIndices, which are computed once per step
+    # the force vectors act on the neighbours, and only along the edges marked by isForce
+    if self.__dataForStepCache is None or self.__dataForStepCache[0] is not state:
+      topology = state.topology
+      n = len(topology)
+      indptr, neighbours = topology.neighboursIndices()
+      rows = topology.neighboursIndicesRows()
+      counts = np.diff(indptr)
+      isActive = np.asarray(topology.arrays()['isActive'])
+      geoDistances, geoBearings = topology.neighboursGeodesics()
+      # compute bearings
+      xs, ys = state.xs, state.ys
+      dXs, dYs = xs[neighbours] - xs[rows], ys[neighbours] - ys[rows]
+      bearings = np.mod(np.arctan2(dYs, dXs) + 1.5 * Common._pi, Common._2pi)
+      # compute average difference
+      avgDiffs = (np.bincount(rows, weights=GeoVectorized.normalizeAngle(bearings - geoBearings, intervalStart=-Common._pi), minlength=n) / np.maximum(counts, 1))[rows]
+      # compute scales, ignoring the edges which have almost vanished
+      rs = np.sqrt(dXs * dXs + dYs * dYs) * self.calibrationFactor
+      isEdge = isActive[rows] & (rs > 1e-3 * self._settings._typicalDistance)
+      sins, coss = np.sin(bearings), np.cos(bearings)
+      sinsGeo, cossGeo = np.sin(geoBearings + avgDiffs), np.cos(geoBearings + avgDiffs)
+      absSinCos = np.abs(sins) + np.abs(coss)
+      # the weighted geometric average of the scales in X and Y direction, accumulated as sums of logarithms
+      def _logScales(vs, vsGeo):
+        isScale = isEdge & (np.abs(vs) >= 1e-1) & (np.abs(vsGeo) >= 1e-1) & (vs * vsGeo > 0)
+        weights = np.where(isScale, np.abs(vs) / absSinCos, 0)
+        logs = np.log(np.where(isScale, rs * vs / (geoDistances * np.where(isScale, vsGeo, 1)), 1))
+        return np.bincount(rows, weights=weights, minlength=n), np.bincount(rows, weights=weights * logs, minlength=n)
+      sinWeights, sinLogScales = _logScales(sins, sinsGeo)
+      cosWeights, cosLogScales = _logScales(coss, cossGeo)
+      # only proceed if scales are found
+      hasScales = (sinWeights > 0) & (cosWeights > 0)
+      def _scale(weights, logScales):
+        # the exponent G is the weighted geometric average (as computed cell by cell)
+        with np.errstate(over='ignore'):
+          scales = np.exp(np.exp(logScales / np.where(hasScales, weights, 1)))
+        return np.where(hasScales, np.where(np.isinf(scales), self.__scaleMax, scales), 1)
+      scalesX = _scale(sinWeights, sinLogScales)
+      scalesY = _scale(cosWeights, cosLogScales)
+      # geometric average scale of X and Y direction
+      with np.errstate(over='ignore'):
+        scales = np.sqrt(scalesX * scalesY)
+      # values
+      values = np.where(hasScales, np.minimum(1, np.maximum(np.abs(scalesX / scalesY), np.abs(scalesY / scalesX)) - 1), 0)
+      # force vectors
+      isForce = isEdge & hasScales[rows]
+      forceXs = (scales - scalesX)[rows] * rs * sins
+      forceYs = (scales - scalesY)[rows] * rs * coss
+      self.__dataForStepCache = state, values, isForce, forceXs, forceYs
+    return self.__dataForStepCache[1:]
+
   def __dataForCell(self, cell, neighbouringCells):
+    # the force vectors and the value of the cell, computed cell by cell (which serves as a reference for energiesAndForces)
     key = cell._id2
     if key not in self.__dataForCellCache:
       lenNeighbours = len(neighbouringCells)
-      bearingGeo = self._geoBearingsForCell(cell, neighbouringCells)
+      bearingGeo = self._geoBearingsForCell(cell)
+      rsGeo = self._geoDistancesForCell(cell)
       # compute bearings
       bearings = [Cartesian.bearing(cell.point(), neighbouringCell.point()) for neighbouringCell in neighbouringCells]
       # compute average difference
@@ -42,7 +103,7 @@ class PotentialDistanceHomogeneity(Potential):
           sins.append(None)
           coss.append(None)
           continue
-        rGeo = self._geoDistanceForCells(neighbouringCell, cell)
+        rGeo = rsGeo[i]
         sin, cos = math.sin(bearings[i]), math.cos(bearings[i])
         sinGeo, cosGeo = math.sin(bearingGeo[i] + avgDiff), math.cos(bearingGeo[i] + avgDiff)
         absSinCos = abs(sin) + abs(cos)
@@ -65,11 +126,11 @@ class PotentialDistanceHomogeneity(Potential):
         try:
           scaleX = math.exp(sinScales**(1 / sinWeights))
         except OverflowError:
-          scaleX = math.sqrt(sys.float_info.max)
+          scaleX = self.__scaleMax
         try:
           scaleY = math.exp(cosScales**(1 / cosWeights))
         except OverflowError:
-          scaleY = math.sqrt(sys.float_info.max)
+          scaleY = self.__scaleMax
         # geometric average scale of X and Y direction
         scale = math.sqrt(scaleX * scaleY)
         # force vectors
@@ -103,6 +164,13 @@ class PotentialDistanceHomogeneity(Potential):
     forceVectors, _ = d
     forces = [Force.byDelta(self.kind, neighbouringCell, forceVector, qForce) for forceVector, neighbouringCell in zip(forceVectors, neighbouringCells) if forceVector is not None]
     return energy, forces
+  def energiesAndForces(self, state, topology, weights):
+    values, isForce, forceXs, forceYs = self.__dataForStep(state)
+    _, neighbours = topology.neighboursIndices()
+    rows = topology.neighboursIndicesRows()
+    qEnergies, qForces = self._quantitiesArray(values)
+    energies = np.where(np.asarray(topology.arrays()['isActive']), qEnergies, 0)
+    return energies, Forces.byDeltas(self.kind, neighbours[isForce], forceXs[isForce], forceYs[isForce], qForces[rows[isForce]], sources=rows[isForce])
 
   def _value(self, cell, neighbouringCells):
     d = self.__dataForCell(cell, neighbouringCells)
@@ -1,7 +1,11 @@
+import numpy as np
+
 from src.geometry.cartesian import Cartesian, Point
 from src.geometry.common import Common
+from src.geometry.geoVectorized import GeoVectorized
 from src.geoGrid.geoGridWeight import GeoGridWeight
 from src.mechanics.force import Force
+from src.mechanics.forces import Forces
 from src.mechanics.potential.potential import Potential
 
 class PotentialShape(Potential):
@@ -42,10 +46,39 @@ class PotentialShape(Potential):
 
   def _values(self, cell, neighbouringCells):
     lenNeighbours = len(cell._neighbours)
-    bearingIdeal = self._geoBearingsForCell(cell, neighbouringCells)
+    bearingIdeal = self._geoBearingsForCell(cell)
     # compute bearings
     bearings = [Cartesian.bearing(cell.point(), neighbouringCell.point()) for neighbouringCell in neighbouringCells]
     # compute average difference
     avgDiff = 0 if self._enforceNorth else sum([Common.normalizeAngle(bearings[i] - bearingIdeal[i], intervalStart=-Common._pi) for i in range(0, lenNeighbours)]) / lenNeighbours
     # quantities
     return [len(bearings) / Common._pi * abs(Common.normalizeAngle(bearing - (bearingIdeal[i] + avgDiff), intervalStart=-Common._pi)) for i, bearing in enumerate(bearings)]
+
+  def energiesAndForces(self, state, topology, weights):
+    # the same computation as energyAndForces, for all edges between active cells and their neighbours at once
+    n = len(topology)
+    indptr, indices = topology.neighboursIndices()
+    rows = topology.neighboursIndicesRows()
+    isEdgeActive = np.asarray(topology.arrays()['isActive'])[rows]
+    rows, neighbours = rows[isEdgeActive], indices[isEdgeActive]
+    bearingsIdeal = topology.neighboursGeodesics()[1][isEdgeActive]
+    counts = np.diff(indptr)
+    countsEdges = counts[rows]
+    # compute bearings
+    xs, ys = state.xs, state.ys
+    bearings = np.mod(np.arctan2(ys[neighbours] - ys[rows], xs[neighbours] - xs[rows]) + 1.5 * Common._pi, Common._2pi)
+    # compute average difference
+    if self._enforceNorth:
+      avgDiffs = 0
+    else:
+      avgDiffs = (np.bincount(rows, weights=GeoVectorized.normalizeAngle(bearings - bearingsIdeal, intervalStart=-Common._pi), minlength=n) / np.maximum(counts, 1))[rows]
+    # quantities
+    qEnergies, qForces = self._quantitiesArray(countsEdges / Common._pi * np.abs(GeoVectorized.normalizeAngle(bearings - (bearingsIdeal + avgDiffs), intervalStart=-Common._pi)))
+    energies = np.bincount(rows, weights=qEnergies, minlength=n)
+    if self.averaged:
+      qForces = (np.bincount(rows, weights=qForces, minlength=n) / np.maximum(counts, 1))[rows]
+    # forces on the neighbours, perpendicular to the direction to the cell
+    xsNeighbours, ysNeighbours = xs[neighbours], ys[neighbours]
+    dXs = (xsNeighbours + (ysNeighbours - ys[rows])) - xsNeighbours
+    dYs = (ysNeighbours - (xsNeighbours - xs[rows])) - ysNeighbours
+    return energies, Forces.byDeltas(self.kind, neighbours, dXs, dYs, qForces, sources=rows)
@@ -1,29 +1,32 @@
+import numpy as np
+
 from src.geometry.cartesian import Cartesian, Point
 from src.geoGrid.geoGridWeight import GeoGridWeight
 from src.mechanics.force import Force
+from src.mechanics.forces import Forces
 from src.mechanics.potential.potential import Potential
 
 class PotentialTriangleAltitude(Potential):
+  # a constraint rather than a potential: it is computed after all other potentials, and corrects the triangles of neighbouring cells whose altitudes would become too short (or whose orientation would be swapped) when the forces of the other potentials were applied
   kind = 'TRIANGLE_ALTITUDE'
   computationalOrder = 1
   defaultWeight = GeoGridWeight(active=True, weightLand=1, weightOceanActive=False, weightOcean=0.3, distanceTransitionStart=100000, distanceTransitionEnd=800000)
   calibrationPossible = False
   considerForSumOfWeights = False
   maximumStrengthRatioOfTypicalDistance = .2
-  __dataForCellCache = {}
+  # the number of passes over all triangles: within a pass, all triangles are evaluated with the same predicted positions (Jacobi), and the corrections of a pass are only applied to the predicted positions before the next pass
+  # further passes (iterated Jacobi) are optional, e.g., PotentialTriangleAltitude.iterations = 2, and are only computed by energiesAndForces (the computation cell by cell corresponds to the first pass)
+  iterations = 1
 
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
 
-  def emptyCacheForStep(self):
-    super().emptyCacheForStep()
-    self.__dataForCellCache = {}
-
   def energy(self, cell, neighbouringCells):
     return 0
-    # cells = dict((neighbouringCell._id2, neighbouringCell) for neighbouringCell in neighbouringCells)
-    # return sum(self._quantity(cell, cells[i], cells[j], onlyEnergy=True, relativeToTypicalDistance=False) for i, j in cell.getNeighbourTriangles() if i in cells and j in cells)
   def forces(self, cell, neighbouringCells):
+    return self.energyAndForces(cell, neighbouringCells)[1]
+  def energyAndForces(self, cell, neighbouringCells):
+    # the triangles of the cell, evaluated with the positions predicted by the forces computed so far (as the first pass of energiesAndForces)
     cells = dict((neighbouringCell._id2, neighbouringCell) for neighbouringCell in neighbouringCells)
     forces = []
     for i, j in cell.getNeighbourTriangles():
@@ -32,43 +35,60 @@ class PotentialTriangleAltitude(Potential):
       qForce = self._quantity(cell, cells[i], cells[j], onlyForce=True, relativeToTypicalDistance=False)
       if qForce == 0:
         continue
-      p = self.__dataForCellCache[(cell._id2, i, j)][1]
+      p = self.__destination(Point(*cell.applyForces(persist=False)), Point(*cells[i].applyForces(persist=False)), Point(*cells[j].applyForces(persist=False)))
       forces.append(Force.toDestination(self.kind, cell, p, qForce, withoutDamping=True))
       delta = Point(cell.x - p.x, cell.y - p.y)
       forces.append(Force.byDelta(self.kind, cells[i], delta, qForce / 2, withoutDamping=True))
       forces.append(Force.byDelta(self.kind, cells[j], delta, qForce / 2, withoutDamping=True))
-    return forces
-  def energyAndForces(self, cell, neighbouringCells):
-    return 0, self.forces(cell, neighbouringCells=neighbouringCells)
-    # cells = dict((neighbouringCell._id2, neighbouringCell) for neighbouringCell in neighbouringCells)
-    # quantities = [(i, j, self._quantity(cell, cells[i], cells[j], relativeToTypicalDistance=False)) for i, j in cell.getNeighbourTriangles() if i in cells and j in cells]
-    # energy = sum(qEnergy for _, _, (qEnergy, _) in quantities)
-    # forces = []
-    # for i, j, (_, qForce) in quantities:
-    #   if qForce == 0:
-    #     continue
-    #   p = self.__dataForCellCache[(cell._id2, i, j)][1]
-    #   forces.append(Force.toDestination(self.kind, cell, p, qForce / 2, withoutDamping=True))
-    #   delta = Point(cell.x - p.x, cell.y - p.y)
-    #   forces.append(Force.byDelta(self.kind, cells[i], delta, qForce / 2, withoutDamping=True))
-    #   forces.append(Force.byDelta(self.kind, cells[j], delta, qForce / 2, withoutDamping=True))
-    # return energy, forces
+    return 0, forces
+  def energiesAndForces(self, state, topology, weights):
+    indices0, indices1, indices2 = topology.neighbourTriangles()
+    froms = np.stack([indices0, indices1, indices2], axis=1).ravel()
+    sources = np.repeat(indices0, 3)
+    # the positions predicted by the forces of the other potentials
+    xsForces, ysForces = state.forcesNext()
+    xs, ys = state.xs + xsForces, state.ys + ysForces
+    forcesList = []
+    for iteration in range(self.iterations):
+      strengths, pXs, pYs = self.__corrections(xs[indices0], ys[indices0], xs[indices1], ys[indices1], xs[indices2], ys[indices2])
+      _, qForces = self._quantitiesArray(strengths, relativeToTypicalDistance=False)
+      # the first corner is moved to the point with the minimum altitude, and the other two corners are moved in the opposite direction by half of the strength
+      dXs, dYs = state.xs[indices0] - pXs, state.ys[indices0] - pYs
+      isCorrected = np.repeat(strengths != 0, 3)
+      forces = Forces.byDeltas(self.kind, froms[isCorrected], np.stack([-dXs, dXs, dXs], axis=1).ravel()[isCorrected], np.stack([-dYs, dYs, dYs], axis=1).ravel()[isCorrected], np.stack([qForces, qForces / 2, qForces / 2], axis=1).ravel()[isCorrected], sources=sources[isCorrected], withoutDamping=True)
+      forcesList.append(forces)
+      # correct the predicted positions for the next pass
+      if iteration < self.iterations - 1:
+        if len(forces) == 0:
+          break
+        xs = xs + np.bincount(forces.froms, weights=forces.xs * weights[forces.sources], minlength=len(topology))
+        ys = ys + np.bincount(forces.froms, weights=forces.ys * weights[forces.sources], minlength=len(topology))
+    return np.zeros(len(topology)), Forces.concatenate(self.kind, forcesList, withoutDamping=True)
+
+  def __corrections(self, xs0, ys0, xs1, ys1, xs2, ys2):
+    # the strengths of the corrections of the first corners, and the points to which they are moved (as _value and __destination)
+    minimumDistance = self._settings._almostDeficiencyRatioOfTypicalDistance * self._settings._typicalDistance
+    dXs, dYs = xs2 - xs1, ys2 - ys1
+    lengths2 = dXs * dXs + dYs * dYs
+    isDegenerate = lengths2 == 0
+    lengths2 = np.where(isDegenerate, 1, lengths2)
+    lengths = np.sqrt(lengths2)
+    altitudes = (xs0 * (ys1 - ys2) + xs1 * (ys2 - ys0) + xs2 * (ys0 - ys1)) / lengths * self.calibrationFactor
+    strengths = np.where(isDegenerate, 0, np.minimum(np.maximum(0, -altitudes + minimumDistance), self.maximumStrengthRatioOfTypicalDistance * self._settings._typicalDistance))
+    # project to the line, and move away from it by the minimum distance
+    ks = ((xs0 - xs1) * dXs + (ys0 - ys1) * dYs) / lengths2
+    return strengths, xs1 + ks * dXs - minimumDistance * dYs / lengths, ys1 + ks * dYs + minimumDistance * dXs / lengths
+
+  def __destination(self, p0, p1, p2):
+    minimumDistance = self._settings._almostDeficiencyRatioOfTypicalDistance * self._settings._typicalDistance
+    p = Cartesian.projectToLine(p0, p1, p2)
+    return Cartesian.pointWithDistanceToLine(p, p1, p2, distance=minimumDistance)
 
   def _value(self, cell, cell1, cell2):
-    Cartesian.orientedAltitude(cell.point(), cell1.point(), cell2.point())
-    if (cell._id2, cell1._id2, cell2._id2) not in self.__dataForCellCache:
-      # p0 = cell.point()
-      # p1 = cell1.point()
-      # p2 = cell2.point()
-      p0 = Point(*cell.applyForces(persist=False))
-      p1 = Point(*cell1.applyForces(persist=False))
-      p2 = Point(*cell2.applyForces(persist=False))
-      minimumDistance = self._settings._almostDeficiencyRatioOfTypicalDistance * self._settings._typicalDistance
-      altitude = Cartesian.orientedAltitude(p0, p1, p2) * self.calibrationFactor
-      strength = max(0, -altitude + minimumDistance)
-      strength = min(strength, self.maximumStrengthRatioOfTypicalDistance * self._settings._typicalDistance)
-      p = Cartesian.projectToLine(p0, p1, p2) if strength != 0 else None
-      p = Cartesian.pointWithDistanceToLine(p, p1, p2, distance=minimumDistance) if strength != 0 else None
-      self.__dataForCellCache[(cell._id2, cell1._id2, cell2._id2)] = (strength, p)
-    strength, p = self.__dataForCellCache[(cell._id2, cell1._id2, cell2._id2)]
-    return strength
+    p0 = Point(*cell.applyForces(persist=False))
+    p1 = Point(*cell1.applyForces(persist=False))
+    p2 = Point(*cell2.applyForces(persist=False))
+    minimumDistance = self._settings._almostDeficiencyRatioOfTypicalDistance * self._settings._typicalDistance
+    altitude = Cartesian.orientedAltitude(p0, p1, p2) * self.calibrationFactor
+    strength = max(0, -altitude + minimumDistance)
+    return min(strength, self.maximumStrengthRatioOfTypicalDistance * self._settings._typicalDistance)
@@ -1,3 +1,7 @@
+import numpy as np
+
+from src.mechanics.forces import Forces
+from src.mechanics.potential.potential import Potential
 from src.mechanics.potential.potentialArea import PotentialArea
 from src.mechanics.potential.potentialDistance import PotentialDistance
 from src.mechanics.potential.potentialDistanceHomogeneity import PotentialDistanceHomogeneity
@@ -5,4 +9,69 @@ from src.mechanics.potential.potentialShape import PotentialShape
 from src.mechanics.potential.potentialOrientation import PotentialOrientation
 from src.mechanics.potential.potentialTriangleAltitude import PotentialTriangleAltitude
 
-potentials = [PotentialArea, PotentialDistance, PotentialDistanceHomogeneity, PotentialShape, PotentialOrientation, PotentialTriangleAltitude]
+potentials = []
+# the kernels by class of potential: kernel(potential, state, topology, weights) computes the energies and forces of all cells at once (see Potential.energiesAndForces)
+# the potentials without a kernel are computed cell by cell (see Potential.energyAndForces)
+kernels = {}
+
+def registerPotential(potentialClass, kernel=None):
+  # by default, the kernel is the method energiesAndForces of the potential, if it is implemented
+  if kernel is None and potentialClass.energiesAndForces is not Potential.energiesAndForces:
+    kernel = potentialClass.energiesAndForces
+  if potentialClass not in potentials:
+    potentials.append(potentialClass)
+  if kernel is not None:
+    kernels[potentialClass] = kernel
+  else:
+    kernels.pop(potentialClass, None)
+
+def kernelForPotential(potential):
+  return kernels.get(type(potential))
+
+for potentialClass in [PotentialArea, PotentialDistance, PotentialDistanceHomogeneity, PotentialShape, PotentialOrientation, PotentialTriangleAltitude]:
+  registerPotential(potentialClass)
+
+def compareKernelWithScalar(potential, state, weights=None):
+  # computes the energies and forces with the kernel of the potential, and cell by cell, and returns the maximum differences of the energies and of the sums of the forces by cell (relative to the largest absolute values computed cell by cell)
+  # the forces are not weighted, and the forces already added to the state are considered as predicted by both computations
+  # kernels with several passes (see PotentialTriangleAltitude.iterations) are compared for the first pass, to which the computation cell by cell corresponds
+  kernel = kernelForPotential(potential)
+  if kernel is None:
+    raise Exception(f"No kernel registered for the potential {potential.kind}")
+  topology = state.topology
+  n = len(topology)
+  isIterated = hasattr(potential, 'iterations')
+  if isIterated:
+    iterations = vars(potential).get('iterations')
+    potential.iterations = 1
+  try:
+    energies, forces = kernel(potential, state, topology, weights if weights is not None else np.ones(n))
+  finally:
+    if isIterated:
+      if iterations is None:
+        del potential.iterations
+      else:
+        potential.iterations = iterations
+  cells = state.cells()
+  energiesScalar = np.zeros(n)
+  forcesScalar = []
+  for i, cell in enumerate(cells.values()):
+    energiesScalar[i], forcesCell = potential.energyAndForces(cell, [cells[id2] for id2 in cell._neighbours if id2 in cells] if cell._neighbours is not None else [])
+    forcesScalar += forcesCell
+  forcesScalar = Forces.fromForces(potential.kind, forcesScalar, topology.indexById2())
+  def _relativeDifference(values, valuesScalar):
+    return float(np.max(np.abs(values - valuesScalar), initial=0) / max(float(np.max(np.abs(valuesScalar), initial=0)), 1e-300))
+  def _sums(forces, xs):
+    return np.bincount(forces.froms, weights=xs, minlength=n)
+  return {
+    'energies': _relativeDifference(np.asarray(energies, dtype=np.float64), energiesScalar),
+    'forces': max(_relativeDifference(_sums(forces, forces.xs), _sums(forcesScalar, forcesScalar.xs)), _relativeDifference(_sums(forces, forces.ys), _sums(forcesScalar, forcesScalar.ys))),
+  }
+
+def checkKernel(potential, state, weights=None, tolerance=1e-9):
+  # raises an exception if the kernel of the potential does not agree with its computation cell by cell
+  differences = compareKernelWithScalar(potential, state, weights=weights)
+  for name, difference in differences.items():
+    if not difference <= tolerance:
+      raise Exception(f"The kernel of the potential {potential.kind} does not agree with the computation cell by cell: the {name} differ by {difference:.2e} (relative)")
+  return differences